@@ -0,0 +1,361 @@
+"""
+This file contains the benchmark suite of the Mt St Helens Project.
+
+Every benchmark runs one function on synthetic data (see synthetic.py) of all
+combinations of the given years and stations. The best wall time of several repeats
+and the peak memory traced by tracemalloc (in an extra run) are written to a JSON
+file, together with the scaling exponents of every function in the number of rows
+and of stations. With a baseline the results are compared and slower or
+larger runs are reported as regressions.
+
+Wall times are only comparable on the same machine, so every machine records its own
+baseline first. Run it from the repository root:
+    python -m benchmarks.run_benchmarks --years 1 2 5 --stations 2 10 --output baseline.json
+    python -m benchmarks.run_benchmarks --years 1 2 5 --stations 2 10 --baseline baseline.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import contextlib
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from mtsthelens import preprocessing_functions
+from mtsthelens import manipulation_functions
+from benchmarks import synthetic
+
+
+# name: (setup, function), setup(df, tmp) returns the arguments of function
+BENCHMARKS = {
+    "read_data": (
+        lambda df, tmp: (synthetic.write_csv(df, os.path.join(tmp, "data.csv")),),
+        preprocessing_functions.read_data,
+    ),
+    "mask_df": (
+        lambda df, tmp: (df,),
+        lambda df: df.apply(preprocessing_functions.mask_df, axis=0),
+    ),
+    "mask_frame": (lambda df, tmp: (df,), preprocessing_functions.mask_frame),
+    "normalize": (lambda df, tmp: (df,), preprocessing_functions.normalize),
+    "stack_in_time": (lambda df, tmp: (df,), manipulation_functions.stack_in_time),
+    "stack_in_space": (lambda df, tmp: (df,), manipulation_functions.stack_in_space),
+    "stack_space_year_param": (
+        lambda df, tmp: (df,),
+        manipulation_functions.stack_space_year_param,
+    ),
+    "station_year_param": (
+        lambda df, tmp: (df,),
+        manipulation_functions.station_year_param,
+    ),
+    "df2dict": (lambda df, tmp: (df, "year"), manipulation_functions.df2dict),
+    "filter_data": (lambda df, tmp: (df,), manipulation_functions.filter_data),
+    "remove_long_periods": (
+        lambda df, tmp: (df,),
+        manipulation_functions.remove_long_periods,
+    ),
+}
+
+# differences below these are noise and never a regression
+MIN_SECONDS = 0.005
+MIN_BYTES = 2**20
+
+# a baseline is only valid on a machine with the same metadata
+MACHINE_KEYS = ("machine", "cpus")
+
+
+def measure(function, args_list: list, repeat: int = 3):
+    """
+    Measures a function on every argument tuple of args_list (one per parameter).
+
+    Returns:
+        tuple: The best wall time in seconds and the peak traced memory in bytes.
+    """
+    seconds = []
+    # mask_df prints every station it can not mask
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for args in args_list:
+                function(*args)
+            seconds.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            for args in args_list:
+                function(*args)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return min(seconds), peak
+
+
+def run(
+    functions: list = None,
+    years: list = (1, 2),
+    stations: list = (2, 10),
+    parameters: list = ("DSAR",),
+    nan_density: float = 0.001,
+    gap_density: float = 0.01,
+    repeat: int = 3,
+    verbose: bool = True,
+):
+    """
+    Runs the benchmarks on all combinations of years and stations.
+
+    Returns:
+        list: One dict per (function, years, stations) with 'seconds' and 'peak_bytes'.
+    """
+    functions = list(BENCHMARKS) if functions is None else functions
+    unknown = set(functions) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks {sorted(unknown)}.")
+    results = []
+    for n_years in years:
+        for n_stations in stations:
+            data = synthetic.synthetic_parameters(
+                parameters,
+                years=n_years,
+                stations=n_stations,
+                nan_density=nan_density,
+                gap_density=gap_density,
+            )
+            rows = len(next(iter(data.values())))
+            with tempfile.TemporaryDirectory() as tmp:
+                for name in functions:
+                    setup, function = BENCHMARKS[name]
+                    args_list = [
+                        setup(df, os.path.join(tmp, parameter))
+                        for parameter, df in data.items()
+                    ]
+                    seconds, peak = measure(function, args_list, repeat)
+                    results.append(
+                        {
+                            "function": name,
+                            "years": n_years,
+                            "stations": n_stations,
+                            "parameters": len(parameters),
+                            "rows": rows,
+                            "nan_density": nan_density,
+                            "gap_density": gap_density,
+                            "seconds": seconds,
+                            "peak_bytes": peak,
+                        }
+                    )
+                    if verbose:
+                        print(
+                            f"{name:24s} {n_years:3d} years {n_stations:4d} stations "
+                            f"{seconds:9.4f} s {peak / 2**20:9.1f} MiB",
+                            flush=True,
+                        )
+    return results
+
+
+def scaling(results: list):
+    """
+    The scaling exponents of every function, fitted as
+    log(seconds) = a * log(rows) + b * log(stations) + c. An exponent of 1 is linear,
+    it is only given if the runs differ in that size.
+
+    Returns:
+        dict: {'rows': a, 'stations': b} of every function.
+    """
+    df = pd.DataFrame(results)
+    exponents = {}
+    for name, group in df.groupby("function", sort=False):
+        sizes = [size for size in ("rows", "stations") if group[size].nunique() > 1]
+        if not sizes:
+            continue
+        design = np.column_stack(
+            [np.log(group[size]) for size in sizes] + [np.ones(len(group))]
+        )
+        seconds = np.log(group["seconds"].clip(lower=1e-6))
+        fit = np.linalg.lstsq(design, seconds, rcond=None)[0]
+        exponents[name] = {size: float(a) for size, a in zip(sizes, fit)}
+    return exponents
+
+
+def _key(result: dict):
+    return tuple(
+        result[key]
+        for key in (
+            "function",
+            "years",
+            "stations",
+            "parameters",
+            "nan_density",
+            "gap_density",
+        )
+    )
+
+
+def _machine(meta: dict = None):
+    """The metadata of meta (default: this machine) which a baseline has to match."""
+    if meta is None:
+        meta = {"machine": platform.platform(), "cpus": os.cpu_count()}
+    return {key: meta.get(key) for key in MACHINE_KEYS}
+
+
+def compare(
+    results: list,
+    baseline: list,
+    tolerance: float = 1.5,
+    meta: dict = None,
+    baseline_meta: dict = None,
+):
+    """
+    Compares results with a baseline.
+
+    A run is a regression if it is more than 'tolerance' times slower or uses more
+    than 'tolerance' times the memory of the same run in the baseline (and the
+    difference is above MIN_SECONDS or MIN_BYTES).
+
+    Args:
+        results (list): The results of run.
+        baseline (list): The results of the baseline.
+        tolerance (float, optional): Allowed factor. Defaults to 1.5.
+        meta (dict, optional): The metadata of the results. Defaults to None, which
+            uses this machine.
+        baseline_meta (dict, optional): The metadata of the baseline. Defaults to
+            None, which skips the check of the machine.
+
+    Returns:
+        list: One dict per run in both results with the ratios and 'regression'.
+
+    Raises:
+        ValueError: If the baseline was recorded on a different machine (platform or
+            number of CPUs).
+    """
+    if baseline_meta is not None and _machine(meta) != _machine(baseline_meta):
+        raise ValueError(
+            f"The baseline was recorded on {_machine(baseline_meta)}, not on "
+            f"{_machine(meta)}. Wall times are only comparable on the same machine, "
+            "record a baseline on this machine with --output."
+        )
+    reference = {_key(result): result for result in baseline}
+    comparison = []
+    for result in results:
+        old = reference.get(_key(result))
+        if old is None:
+            continue
+        time_ratio = result["seconds"] / max(old["seconds"], 1e-9)
+        memory_ratio = result["peak_bytes"] / max(old["peak_bytes"], 1)
+        slower = (
+            time_ratio > tolerance and result["seconds"] - old["seconds"] > MIN_SECONDS
+        )
+        larger = (
+            memory_ratio > tolerance
+            and result["peak_bytes"] - old["peak_bytes"] > MIN_BYTES
+        )
+        comparison.append(
+            {
+                "function": result["function"],
+                "years": result["years"],
+                "stations": result["stations"],
+                "time_ratio": time_ratio,
+                "memory_ratio": memory_ratio,
+                "regression": bool(slower or larger),
+            }
+        )
+    return comparison
+
+
+def plot_scaling(results: list, path_file: str):
+    """Plots the wall time of every function over the number of values (log-log)."""
+    import matplotlib.pyplot as plt
+
+    df = pd.DataFrame(results)
+    df["values"] = df["rows"] * df["stations"] * df["parameters"]
+    fig, ax = plt.subplots(figsize=(8, 6))
+    for name, group in df.groupby("function", sort=False):
+        group = group.groupby("values")["seconds"].min()
+        ax.loglog(group.index, group.values, marker="o", label=name)
+    ax.set_xlabel("Number of values")
+    ax.set_ylabel("Wall time (s)")
+    ax.legend(fontsize="small")
+    fig.savefig(path_file)
+    plt.close(fig)
+    return path_file
+
+
+def main(argv: list = None):
+    """Entry point, see the module docstring."""
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the mtsthelens package."
+    )
+    parser.add_argument("--functions", nargs="+", choices=list(BENCHMARKS))
+    parser.add_argument("--years", nargs="+", type=int, default=[1, 2])
+    parser.add_argument("--stations", nargs="+", type=int, default=[2, 10])
+    parser.add_argument("--parameters", nargs="+", default=["DSAR"])
+    parser.add_argument("--nan-density", type=float, default=0.001)
+    parser.add_argument("--gap-density", type=float, default=0.01)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="compare with this results file")
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    parser.add_argument("--plot", help="save the scaling curves as image")
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.functions,
+        args.years,
+        args.stations,
+        args.parameters,
+        args.nan_density,
+        args.gap_density,
+        args.repeat,
+    )
+    report = {
+        "meta": {
+            "created": pd.Timestamp.now().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "scaling": scaling(results),
+        "results": results,
+    }
+    for name, exponents in report["scaling"].items():
+        text = ", ".join(f"{size}^{a:.2f}" for size, a in exponents.items())
+        print(f"{name:24s} scales with {text}")
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        try:
+            report["comparison"] = compare(
+                results,
+                baseline["results"],
+                args.tolerance,
+                report["meta"],
+                baseline.get("meta", {}),
+            )
+        except ValueError as error:
+            print(error)
+            return 2
+        for row in report["comparison"]:
+            if row["regression"]:
+                exit_code = 1
+                print(
+                    f"REGRESSION {row['function']} {row['years']} years "
+                    f"{row['stations']} stations: {row['time_ratio']:.2f}x time, "
+                    f"{row['memory_ratio']:.2f}x memory"
+                )
+        if not exit_code:
+            print(f"No regressions against {args.baseline}.")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    if args.plot:
+        plot_scaling(results, args.plot)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,96 @@
+"""
+This file contains the deterministic synthetic data generator of the benchmarks.
+
+The data look like the preprocessed seismic parameters of the project: a 10 minute
+grid, one column per station, a seasonal (yearly) and a daily cycle, log-normal
+noise, eruption spikes which decay over a few days, and gaps (missing days) and
+single missing values.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+
+def synthetic_data(
+    years: int = 1,
+    stations: int = 2,
+    nan_density: float = 0.001,
+    gap_density: float = 0.01,
+    spikes_per_year: float = 2,
+    start: str = "2004-01-01",
+    seed: int = 0,
+):
+    """
+    Creates one synthetic (time x station) parameter on a 10 minute grid.
+
+    Args:
+        years (int, optional): Length of the time series in years. Defaults to 1.
+        stations (int, optional): Number of stations. Defaults to 2.
+        nan_density (float, optional): Fraction of single missing values.
+            Defaults to 0.001.
+        gap_density (float, optional): Fraction of days which are missing completely.
+            Defaults to 0.01.
+        spikes_per_year (float, optional): Mean number of eruption spikes per station
+            and year. Defaults to 2.
+        start (str, optional): The first time. Defaults to '2004-01-01'.
+        seed (int, optional): Seed of the random numbers, the same arguments always
+            give the same data. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: The data with a DatetimeIndex and the stations 'STA000', ...
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.date_range(
+        start, pd.Timestamp(start) + pd.DateOffset(years=years), freq="10min"
+    )[:-1]
+    n = len(index)
+    day = (index - index[0]).total_seconds().to_numpy() / 86400
+
+    level = rng.uniform(0.5, 2, stations)
+    season = rng.uniform(0.1, 0.3, stations) * np.cos(
+        2 * np.pi * (day[:, None] / 365.25 - rng.uniform(0, 1, stations))
+    )
+    daily = 0.05 * np.cos(2 * np.pi * day[:, None])
+    noise = rng.lognormal(0, 0.1, (n, stations))
+    values = level * (1 + season + daily) * noise
+
+    # eruption spikes: a fast rise and an exponential decay over a few days
+    for j in range(stations):
+        for onset in rng.integers(0, n, rng.poisson(spikes_per_year * years)):
+            length = min(n - onset, 144 * 10)
+            decay = np.exp(-np.arange(length) / rng.uniform(72, 432))
+            values[onset : onset + length, j] += rng.uniform(2, 10) * level[j] * decay
+
+    # missing days and single missing values
+    n_days = -(-n // 144)
+    missing_days = rng.random((n_days, stations)) < gap_density
+    values[np.repeat(missing_days, 144, axis=0)[:n]] = np.nan
+    values[rng.random((n, stations)) < nan_density] = np.nan
+
+    columns = [f"STA{j:03d}" for j in range(stations)]
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
+def synthetic_parameters(parameters=("DSAR",), seed: int = 0, **kwargs):
+    """
+    Creates several synthetic parameters, see synthetic_data for the kwargs.
+
+    Returns:
+        dict: The DataFrame of every parameter.
+    """
+    return {
+        parameter: synthetic_data(seed=seed + i, **kwargs)
+        for i, parameter in enumerate(parameters)
+    }
+
+
+def write_csv(df: pd.DataFrame, path_file: str):
+    """Writes data in the CSV format of read_data (UTC 'time' column)."""
+    directory = os.path.dirname(path_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    df = df.copy()
+    df.index = df.index.tz_localize("UTC")
+    df.index.name = "time"
+    df.to_csv(path_file)
+    return path_file
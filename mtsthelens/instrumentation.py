@@ -0,0 +1,219 @@
+"""
+This file contains the opt-in instrumentation of the Mt St Helens Project.
+
+The public functions of the preprocessing, manipulation and plotting modules are
+decorated with instrument. As long as no profile is active the decorator only checks
+one flag. Inside 'with profile() as report:' every call records its wall time, CPU
+time, peak traced memory (tracemalloc) and the shapes of its inputs and outputs.
+Calls of functions in worker processes (parallel_apply, animation, the pipeline) are
+not recorded.
+
+Example:
+    >>> with profile() as report:
+    ...     df = read_data('data.csv')
+    ...     filtered = filter_data(df)
+    >>> report.summary()
+    >>> report.to_json('profile.json')
+    >>> report.to_flamegraph('profile.folded')
+"""
+import json
+import time
+import threading
+import functools
+import tracemalloc
+import contextlib
+import pandas as pd
+
+_ENABLED = False
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+_REPORTS = []
+
+
+def _shape(value):
+    """The shape of DataFrames, arrays and StationArrays, the shapes of tuples."""
+    if hasattr(value, "shape"):
+        return list(value.shape)
+    if isinstance(value, (tuple, list)) and value and len(value) <= 8:
+        shapes = [_shape(item) for item in value]
+        if any(shape is not None for shape in shapes):
+            return shapes
+    if isinstance(value, dict):
+        return {"len": len(value)}
+    return None
+
+
+def _stack():
+    if not hasattr(_LOCAL, "stack"):
+        _LOCAL.stack = []
+    return _LOCAL.stack
+
+
+def _call(func, args, kwargs):
+    """Runs func and records the call in all active reports."""
+    stack = _stack()
+    # the peak so far belongs to the calls which are running, the peak of this call
+    # starts at the current memory
+    current, peak = tracemalloc.get_traced_memory()
+    for frame in stack:
+        frame["peak"] = max(frame["peak"], peak)
+    tracemalloc.reset_peak()
+    frame = {"peak": current, "start_memory": current}
+    stack.append(frame)
+    path = ";".join([entry["name"] for entry in stack[:-1]] + [func.__qualname__])
+    frame["name"] = func.__qualname__
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        stack.pop()
+        _, peak = tracemalloc.get_traced_memory()
+        frame["peak"] = max(frame["peak"], peak)
+        for parent in stack:
+            parent["peak"] = max(parent["peak"], peak)
+    record = {
+        "function": f"{func.__module__.rsplit('.', 1)[-1]}.{func.__qualname__}",
+        "stack": path,
+        "depth": len(stack),
+        "wall_time": wall,
+        "cpu_time": cpu,
+        "peak_memory": frame["peak"] - frame["start_memory"],
+        "input_shapes": [_shape(arg) for arg in args]
+        + [_shape(value) for value in kwargs.values()],
+        "output_shape": _shape(result),
+    }
+    with _LOCK:
+        for report in _REPORTS:
+            report.records.append(record)
+    return result
+
+
+def instrument(func):
+    """
+    Decorator which records the calls of func while a profile is active.
+
+    Without an active profile the overhead is one check of a flag.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _ENABLED:
+            return func(*args, **kwargs)
+        return _call(func, args, kwargs)
+
+    return wrapper
+
+
+class Report:
+    """
+    The calls recorded in a profile.
+
+    Attributes:
+        records (list): One dict per call with 'function', 'stack' (the instrumented
+            callers separated by ';'), 'depth', 'wall_time' and 'cpu_time' in seconds,
+            'peak_memory' in bytes above the memory at the start of the call,
+            'input_shapes' and 'output_shape'.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def to_frame(self):
+        """The records as DataFrame, in the order the calls finished."""
+        return pd.DataFrame(
+            self.records,
+            columns=[
+                "function",
+                "stack",
+                "depth",
+                "wall_time",
+                "cpu_time",
+                "peak_memory",
+                "input_shapes",
+                "output_shape",
+            ],
+        )
+
+    def summary(self):
+        """
+        The calls, total and maximum wall time, total CPU time and the maximum peak
+        memory of every function, sorted by the total wall time.
+        """
+        df = self.to_frame()
+        summary = df.groupby("function").agg(
+            calls=("wall_time", "size"),
+            wall_time=("wall_time", "sum"),
+            max_wall_time=("wall_time", "max"),
+            cpu_time=("cpu_time", "sum"),
+            peak_memory=("peak_memory", "max"),
+        )
+        return summary.sort_values("wall_time", ascending=False)
+
+    def to_json(self, path_file: str = None):
+        """
+        Exports the records as JSON.
+
+        Args:
+            path_file (str, optional): The file. Defaults to None, which returns the
+                JSON as str.
+        """
+        text = json.dumps({"records": self.records}, indent=2)
+        if path_file is None:
+            return text
+        with open(path_file, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path_file
+
+    def to_flamegraph(self, path_file: str = None):
+        """
+        Exports the self time of every call stack in the folded format of
+        flamegraph.pl and speedscope ('a;b;c <microseconds>' per line).
+
+        Args:
+            path_file (str, optional): The file. Defaults to None, which returns the
+                lines as str.
+        """
+        total, children = {}, {}
+        for record in self.records:
+            stack = record["stack"]
+            total[stack] = total.get(stack, 0) + record["wall_time"]
+            parent = stack.rpartition(";")[0]
+            if ";" in stack:
+                children[parent] = children.get(parent, 0) + record["wall_time"]
+        lines = [
+            f"{stack} {max(int(round((wall - children.get(stack, 0)) * 1e6)), 0)}"
+            for stack, wall in total.items()
+        ]
+        text = "\n".join(lines) + "\n"
+        if path_file is None:
+            return text
+        with open(path_file, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path_file
+
+
+@contextlib.contextmanager
+def profile():
+    """
+    Records the calls of all instrumented functions inside the with block.
+
+    Yields:
+        Report: The report, which is filled while the block runs.
+    """
+    global _ENABLED
+    report = Report()
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    with _LOCK:
+        _REPORTS.append(report)
+        _ENABLED = True
+    try:
+        yield report
+    finally:
+        with _LOCK:
+            _REPORTS.remove(report)
+            _ENABLED = bool(_REPORTS)
+        if started:
+            tracemalloc.stop()
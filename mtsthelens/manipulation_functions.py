@@ -2,77 +2,928 @@
 This file is for manipulation functuions for the Mt St Helens Project
 """
 import numpy as np
-from scipy.signal import butter, lfilter, freqz
+from scipy.signal import butter, sosfilt, sosfiltfilt, sosfreqz
 import pandas as pd
 import matplotlib.pyplot as plt
 import datetime
+import functools
+import os
 import sys
+import warnings
+from collections.abc import Iterator, Mapping
+
+from .station_array import StationArray
+from .parameter_cube import ParameterCube
+from .instrumentation import instrument
+from .preprocessing_functions import read_data_chunks
 
 
 sys.path.append("../CSE583_MtStHelens")
 
+# number of rows which are processed at once for row wise operations on a StationArray
+_BLOCK_ROWS = 2**16
+
+
+def _out_path(out_path: str = None, name: str = None):
+    """Returns the directory of an output StationArray or None to keep it in memory."""
+    if out_path is None:
+        return None
+    return os.path.join(out_path, name)
+
+
+@functools.lru_cache(maxsize=None)
+def _butter_sos(order: int, cutoff, fs: float, btype: str = "low"):
+    """
+    Returns the second order sections of a digital Butterworth filter. The
+    coefficients are cached, so each filter is only designed once (do not modify them).
+    """
+    return butter(order, cutoff, fs=fs, btype=btype, analog=False, output="sos")
+
+
+def _nan_segments(values: np.ndarray):
+    """
+    Finds the contiguous non NaN segments of every column of a 2D array.
+
+    Returns:
+        tuple: The start row, end row (exclusive) and column of every segment.
+    """
+    edges = np.diff((~np.isnan(values)).astype(np.int8), axis=0, prepend=0, append=0).T
+    column, start = np.nonzero(edges == 1)
+    _, end = np.nonzero(edges == -1)
+    return start, end, column
+
+
+def _filter_segments(values: np.ndarray, sos: np.ndarray, zero_phase: bool = True):
+    """
+    Filters every contiguous non NaN segment of every column of a 2D (time x station)
+    array on its own, NaNs stay NaN. Segments with the same start and end in several
+    columns (e.g. the whole series if there are no gaps) are filtered in one call.
+    """
+    filtered = np.full(values.shape, np.nan)
+    start, end, column = _nan_segments(values)
+    keys = start * (values.shape[0] + 1) + end
+    order = np.argsort(keys, kind="stable")
+    start, end, column, keys = start[order], end[order], column[order], keys[order]
+    # default padding of sosfiltfilt, shortened for short segments
+    padlen = 3 * (
+        2 * len(sos) + 1 - min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+    )
+
+    bounds = np.flatnonzero(np.diff(keys, prepend=-1))
+    for first, last in zip(bounds, np.append(bounds[1:], len(keys))):
+        i, j, columns = start[first], end[first], column[first:last]
+        segment = values[i:j, columns]
+        if zero_phase:
+            filtered[i:j, columns] = sosfiltfilt(
+                sos, segment, axis=0, padlen=min(padlen, j - i - 1)
+            )
+        else:
+            filtered[i:j, columns] = sosfilt(sos, segment, axis=0)
+    return filtered
+
+
+@instrument
+def filter_data(
+    stack,
+    out_path: str = None,
+    order: int = 5,
+    cutoff=0.025,
+    fs: float = 30,
+    btype: str = "low",
+    zero_phase: bool = True,
+    plot: bool = False,
+):
+    """
+    Applies a Butterworth filter (by default a low pass filter) to every column of the stack.
+
+    The filter coefficients are designed once per (order, cutoff, fs, btype) as second
+    order sections and cached. By default the filter is applied forward and backward
+    (sosfiltfilt), so the filtered data has no phase shift. All columns are filtered
+    together along the time axis. Gaps (NaNs) are not filled: each contiguous non NaN
+    segment is filtered on its own and NaNs stay NaN.
+
+    Args:
+        stack (pd.DataFrame or StationArray): The (time x station) data.
+        out_path (str, optional): Only used for a StationArray input. Directory in which
+            the filtered array is preallocated as memmap ('<out_path>/filtered').
+            Defaults to None, which keeps the result in memory.
+        order (int, optional): Order of the Butterworth filter. Defaults to 5.
+        cutoff (float or tuple, optional): Cutoff frequency, a (low, high) tuple for
+            'bandpass' and 'bandstop'. Defaults to 0.025.
+        fs (float, optional): Sampling rate. Defaults to 30.
+        btype (str, optional): 'low', 'high', 'bandpass' or 'bandstop'. Defaults to 'low'.
+        zero_phase (bool, optional): Filter forward and backward. With False the data
+            is only filtered forward (causal, with phase shift). Defaults to True.
+        plot (bool, optional): Plot the frequency response of the filter with
+            matplotlib. Defaults to False.
+
+    Returns:
+        pd.DataFrame or StationArray: The filtered data, same type as the input.
+    """
+    if isinstance(cutoff, list):
+        cutoff = tuple(cutoff)
+    sos = _butter_sos(order, cutoff, fs, btype)
+
+    if plot:
+        w, h = sosfreqz(sos, fs=fs, worN=8000)  # Frequency response
+        plt.plot()
+        plt.plot(w, np.abs(h), "b")
+        # one marker and line per cutoff, band filters have two
+        cutoffs = np.atleast_1d(cutoff)
+        plt.plot(cutoffs, np.full(cutoffs.size, 0.5 * np.sqrt(2)), "o")
+        for frequency in cutoffs:
+            plt.axvline(frequency)
+        plt.xlim(0, 1)
+        plt.xlabel("Frequency")
+
+    if isinstance(stack, StationArray):
+        filt_stack = StationArray.empty(
+            stack.time, stack.stations, _out_path(out_path, "filtered"), stack.dtype
+        )
+        for j in range(stack.shape[1]):
+            column = np.asarray(stack.values[:, [j]], dtype=np.float64)
+            filt_stack.values[:, j] = _filter_segments(column, sos, zero_phase)[:, 0]
+        filt_stack.flush()
+        return filt_stack
+
+    values = stack.to_numpy(dtype=np.float64, na_value=np.nan)
+    if values.ndim == 1:
+        filtered = _filter_segments(values[:, np.newaxis], sos, zero_phase)[:, 0]
+        return pd.Series(filtered, index=stack.index, name=stack.name)
+    return pd.DataFrame(
+        _filter_segments(values, sos, zero_phase),
+        index=stack.index,
+        columns=stack.columns,
+    )
+
+
+def _block_sums(sums: np.ndarray, counts: np.ndarray, factor: int):
+    """Sums blocks of 'factor' rows of (time x station) sums and counts."""
+    pad = -len(sums) % factor
+    if pad:
+        sums = np.concatenate([sums, np.zeros((pad, sums.shape[1]))])
+        counts = np.concatenate([counts, np.zeros((pad, counts.shape[1]))])
+    shape = (len(sums) // factor, factor, sums.shape[1])
+    return sums.reshape(shape).sum(axis=1), counts.reshape(shape).sum(axis=1)
+
+
+@instrument
+def remove_long_periods(
+    stack,
+    period="365D",
+    order: int = 4,
+    stage_factor: int = 8,
+    nyquist_margin: float = 10,
+    return_trend: bool = False,
+):
+    """
+    Removes periods longer than 'period' (by default one year) from every column of
+    the stack with a multirate high pass filter.
+
+    A Butterworth high pass with a cutoff of about 1/52560 samples (one year of 10
+    minute data) is numerically unstable and slow. Instead the data is decimated in
+    stages of 'stage_factor' (NaN aware block means) until the cutoff is at most
+    1/nyquist_margin of the Nyquist frequency, the long period trend is computed
+    there with a zero phase low pass filter, linearly interpolated back to the
+    original time axis and subtracted. All stations are filtered together.
+
+    Args:
+        stack (pd.DataFrame or pd.Series): The (time x station) data on a regular
+            DatetimeIndex.
+        period (str or pd.Timedelta, optional): Shortest period which is removed.
+            Defaults to '365D'.
+        order (int, optional): Order of the Butterworth low pass filter at the
+            coarse rate. Defaults to 4.
+        stage_factor (int, optional): Decimation factor of every stage. Defaults to 8.
+        nyquist_margin (float, optional): Decimation stops before the cutoff exceeds
+            1/nyquist_margin of the coarse Nyquist frequency. Defaults to 10.
+        return_trend (bool, optional): Return the removed trend as well. Defaults
+            to False.
+
+    Returns:
+        pd.DataFrame or pd.Series: The high pass filtered data, same type as the
+            input (and the trend if return_trend is True). NaNs stay NaN.
+
+    Raises:
+        TypeError: If stack is neither a pd.DataFrame nor a pd.Series.
+        ValueError: If the index is not a DatetimeIndex with at least two rows or
+            the stages do not decimate.
+    """
+    if not isinstance(stack, (pd.DataFrame, pd.Series)):
+        raise TypeError("Input must be a pd.DataFrame or pd.Series.")
+    if not isinstance(stack.index, pd.DatetimeIndex) or len(stack) < 2:
+        raise ValueError("The index must be a DatetimeIndex with at least two rows.")
+    if stage_factor < 2:
+        raise ValueError("stage_factor must be at least 2.")
+
+    values = stack.to_numpy(dtype=np.float64, na_value=np.nan)
+    if values.ndim == 1:
+        values = values[:, np.newaxis]
+    n = len(values)
+
+    # cutoff in cycles per sample
+    step = np.median(np.diff(stack.index.asi8))
+    cutoff = step / pd.Timedelta(period).value
+
+    valid = ~np.isnan(values)
+    sums, counts = np.where(valid, values, 0), valid.astype(np.float64)
+    factor = 1
+    while (
+        cutoff * factor * stage_factor <= 0.5 / nyquist_margin
+        and n // (factor * stage_factor) >= 2
+    ):
+        sums, counts = _block_sums(sums, counts, stage_factor)
+        factor *= stage_factor
+    with np.errstate(invalid="ignore", divide="ignore"):
+        coarse = sums / counts
+
+    # fill empty blocks, the trend is smooth on this scale
+    positions = np.arange(len(coarse))
+    for j in range(coarse.shape[1]):
+        filled = ~np.isnan(coarse[:, j])
+        if filled.any() and not filled.all():
+            coarse[:, j] = np.interp(positions, positions[filled], coarse[filled, j])
+
+    sos = _butter_sos(order, 2 * cutoff * factor, 2, "low")
+    trend = _filter_segments(coarse, sos)
+
+    # back to the original time axis, block means sit at the block centers
+    position = (np.arange(n) - (factor - 1) / 2) / factor
+    position = np.clip(position, 0, len(trend) - 1)
+    first = np.minimum(position.astype(np.int64), len(trend) - 1)
+    second = np.minimum(first + 1, len(trend) - 1)
+    weight = (position - first)[:, np.newaxis]
+    trend = (1 - weight) * trend[first] + weight * trend[second]
+
+    filtered = values - trend
+    if isinstance(stack, pd.Series):
+        filtered = pd.Series(filtered[:, 0], index=stack.index, name=stack.name)
+        trend = pd.Series(trend[:, 0], index=stack.index, name=stack.name)
+    else:
+        filtered = pd.DataFrame(filtered, index=stack.index, columns=stack.columns)
+        trend = pd.DataFrame(trend, index=stack.index, columns=stack.columns)
+    if return_trend:
+        return filtered, trend
+    return filtered
+
+
+class StreamingFilter:
+    """
+    Causal Butterworth filter for data which arrives in chunks, e.g. from
+    preprocessing_functions.read_data_chunks or a live feed.
+
+    The filter is designed like in filter_data and the filter state (zi) of every
+    station is kept between the chunks. Filtering the chunks one after the other gives
+    the same result as filter_data(concatenated_chunks, zero_phase=False), while the
+    memory and the cost per update only depend on the chunk size. Like in filter_data
+    NaNs stay NaN and the filter starts again from rest after a gap.
+
+    Args:
+        order (int, optional): Order of the Butterworth filter. Defaults to 5.
+        cutoff (float or tuple, optional): Cutoff frequency. Defaults to 0.025.
+        fs (float, optional): Sampling rate. Defaults to 30.
+        btype (str, optional): 'low', 'high', 'bandpass' or 'bandstop'. Defaults to 'low'.
+    Example:
+        >>> streaming_filter = StreamingFilter()
+        >>> for chunk in read_data_chunks('data.csv', chunksize=10000):
+        ...     filtered_chunk = streaming_filter.update(chunk)
+    """
+
+    def __init__(self, order: int = 5, cutoff=0.025, fs: float = 30, btype="low"):
+        if isinstance(cutoff, list):
+            cutoff = tuple(cutoff)
+        self.sos = _butter_sos(order, cutoff, fs, btype)
+        self.stations = []
+        self.zi = np.zeros((len(self.sos), 2, 0))
+
+    def reset(self):
+        """Sets the filter state of all stations back to rest."""
+        self.zi[:] = 0
+
+    def _columns(self, columns):
+        """Returns the positions of the stations, unknown stations start at rest."""
+        new = [col for col in columns if col not in self.stations]
+        if new:
+            self.stations += new
+            self.zi = np.pad(self.zi, ((0, 0), (0, 0), (0, len(new))))
+        return [self.stations.index(col) for col in columns]
+
+    @instrument
+    def update(self, chunk):
+        """
+        Filters the next chunk of data.
 
-def filter_data(stack):
-    def lowpass(cutoff, fs, order=5):
-        return butter(
-            order, cutoff, fs=fs, btype="low", analog=False
-        )  # returns coefficients of transfer function of the low pass filter
+        Args:
+            chunk (pd.DataFrame or pd.Series): The next (time x station) rows, the
+                stations are matched by column name (or Series name).
 
-    def lowp_filter(data, cutoff, fs, order=5):
-        b, a = lowpass(cutoff, fs, order=order)
-        return lfilter(b, a, data)
+        Returns:
+            pd.DataFrame or pd.Series: The filtered chunk.
 
-    filt_stack = stack.copy()
-    order = 5
-    fs = 30  # sampling rate
-    cutoff = 0.025  # cutoff frequency
+        Raises:
+            TypeError: If chunk is neither a pd.DataFrame nor a pd.Series.
+        """
+        if not isinstance(chunk, (pd.DataFrame, pd.Series)):
+            raise TypeError("Input must be a pd.DataFrame or pd.Series.")
+        if isinstance(chunk, pd.Series):
+            filtered = self.update(chunk.to_frame()).iloc[:, 0]
+            filtered.name = chunk.name
+            return filtered
 
-    b, a = lowpass(cutoff, fs, order)
-    w, h = freqz(b, a, fs=fs, worN=8000)  # Frequency response
-    plt.plot()
-    plt.plot(w, np.abs(h), "b")
-    plt.plot(cutoff, 0.5 * np.sqrt(2))
-    plt.axvline(cutoff)
-    plt.xlim(0, 1)
-    plt.xlabel("Frequency")
+        positions = np.array(self._columns(list(chunk.columns)), dtype=np.int64)
+        values = chunk.to_numpy(dtype=np.float64, na_value=np.nan)
+        filtered = np.full(values.shape, np.nan)
+        has_nan = np.isnan(values).any(axis=0)
 
-    for column in stack.columns:
-        data = stack[column]
-        filt = lowp_filter(data, cutoff, fs, order)
-        filt_stack[column] = filt
+        # stations without gaps in this chunk are filtered together
+        complete = np.flatnonzero(~has_nan)
+        if len(complete) and len(values):
+            filtered[:, complete], self.zi[:, :, positions[complete]] = sosfilt(
+                self.sos,
+                values[:, complete],
+                axis=0,
+                zi=self.zi[:, :, positions[complete]],
+            )
 
-    return filt_stack
+        # the others segment by segment, a segment after a gap starts at rest
+        for j in np.flatnonzero(has_nan):
+            c = positions[j]
+            start, end, _ = _nan_segments(values[:, [j]])
+            for i, k in zip(start, end):
+                zi = self.zi[:, :, c] if i == 0 else np.zeros((len(self.sos), 2))
+                filtered[i:k, j], zf = sosfilt(self.sos, values[i:k, j], zi=zi)
+                self.zi[:, :, c] = zf
+            if np.isnan(values[-1, j]):
+                self.zi[:, :, c] = 0
 
+        return pd.DataFrame(filtered, index=chunk.index, columns=chunk.columns)
 
-def stack_in_time(df):
+
+# number of minute slots in a (leap) year, the slot of year is the minute of the year
+# in a leap year calendar, so the same date has the same slot in every year
+_N_SLOTS = 366 * 24 * 60
+_LEAP_DAY_OPTIONS = ("keep", "feb28", "drop")
+
+
+def _slot_of_year(time: pd.DatetimeIndex, leap_day: str = "keep"):
+    """
+    Computes the integer slot of year (minute of the year in a leap year calendar)
+    of every timestamp. Seconds are ignored.
+
+    Args:
+        time (pd.DatetimeIndex): The timestamps.
+        leap_day (str, optional): How the 29th February is handled
+            - 'keep': The 29th February has its own slots.
+            - 'feb28': The 29th February is stacked with the 28th February.
+            - 'drop': The 29th February gets the slot -1.
+            Defaults to 'keep'.
+
+    Returns:
+        np.ndarray: The slot of every timestamp as int64.
+
+    Raises:
+        ValueError: If leap_day is not one of 'keep', 'feb28' or 'drop'.
+    """
+    if leap_day not in _LEAP_DAY_OPTIONS:
+        raise ValueError(
+            f"Invalid value for 'leap_day'. Use one of {', '.join(_LEAP_DAY_OPTIONS)}."
+        )
+    day = time.dayofyear.to_numpy().astype(np.int64) - 1
+    leap = np.asarray(time.is_leap_year)
+    # skip the 29th February (day 59 of a leap year) in the other years
+    day = day + (~leap & (day >= 59))
+    slots = (day * 1440 + time.hour.to_numpy() * 60 + time.minute.to_numpy()).astype(
+        np.int64
+    )
+    feb29 = leap & (day == 59)
+    if leap_day == "feb28":
+        slots[feb29] -= 1440
+    elif leap_day == "drop":
+        slots[feb29] = -1
+    return slots
+
+
+def _seasonal_groups(time: pd.DatetimeIndex, leap_day: str = "keep"):
+    """
+    Groups timestamps by their slot of year.
+
+    Returns:
+        keep (np.ndarray): Boolean mask of the timestamps which are stacked.
+        slot_time (pd.DatetimeIndex): The occupied slots as timestamps in the year 2000.
+        inverse (np.ndarray): The group of every kept timestamp.
+    """
+    slots = _slot_of_year(time, leap_day)
+    keep = slots >= 0
+    occupied = np.bincount(slots[keep], minlength=_N_SLOTS) > 0
+    inverse = (np.cumsum(occupied) - 1)[slots[keep]]
+    slot_time = pd.DatetimeIndex(
+        np.datetime64("2000-01-01", "ns")
+        + np.flatnonzero(occupied).astype("timedelta64[m]")
+    )
+    return keep, slot_time, inverse
+
+
+def _grouped_nanmean(column: np.ndarray, inverse: np.ndarray, n_groups: int):
+    """Mean of the non NaN values of each group, NaN for groups without values."""
+    valid = ~np.isnan(column)
+    sums = np.bincount(inverse[valid], weights=column[valid], minlength=n_groups)
+    counts = np.bincount(inverse[valid], minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+class ChunkedFrame:
+    """
+    A (time x station) DataFrame which is read as a sequence of row chunks, the
+    out-of-core input (and output) of stack_in_time and stack_in_space.
+
+    The chunks come from a function which returns a new iterator of DataFrames every
+    time it is called, e.g. a call of preprocessing_functions.read_data_chunks, so the
+    data can be passed over several times while only one chunk is held in memory. All
+    chunks have the same columns and together the rows of the whole DataFrame.
+
+    Args:
+        chunks (callable or list): Function without arguments which returns an
+            iterator of DataFrames, or a list of DataFrames.
+
+    Raises:
+        TypeError: If chunks is neither callable nor a list or tuple. A generator can
+            only be read once, pass the function which creates it instead.
+    Example:
+        >>> chunks = ChunkedFrame.from_csv('data.csv', chunksize=500000)
+        >>> seasonal, no_seasonal = stack_in_time(chunks)
+        >>> for chunk in no_seasonal:
+        ...     df_stat = stack_space_year_param(chunk)
+    """
+
+    def __init__(self, chunks):
+        if callable(chunks):
+            self._chunks = chunks
+        elif isinstance(chunks, (list, tuple)):
+            self._chunks = lambda: iter(chunks)
+        else:
+            raise TypeError(
+                "chunks must be a list of DataFrames or a function which returns an "
+                "iterator of DataFrames."
+            )
+
+    @classmethod
+    def from_csv(
+        cls,
+        path_file: str,
+        cols=None,
+        chunksize: int = 100000,
+        start=None,
+        end=None,
+        cache_dir: str = None,
+    ):
+        """The chunks of a CSV file, see preprocessing_functions.read_data_chunks."""
+        return cls(
+            lambda: read_data_chunks(
+                path_file, cols, chunksize, start=start, end=end, cache_dir=cache_dir
+            )
+        )
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, chunksize: int = 100000):
+        """Splits a DataFrame into chunks of at most chunksize rows (views, not copies)."""
+        if not isinstance(chunksize, int) or chunksize <= 0:
+            raise ValueError("chunksize must be a positive integer.")
+        return cls([df.iloc[i : i + chunksize] for i in range(0, len(df), chunksize)])
+
+    def __iter__(self):
+        for chunk in self._chunks():
+            if isinstance(chunk, pd.Series):
+                chunk = chunk.to_frame()
+            if not isinstance(chunk, pd.DataFrame):
+                raise TypeError("The chunks must be pandas DataFrames.")
+            if len(chunk):
+                yield chunk
+
+    def map(self, func):
+        """Applies func to every chunk when the result is iterated."""
+        return ChunkedFrame(lambda: (func(chunk) for chunk in self))
+
+    def to_frame(self):
+        """Concatenates all chunks into one DataFrame."""
+        return pd.concat(list(self))
+
+    def __repr__(self):
+        return f"ChunkedFrame({self._chunks!r})"
+
+
+def _iter_chunks(chunks):
+    """
+    Iterates over the chunks and checks that all of them have the same columns.
+
+    Raises:
+        ValueError: If there are no chunks or the columns of a chunk differ.
+    """
+    columns = None
+    for chunk in chunks:
+        if isinstance(chunk, pd.Series):
+            chunk = chunk.to_frame()
+        if not isinstance(chunk, pd.DataFrame):
+            raise TypeError("The chunks must be pandas DataFrames.")
+        if not len(chunk):
+            continue
+        if columns is None:
+            columns = chunk.columns
+        elif not chunk.columns.equals(columns):
+            raise ValueError("All chunks must have the same columns.")
+        yield chunk
+    if columns is None:
+        raise ValueError("There are no chunks with data.")
+
+
+@instrument
+def stack_in_time(df, out_path: str = None, leap_day: str = "keep"):
     """
     Name: Stacking in Time\
     What it does: Analyses data over multiple years to find the average seasonality data,\
             and removes the seasonality trends from the data
     Input: pandas dataframe of the reformatted time series data\
+            or a StationArray, in which case out_path is the directory for the\
+            preallocated 'seasonal' and 'no_seasonal' output memmaps\
+            leap_day: 'keep' stacks the 29th February on its own (default),\
+            'feb28' stacks it with the 28th February and 'drop' removes it\
+            or a ChunkedFrame (or list of DataFrame chunks) which is read twice,\
+            in which case the data with seasonality removed is a ChunkedFrame as well\
+            or a ParameterCube, in which case all parameters are stacked in one call\
+            (one parameter after the other) and the outputs have (parameter, station)\
+            columns\
     Output: Average seasonality of each station, data from each station with seasonality removed\
+    The seasonality is the NaN ignoring mean of every minute of the year (slot of year)\
+    over all years. The slots are integer codes computed from the index, the means are\
+    reduced with bincount and subtracted by indexing with the slot of every row.\
     """
-    grouped_data = df.groupby(
-        [df.index.month, df.index.day, df.index.hour, df.index.minute]
-    )
-    seasonal_data = grouped_data.mean()
-    seasonal_data.index = pd.to_datetime(
-        seasonal_data.index.map(
-            lambda x: f"2000-{x[0]:02d}-{x[1]:02d} {x[2]:02d}:{x[3]:02d}:00"
+    if isinstance(df, StationArray):
+        return _stack_in_time_array(df, out_path, leap_day)
+    if isinstance(df, (ChunkedFrame, list, tuple)):
+        return _stack_in_time_chunks(df, leap_day)
+    if isinstance(df, Iterator):
+        raise TypeError(
+            "stack_in_time reads the chunks twice, pass a ChunkedFrame instead of an "
+            "iterator."
         )
+    if isinstance(df, ParameterCube):
+        return _stack_cube_in_time(df, leap_day)
+
+    keep, slot_time, inverse = _seasonal_groups(df.index, leap_day)
+    if keep.all():
+        values = df.to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+    else:
+        values = df.to_numpy(dtype=np.float64, na_value=np.nan)[keep]
+
+    seasonal = np.empty((len(slot_time), df.shape[1]))
+    for j in range(df.shape[1]):
+        seasonal[:, j] = _grouped_nanmean(values[:, j], inverse, len(slot_time))
+        values[:, j] -= seasonal[inverse, j]
+
+    seasonal_data = pd.DataFrame(seasonal, index=slot_time, columns=df.columns)
+    data_no_seasonal = pd.DataFrame(values, index=df.index[keep], columns=df.columns)
+
+    return seasonal_data, data_no_seasonal
+
+
+def _stack_in_time_array(
+    array: StationArray, out_path: str = None, leap_day: str = "keep"
+):
+    """
+    stack_in_time for a StationArray. The seasonal mean is computed station by station,
+    so only one column of the input is held in memory at a time.
+    """
+    keep, slot_time, inverse = _seasonal_groups(pd.DatetimeIndex(array.time), leap_day)
+
+    seasonal_data = StationArray.empty(
+        slot_time, array.stations, _out_path(out_path, "seasonal"), array.dtype
     )
+    data_no_seasonal = StationArray.empty(
+        array.time[keep],
+        array.stations,
+        _out_path(out_path, "no_seasonal"),
+        array.dtype,
+    )
+    for j in range(array.shape[1]):
+        column = np.asarray(array.values[:, j], dtype=np.float64)[keep]
+        mean = _grouped_nanmean(column, inverse, len(slot_time))
+        seasonal_data.values[:, j] = mean
+        data_no_seasonal.values[:, j] = column - mean[inverse]
+    seasonal_data.flush()
+    data_no_seasonal.flush()
+    return seasonal_data, data_no_seasonal
 
-    data_no_seasonal = df.copy()
-    modified_index = pd.to_datetime(
-        df.index.map(
-            lambda x: f"2000-{x.month:02d}-{x.day:02d} {x.hour:02d}:{x.minute:02d}:00"
-        )
+
+def _stack_in_time_chunks(chunks, leap_day: str = "keep"):
+    """
+    stack_in_time for a ChunkedFrame. The first pass reduces every chunk to the sums
+    and counts of its occupied slots of year and adds them to the partial sums of all
+    chunks so far, the second pass (when the result is iterated) subtracts the
+    seasonality chunk by chunk. Only the (slot x station) sums and one chunk are held
+    in memory.
+    """
+    if not isinstance(chunks, ChunkedFrame):
+        chunks = ChunkedFrame(chunks)
+    _slot_of_year(pd.DatetimeIndex([]), leap_day)
+
+    # sorted occupied slots and their (slot x station) sums and counts
+    slots = np.empty(0, dtype=np.int64)
+    sums = counts = None
+    for chunk in _iter_chunks(chunks):
+        chunk_slots = _slot_of_year(chunk.index, leap_day)
+        keep = chunk_slots >= 0
+        chunk_slots, inverse = np.unique(chunk_slots[keep], return_inverse=True)
+        values = chunk.to_numpy(dtype=np.float64, na_value=np.nan)[keep]
+        chunk_sums = np.empty((len(chunk_slots), values.shape[1]))
+        chunk_counts = np.empty((len(chunk_slots), values.shape[1]), dtype=np.int64)
+        for j in range(values.shape[1]):
+            valid = ~np.isnan(values[:, j])
+            chunk_sums[:, j] = np.bincount(
+                inverse[valid], weights=values[valid, j], minlength=len(chunk_slots)
+            )
+            chunk_counts[:, j] = np.bincount(inverse[valid], minlength=len(chunk_slots))
+
+        if sums is None:
+            slots, sums, counts = chunk_slots, chunk_sums, chunk_counts
+            columns = chunk.columns
+            continue
+        if not np.isin(chunk_slots, slots, assume_unique=True).all():
+            merged = np.union1d(slots, chunk_slots)
+            position = np.searchsorted(merged, slots)
+            sums_merged = np.zeros((len(merged), sums.shape[1]))
+            counts_merged = np.zeros((len(merged), sums.shape[1]), dtype=np.int64)
+            sums_merged[position] = sums
+            counts_merged[position] = counts
+            slots, sums, counts = merged, sums_merged, counts_merged
+        position = np.searchsorted(slots, chunk_slots)
+        sums[position] += chunk_sums
+        counts[position] += chunk_counts
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        seasonal = sums / counts
+    seasonal_data = pd.DataFrame(
+        seasonal,
+        index=pd.DatetimeIndex(
+            np.datetime64("2000-01-01", "ns") + slots.astype("timedelta64[m]")
+        ),
+        columns=columns,
     )
-    data_no_seasonal = data_no_seasonal - seasonal_data.loc[modified_index].values
 
+    def remove_seasonal(chunk):
+        chunk_slots = _slot_of_year(chunk.index, leap_day)
+        keep = chunk_slots >= 0
+        values = chunk.to_numpy(dtype=np.float64, na_value=np.nan, copy=True)[keep]
+        values -= seasonal[np.searchsorted(slots, chunk_slots[keep])]
+        return pd.DataFrame(values, index=chunk.index[keep], columns=chunk.columns)
+
+    return seasonal_data, ChunkedFrame(
+        lambda: (remove_seasonal(chunk) for chunk in _iter_chunks(chunks))
+    )
+
+
+def _stack_cube_in_time(cube: ParameterCube, leap_day: str = "keep"):
+    """
+    stack_in_time for a ParameterCube. The parameters are derived and stacked one at a
+    time and written into the preallocated (time x parameter x station) results, so
+    besides the results only one parameter is held in memory.
+    """
+    parameters = _cube_parameters(cube)
+    shape = (len(parameters), len(cube.stations))
+    for k, name in enumerate(parameters):
+        seasonal, no_seasonal = stack_in_time(cube[name], leap_day=leap_day)
+        if k == 0:
+            seasonal_values = np.empty((len(seasonal),) + shape)
+            no_seasonal_values = np.empty((len(no_seasonal),) + shape)
+        seasonal_values[:, k] = seasonal.to_numpy()
+        no_seasonal_values[:, k] = no_seasonal.to_numpy()
+
+    columns = pd.MultiIndex.from_product([parameters, cube.stations])
+    seasonal_data = pd.DataFrame(
+        seasonal_values.reshape(len(seasonal), -1),
+        index=seasonal.index,
+        columns=columns,
+    )
+    data_no_seasonal = pd.DataFrame(
+        no_seasonal_values.reshape(len(no_seasonal), -1),
+        index=no_seasonal.index,
+        columns=columns,
+    )
     return seasonal_data, data_no_seasonal
 
 
+class SeasonalClimatology:
+    """
+    Incrementally updated seasonality of each station, the same average seasonality as
+    stack_in_time computes, but without going over the whole history again.
+
+    For each station and slot of the year the running sum and count of the non NaN
+    values are kept, and optionally the sum of squared deviations (M2) to get the
+    variance. New data is added with update(), which returns the new rows with the
+    seasonality removed, so the cost of an update only depends on the new data. The
+    state can be saved to and loaded from a .npz file. For the same input a single
+    update gives exactly the output of stack_in_time.
+
+    Args:
+        slot_minutes (int, optional): Width of the slots of the year in minutes, the
+            timestamps have to lie on this grid. Defaults to 10.
+        leap_day (str, optional): Handling of the 29th February, see stack_in_time.
+            Defaults to 'keep'.
+        variance (bool, optional): Also track M2 for the variance. Defaults to False.
+
+    Raises:
+        ValueError: If 1440 is not a multiple of slot_minutes.
+        ValueError: If leap_day is not one of 'keep', 'feb28' or 'drop'.
+    Example:
+        >>> climatology = SeasonalClimatology()
+        >>> data_no_seasonal = climatology.update(history)
+        >>> climatology.save('climatology.npz')
+        >>> climatology = SeasonalClimatology.load('climatology.npz')
+        >>> new_no_seasonal = climatology.update(new_week)
+    """
+
+    def __init__(
+        self, slot_minutes: int = 10, leap_day: str = "keep", variance: bool = False
+    ):
+        if (
+            not isinstance(slot_minutes, int)
+            or slot_minutes <= 0
+            or 1440 % slot_minutes
+        ):
+            raise ValueError("slot_minutes must be a positive divisor of 1440.")
+        if leap_day not in _LEAP_DAY_OPTIONS:
+            raise ValueError(
+                f"Invalid value for 'leap_day'. Use one of {', '.join(_LEAP_DAY_OPTIONS)}."
+            )
+        self.slot_minutes = slot_minutes
+        self.leap_day = leap_day
+        self.stations = []
+        n_slots = _N_SLOTS // slot_minutes
+        self.rows = np.zeros(n_slots, dtype=np.int64)
+        self.sums = np.zeros((n_slots, 0))
+        self.counts = np.zeros((n_slots, 0), dtype=np.int64)
+        self.m2 = np.zeros((n_slots, 0)) if variance else None
+
+    def _slots(self, index: pd.DatetimeIndex):
+        """Returns the mask of the stacked rows and their slots."""
+        if not isinstance(index, pd.DatetimeIndex):
+            raise ValueError("The index of 'df' must be a DatetimeIndex.")
+        slots = _slot_of_year(index, self.leap_day)
+        keep = slots >= 0
+        slots = slots[keep]
+        if (slots % self.slot_minutes).any():
+            raise ValueError(
+                f"The timestamps must lie on a {self.slot_minutes} minute grid."
+            )
+        return keep, slots // self.slot_minutes
+
+    def _columns(self, columns):
+        """Returns the positions of the stations, unknown stations are appended."""
+        new = [str(c) for c in columns if str(c) not in self.stations]
+        if new:
+            self.stations += new
+            extend = ((0, 0), (0, len(new)))
+            self.sums = np.pad(self.sums, extend)
+            self.counts = np.pad(self.counts, extend)
+            if self.m2 is not None:
+                self.m2 = np.pad(self.m2, extend)
+        return [self.stations.index(str(c)) for c in columns]
+
+    def _mean(self, c: int):
+        """The seasonal mean of every slot of station c."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.sums[:, c] / self.counts[:, c]
+
+    @instrument
+    def update(self, df: pd.DataFrame):
+        """
+        Adds new data to the seasonality.
+
+        Args:
+            df (pd.DataFrame): The new (time x station) data with a DatetimeIndex.
+
+        Returns:
+            pd.DataFrame: The new data with the updated seasonality removed.
+
+        Raises:
+            TypeError: If df is not a pd.DataFrame.
+            ValueError: If the index is not a DatetimeIndex or not on the slot grid.
+        """
+        if not isinstance(df, pd.DataFrame):
+            raise TypeError("Input 'df' must be a pandas DataFrame.")
+        keep, slots = self._slots(df.index)
+        positions = self._columns(df.columns)
+        values = df.to_numpy(dtype=np.float64, na_value=np.nan)[keep]
+        n_slots = len(self.rows)
+
+        self.rows += np.bincount(slots, minlength=n_slots)
+        for j, c in enumerate(positions):
+            column = values[:, j]
+            valid = ~np.isnan(column)
+            sums = np.bincount(slots[valid], weights=column[valid], minlength=n_slots)
+            counts = np.bincount(slots[valid], minlength=n_slots)
+            if self.m2 is not None:
+                # combine the M2 of the batch with the M2 so far (Chan et al.)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    batch_mean = sums / counts
+                deviation = column[valid] - batch_mean[slots[valid]]
+                m2 = np.bincount(
+                    slots[valid], weights=deviation * deviation, minlength=n_slots
+                )
+                both = (counts > 0) & (self.counts[:, c] > 0)
+                delta = np.where(both, batch_mean - self._mean(c), 0)
+                total = np.maximum(self.counts[:, c] + counts, 1)
+                self.m2[:, c] += m2 + delta**2 * self.counts[:, c] * counts / total
+            self.sums[:, c] += sums
+            self.counts[:, c] += counts
+
+        for j, c in enumerate(positions):
+            values[:, j] -= self._mean(c)[slots]
+        return pd.DataFrame(values, index=df.index[keep], columns=df.columns)
+
+    def transform(self, df: pd.DataFrame):
+        """
+        Removes the current seasonality from data without updating the seasonality.
+
+        Args:
+            df (pd.DataFrame): The (time x station) data with a DatetimeIndex, all
+                stations have to be part of the seasonality.
+
+        Returns:
+            pd.DataFrame: The data with the seasonality removed.
+        """
+        if not isinstance(df, pd.DataFrame):
+            raise TypeError("Input 'df' must be a pandas DataFrame.")
+        unknown = [str(c) for c in df.columns if str(c) not in self.stations]
+        if unknown:
+            raise ValueError(f"Stations {unknown} are not part of the seasonality.")
+        keep, slots = self._slots(df.index)
+        values = df.to_numpy(dtype=np.float64, na_value=np.nan, copy=True)[keep]
+        for j, c in enumerate(self._columns(df.columns)):
+            values[:, j] -= self._mean(c)[slots]
+        return pd.DataFrame(values, index=df.index[keep], columns=df.columns)
+
+    def _slot_time(self, occupied: np.ndarray):
+        """The occupied slots as timestamps in the year 2000."""
+        return pd.DatetimeIndex(
+            np.datetime64("2000-01-01", "ns")
+            + (np.flatnonzero(occupied) * self.slot_minutes).astype("timedelta64[m]")
+        )
+
+    @property
+    def seasonal(self):
+        """The average seasonality of each station, like the first output of stack_in_time."""
+        occupied = self.rows > 0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.sums[occupied] / self.counts[occupied]
+        return pd.DataFrame(
+            mean, index=self._slot_time(occupied), columns=self.stations
+        )
+
+    @property
+    def variance(self):
+        """The variance (ddof=1) of each station and slot of the year."""
+        if self.m2 is None:
+            raise ValueError("The variance is only tracked with variance=True.")
+        occupied = self.rows > 0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            variance = self.m2[occupied] / (self.counts[occupied] - 1)
+        variance[self.counts[occupied] < 2] = np.nan
+        return pd.DataFrame(
+            variance, index=self._slot_time(occupied), columns=self.stations
+        )
+
+    def save(self, path: str):
+        """Saves the state to a .npz file."""
+        state = {
+            "slot_minutes": self.slot_minutes,
+            "leap_day": self.leap_day,
+            "stations": np.array(self.stations, dtype=str),
+            "rows": self.rows,
+            "sums": self.sums,
+            "counts": self.counts,
+        }
+        if self.m2 is not None:
+            state["m2"] = self.m2
+        np.savez(path, **state)
+
+    @classmethod
+    def load(cls, path: str):
+        """Loads a state saved with save()."""
+        with np.load(path) as state:
+            climatology = cls(
+                int(state["slot_minutes"]),
+                str(state["leap_day"]),
+                variance="m2" in state.files,
+            )
+            climatology.stations = state["stations"].tolist()
+            climatology.rows = state["rows"]
+            climatology.sums = state["sums"]
+            climatology.counts = state["counts"]
+            if climatology.m2 is not None:
+                climatology.m2 = state["m2"]
+        return climatology
+
+
 """
     For each parameter, there are two types of files, the df_stack_space and the df_yearlyParam. 
     The df_stack_space is stack(average) all the station data for each year, so there are 22 columns, and each row represents every 10 minutes of input data. 
@@ -81,7 +932,96 @@ def stack_in_time(df):
 """
 
 
-def stack_in_space(df_rsam_median):
+_SPACE_ESTIMATORS = ("mean", "median", "trimmed_mean")
+
+
+def _stack_stations(values: np.ndarray, estimator: str = "mean", trim: float = 0.1):
+    """
+    Reduces a (time x station) array over the stations, ignoring NaNs and zeros.
+
+    Args:
+        values (np.ndarray): The (time x station) values.
+        estimator (str, optional): 'mean', 'median' or 'trimmed_mean'. Defaults to 'mean'.
+        trim (float, optional): Fraction of the values which is cut off at each end
+            for the trimmed mean (rounded down per row). Defaults to 0.1.
+
+    Returns:
+        np.ndarray: One value per row, NaN for rows without data.
+    """
+    values = np.where(values != 0, values, np.nan)
+    with warnings.catch_warnings():
+        # rows without any data give NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        if estimator == "mean":
+            return np.nanmean(values, axis=1)
+        if estimator == "median":
+            return np.nanmedian(values, axis=1)
+
+        # trimmed mean: NaNs are sorted to the end of each row
+        values = np.sort(values, axis=1)
+        n_valid = np.count_nonzero(~np.isnan(values), axis=1)
+        cut = (trim * n_valid).astype(np.int64)
+        cumsum = np.zeros((values.shape[0], values.shape[1] + 1))
+        np.nancumsum(values, axis=1, out=cumsum[:, 1:])
+        rows = np.arange(values.shape[0])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (cumsum[rows, n_valid - cut] - cumsum[rows, cut]) / (
+                n_valid - 2 * cut
+            )
+
+
+def _year_table_layout(time: pd.DatetimeIndex):
+    """
+    Computes where each timestamp (without 29th February) goes in a dense
+    (year x slot of year) table.
+
+    Returns:
+        years (np.ndarray): The years, the columns of the table.
+        slot_time (pd.DatetimeIndex): The slots of year in the year 2001, the rows.
+        flat (np.ndarray): The position of every timestamp in the flattened
+            (year x slot of year) table.
+    """
+    slots = _slot_of_year(time, "drop")
+    # close the gap of the 29th February to get a 365 day calendar
+    slots = slots - 1440 * (slots >= 60 * 1440)
+    # the slot width is the sampling interval of the data
+    step = int(np.gcd.reduce(np.append(slots, 1440)))
+    n_slots = 365 * 1440 // step
+    years, year_inverse = np.unique(time.year, return_inverse=True)
+    slot_time = pd.DatetimeIndex(
+        np.datetime64("2001-01-01", "ns")
+        + (np.arange(n_slots) * step).astype("timedelta64[m]")
+    )
+    return years, slot_time, year_inverse * n_slots + slots // step
+
+
+def _where_active(values: np.ndarray, index, stations, catalog=None):
+    """The (time x station) values with NaN outside the operating periods."""
+    if catalog is None:
+        return values
+    return np.where(catalog.active_mask(index, stations), values, np.nan)
+
+
+def _stack_chunk_in_space(df: pd.DataFrame, estimator: str, trim: float, catalog=None):
+    """Removes the 29th February and stacks the rows, returns the index and the stack."""
+    index = df.index
+    keep = ~((index.month == 2) & (index.day == 29))
+    values = df.to_numpy(dtype=np.float64, na_value=np.nan)
+    if values.ndim == 1:
+        values = values[:, np.newaxis]
+    stations = [df.name] if isinstance(df, pd.Series) else df.columns
+    values = _where_active(values[keep], index[keep], stations, catalog)
+    return index[keep], _stack_stations(values, estimator, trim)
+
+
+@instrument
+def stack_in_space(
+    df_rsam_median,
+    out_path: str = None,
+    estimator: str = "mean",
+    trim: float = 0.1,
+    catalog=None,
+):
     """
     Name: Stacking in Space\
     What it does: Analyses Data accross all stations to potential\
@@ -89,60 +1029,349 @@ def stack_in_space(df_rsam_median):
     Input: .csv files of the Reformatted Time Series Data\
     Output: Average Seasonality over all stations, stacked in time series with reasonality removed.\
              Contains a column of maximum and minimum difference per year. Output to .csv file\
+    A StationArray is accepted as input as well, in which case out_path is the directory\
+    for the preallocated 'stack_space' and 'stack_space_year' output memmaps.\
+    A ChunkedFrame, a list or an iterator of DataFrame chunks (all with the same\
+    stations) is stacked chunk by chunk, only the stack is kept in memory.\
+    A ParameterCube is stacked parameter by parameter in one call, the stack has one\
+    column per parameter and the year table one column per (parameter, year).\
+    The stations are stacked with the 'mean' (default), 'median' or 'trimmed_mean'\
+    (cutting off the fraction 'trim' at each end) of each row, ignoring NaNs and zeros.\
+    With a StationCatalog (see preprocessing_functions) as 'catalog', the values of\
+    stations outside their operating periods are ignored as well.\
+    The year table has one row per slot of the year (at the sampling interval of the\
+    data, without 29th February) and one column per year, times without data are NaN.\
+    """
+    if estimator not in _SPACE_ESTIMATORS:
+        raise ValueError(
+            f"Invalid value for 'estimator'. Use one of {', '.join(_SPACE_ESTIMATORS)}."
+        )
+    if not 0 <= trim < 0.5:
+        raise ValueError("trim must be in the interval [0, 0.5).")
+    if isinstance(df_rsam_median, StationArray):
+        return _stack_in_space_array(df_rsam_median, out_path, estimator, trim, catalog)
+    if isinstance(df_rsam_median, ParameterCube):
+        return _stack_cube_in_space(df_rsam_median, estimator, trim, catalog)
+    if isinstance(df_rsam_median, (ChunkedFrame, list, tuple, Iterator)):
+        # the rows are stacked independently, so the chunks are stacked one by one
+        stacks = [
+            _stack_chunk_in_space(chunk, estimator, trim, catalog)
+            for chunk in _iter_chunks(df_rsam_median)
+        ]
+        index = stacks[0][0].append([stack[0] for stack in stacks[1:]])
+        stacked = np.concatenate([stack[1] for stack in stacks])
+    else:
+        index, stacked = _stack_chunk_in_space(df_rsam_median, estimator, trim, catalog)
+    df_median_stackSpace = pd.DataFrame({"df_rsam_median_SS": stacked}, index=index)
+
+    # brake the stack up into years
+    years, slot_time, flat = _year_table_layout(index)
+    table = np.full(len(years) * len(slot_time), np.nan)
+    table[flat] = stacked
+    df_stackSpace_year = pd.DataFrame(
+        table.reshape(len(years), len(slot_time)).T,
+        index=slot_time.strftime("%m/%d %H:%M:%S"),
+        columns=years,
+    )
+    return df_median_stackSpace, df_stackSpace_year
+
+
+def _stack_in_space_array(
+    array: StationArray,
+    out_path: str = None,
+    estimator: str = "mean",
+    trim: float = 0.1,
+    catalog=None,
+):
     """
+    stack_in_space for a StationArray. The rows are stacked block by block and written
+    into a preallocated (time x 1) array. The year table is a preallocated
+    (slot of year x year) array, whose Fortran order memory is the flat
+    (year x slot of year) table.
+    """
+    time = pd.DatetimeIndex(array.time)
     # remove the 29th February
-    df_rsam_median = df_rsam_median.loc[
-        ~((df_rsam_median.index.month == 2) & (df_rsam_median.index.day == 29))
-    ]
+    keep = np.flatnonzero(~((time.month == 2) & (time.day == 29)))
+    time = time[keep]
 
-    df_median_stackSpace = pd.DataFrame()
-    df_rsam_median_f = df_rsam_median.fillna(0)
+    df_median_stackSpace = StationArray.empty(
+        time, ["df_rsam_median_SS"], _out_path(out_path, "stack_space"), array.dtype
+    )
+    for i in range(0, len(keep), _BLOCK_ROWS):
+        rows = keep[i : i + _BLOCK_ROWS]
+        block = np.asarray(array.values[rows[0] : rows[-1] + 1])[rows - rows[0]]
+        block = _where_active(block, time[i : i + len(rows)], array.stations, catalog)
+        df_median_stackSpace.values[i : i + len(rows), 0] = _stack_stations(
+            block, estimator, trim
+        )
 
-    # stack in space
-    df_median_stackSpace["df_rsam_median_SS"] = df_rsam_median_f.apply(
-        lambda row: row[row != 0].mean(), axis=1
+    # brake the stack up into years
+    years, slot_time, flat = _year_table_layout(time)
+    df_stackSpace_year = StationArray.empty(
+        slot_time, years, _out_path(out_path, "stack_space_year"), array.dtype
     )
+    df_stackSpace_year.values.T.reshape(-1)[flat] = df_median_stackSpace.values[:, 0]
+    df_median_stackSpace.flush()
+    df_stackSpace_year.flush()
+    return df_median_stackSpace, df_stackSpace_year
+
+
+def _cube_parameters(cube: ParameterCube):
+    """The parameters of a cube, which is processed parameter by parameter."""
+    if not cube.parameters:
+        raise ValueError("The ParameterCube has no parameters selected.")
+    return cube.parameters
 
-    df_dict = df2dict(
-        df_median_stackSpace["df_rsam_median_SS"]
-    )  # brake df up into years
 
-    key_list = [key for key, value in df_dict.items()]
-    time_list = df_dict[key_list[0]].index.strftime("%m/%d %H:%M:%S").to_list()
-    df_stackSpace_year = pd.DataFrame(index=time_list, columns=key_list)
+def _stack_cube_in_space(
+    cube: ParameterCube, estimator: str = "mean", trim=0.1, catalog=None
+):
+    """
+    stack_in_space for a ParameterCube. The parameters are derived and stacked one at
+    a time, so besides the (time x parameter) stack only one parameter is held in
+    memory. The year tables of all parameters are filled with the same layout.
+    """
+    parameters = _cube_parameters(cube)
+    index = pd.DatetimeIndex(cube.time)
+    # remove the 29th February
+    keep = ~((index.month == 2) & (index.day == 29))
+    n_parameters = len(parameters)
+    stacked = np.empty((int(keep.sum()), n_parameters))
+    if catalog is not None:
+        inactive = ~catalog.active_mask(index[keep], cube.stations)
+    for k, name in enumerate(parameters):
+        values = cube.to_array([name])[keep, 0, :]
+        if catalog is not None:
+            values[inactive] = np.nan
+        stacked[:, k] = _stack_stations(values, estimator, trim)
+    df_median_stackSpace = pd.DataFrame(stacked, index=index[keep], columns=parameters)
 
-    for key, value in df_dict.items():
-        df_stackSpace_year[key] = value.to_list()
+    # brake the stacks up into years
+    years, slot_time, flat = _year_table_layout(index[keep])
+    table = np.full((n_parameters, len(years) * len(slot_time)), np.nan)
+    table[:, flat] = stacked.T
+    table = table.reshape(n_parameters, len(years), len(slot_time)).transpose(2, 0, 1)
+    df_stackSpace_year = pd.DataFrame(
+        table.reshape(len(slot_time), n_parameters * len(years)),
+        index=slot_time.strftime("%m/%d %H:%M:%S"),
+        columns=pd.MultiIndex.from_product([parameters, years]),
+    )
     return df_median_stackSpace, df_stackSpace_year
 
 
+_STATS = {
+    "max": np.nanmax,
+    "min": np.nanmin,
+    "mean": np.nanmean,
+    "median": np.nanmedian,
+    "std": lambda values, axis: np.nanstd(values, axis=axis, ddof=1),
+}
+
+
+def _stat_labels(stats, quantiles=None):
+    """Checks the requested statistics and returns the row labels of the result."""
+    unknown = [stat for stat in stats if stat not in _STATS]
+    if unknown:
+        raise ValueError(
+            f"Unknown statistics {unknown}. Use any of {', '.join(_STATS)}."
+        )
+    quantiles = [] if quantiles is None else list(quantiles)
+    if not all(0 <= q <= 1 for q in quantiles):
+        raise ValueError("Quantiles must be between 0 and 1.")
+    return list(stats) + [f"q{q:g}" for q in quantiles], quantiles
+
+
+def _column_stats(values: np.ndarray, stats, quantiles):
+    """
+    Computes the statistics of every column of a 2D array, ignoring NaNs.
+
+    Returns:
+        np.ndarray: (statistic x column) array, the quantiles follow the statistics.
+    """
+    n_rows = len(stats) + len(quantiles)
+    if values.shape[0] == 0:
+        return np.full((n_rows, values.shape[1]), np.nan)
+    with warnings.catch_warnings():
+        # columns without any data give NaN like in pandas
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        rows = [_STATS[stat](values, axis=0) for stat in stats]
+        if quantiles:
+            rows += list(np.nanquantile(values, quantiles, axis=0))
+    return np.vstack(rows).reshape(n_rows, values.shape[1])
+
+
+@instrument
 def stack_space_year_param(df_stackSpace_year):
     """
     The df_yearlyParam is the statistical outputs, like min, max, mean, etc, of each year's data, which is from each column of the input dataframe.
+    The input can also be a StationArray, which is then reduced column by column.
     """
-    df_yearlyParam = pd.DataFrame(
-        np.nan,
-        index=pd.Series(["max", "min", "mean", "median"]),
+    stats = ["max", "min", "mean", "median"]
+    if isinstance(df_stackSpace_year, StationArray):
+        df_yearlyParam = pd.DataFrame(
+            np.nan,
+            index=pd.Series(stats),
+            columns=df_stackSpace_year.stations,
+        )
+        for j, col in enumerate(df_stackSpace_year.stations):
+            column = np.asarray(df_stackSpace_year.values[:, [j]])
+            df_yearlyParam[col] = _column_stats(column, stats, [])[:, 0]
+        return df_yearlyParam
+
+    values = df_stackSpace_year.to_numpy(dtype=np.float64, na_value=np.nan)
+    return pd.DataFrame(
+        _column_stats(values, stats, []),
+        index=pd.Series(stats),
         columns=df_stackSpace_year.columns,
     )
-    for col in df_stackSpace_year.columns:
-        df_yearlyParam[col].loc["max"] = df_stackSpace_year[col].max()
-        df_yearlyParam[col].loc["min"] = df_stackSpace_year[col].min()
-        df_yearlyParam[col].loc["mean"] = df_stackSpace_year[col].mean()
-        df_yearlyParam[col].loc["median"] = df_stackSpace_year[col].median()
-    return df_yearlyParam
 
 
-def df2dict(df, group_by="year"):
+@instrument
+def station_year_param(
+    df: pd.DataFrame,
+    stats=("max", "min", "mean", "median"),
+    quantiles=None,
+    df_sta: pd.DataFrame = None,
+):
+    """
+    Computes statistics like min, max, mean, etc. of every station for every year in
+    one pass over the data, instead of calling stack_space_year_param for every
+    DataFrame of df2dict(df, 'year').
+
+    The rows are sorted by time once and the statistics of all stations of a year are
+    computed together on the (time x station) block of the year. Latitude and
+    longitude of the stations can be attached from a station table.
+
+    Args:
+        df (pd.DataFrame): The (time x station) data with a DatetimeIndex, or a
+            ParameterCube, whose parameters are processed one after the other and
+            give (parameter, station) columns.
+        stats (list, optional): Any of 'max', 'min', 'mean', 'median' and 'std'.
+            Defaults to ('max', 'min', 'mean', 'median').
+        quantiles (list, optional): Quantiles between 0 and 1, labeled as 'q<quantile>',
+            e.g. 'q0.9'. Defaults to None.
+        df_sta (pd.DataFrame, optional): Station table with the columns 'Station',
+            'latitude' and 'longitude' like sta_log_long.txt. If given, the rows
+            'latitude' and 'longitude' are added for every year. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The statistics with a (year, statistic) MultiIndex and the
+        stations as columns. result.loc[year] is the (statistic x station) table of a
+        year as returned by stack_space_year_param, and
+        result.to_numpy().reshape(n_years, n_stats, n_stations) the 3D array.
+
+    Raises:
+        TypeError: If df is not a pd.DataFrame.
+        ValueError: If the index of df is not a DatetimeIndex.
+        ValueError: If an unknown statistic or a quantile outside of [0, 1] is given.
+    Example:
+        To get the dictionary which is animated by plotting_functions.animation:
+        >>> df_stat = station_year_param(raw_data, df_sta=df_sta)
+        >>> dict_stat = {year: df_stat.loc[year] for year in df_stat.index.levels[0]}
+    """
+    if isinstance(df, ParameterCube):
+        return _cube_year_param(df, stats, quantiles, df_sta)
+    if not isinstance(df, pd.DataFrame):
+        raise TypeError("Input 'df' must be a pandas DataFrame.")
+    if not isinstance(df.index, pd.DatetimeIndex):
+        raise ValueError("The index of 'df' must be a DatetimeIndex.")
+    labels, quantiles = _stat_labels(stats, quantiles)
+    stats = list(stats)
+
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index(kind="stable")
+    values = df.to_numpy(dtype=np.float64, na_value=np.nan)
+    year = df.index.year.to_numpy()
+    # the rows of a year are contiguous in the sorted index
+    starts = np.flatnonzero(np.diff(year, prepend=-1) != 0)
+    ends = np.append(starts[1:], len(year))
+    years = year[starts]
+
+    result = np.empty((len(years), len(labels), df.shape[1]))
+    for k, (i, j) in enumerate(zip(starts, ends)):
+        result[k] = _column_stats(values[i:j], stats, quantiles)
+
+    if df_sta is not None:
+        coordinates = (
+            df_sta.drop_duplicates(subset=["Station"])
+            .set_index("Station")[["latitude", "longitude"]]
+            .reindex([str(col) for col in df.columns.get_level_values(-1)])
+            .to_numpy(dtype=np.float64)
+            .T
+        )
+        result = np.concatenate(
+            [result, np.broadcast_to(coordinates, (len(years),) + coordinates.shape)],
+            axis=1,
+        )
+        labels = labels + ["latitude", "longitude"]
+
+    return pd.DataFrame(
+        result.reshape(len(years) * len(labels), df.shape[1]),
+        index=pd.MultiIndex.from_product([years, labels]),
+        columns=df.columns,
+    )
+
+
+def _cube_year_param(
+    cube: ParameterCube, stats, quantiles=None, df_sta: pd.DataFrame = None
+):
+    """station_year_param for a ParameterCube, computed parameter by parameter."""
+    parameters = _cube_parameters(cube)
+    for k, name in enumerate(parameters):
+        df_stat = station_year_param(cube[name], stats, quantiles, df_sta)
+        if k == 0:
+            values = np.empty((len(df_stat), len(parameters), len(cube.stations)))
+        values[:, k] = df_stat.to_numpy()
+    return pd.DataFrame(
+        values.reshape(len(df_stat), -1),
+        index=df_stat.index,
+        columns=pd.MultiIndex.from_product([parameters, cube.stations]),
+    )
+
+
+class PeriodSlices(Mapping):
+    """
+    Read only mapping from periods (years, months or days) to the rows of a DataFrame
+    or Series in that period, as returned by df2dict(df, lazy=True).
+
+    Only the start and end row of every period are stored, the rows of a period are
+    sliced from the data when the period is accessed.
+    """
+
+    def __init__(self, df, keys, starts, ends):
+        self._df = df
+        self._keys = list(keys)
+        self._position = {key: i for i, key in enumerate(self._keys)}
+        self._starts = starts
+        self._ends = ends
+
+    def __getitem__(self, key):
+        i = self._position[key]
+        return self._df.iloc[self._starts[i] : self._ends[i]]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f"PeriodSlices({self._keys})"
+
+
+@instrument
+def df2dict(df, group_by="year", lazy: bool = False):
     """
     Group a DataFrame or time series by year, month, or day based on the DatetimeIndex.
 
     Args:
         df (pd.DataFrame or pd.Series): The input DataFrame or time series with a DatetimeIndex.
         group_by (str, optional): The time unit to group by. Accepted values are 'year', 'month', or 'day'. Defaults to 'year'.
+        lazy (bool, optional): Return a PeriodSlices mapping which slices a period only when it is accessed. Defaults to False.
 
     Returns:
         dict: A dictionary where keys are years, months, or days, and values are corresponding DataFrames or time series.
+        The values are slices of the (sorted) input and not copies.
 
     Raises:
         ValueError: If the 'group_by' parameter is not one of 'year', 'month', or 'day'.
@@ -157,20 +1386,29 @@ def df2dict(df, group_by="year"):
     if not isinstance(df.index, pd.DatetimeIndex):
         raise ValueError("The index of 'df' must be a DatetimeIndex.")
 
+    # integer code of the period of every row
     if group_by == "year":
-        periods = df.index.year
+        codes = df.index.year.to_numpy()
     elif group_by == "month":
-        periods = df.index.to_period("M")
+        codes = df.index.year.to_numpy() * 12 + df.index.month.to_numpy()
     elif group_by == "day":
-        periods = df.index.to_period("D")
+        codes = df.index.asi8 // (24 * 3600 * 10**9)
     else:
         raise ValueError("Invalid value for 'group_by'. Use 'year', 'month', or 'day'.")
 
-    df_dict = {}
-    unique_periods = np.unique(periods)
+    # the rows of a period have to be contiguous to be sliced
+    if len(codes) and (np.diff(codes) < 0).any():
+        order = np.argsort(codes, kind="stable")
+        df = df.iloc[order]
+        codes = codes[order]
 
-    for period in unique_periods:
-        df_period = df[periods == period]
-        df_dict[period] = df_period
+    starts = np.flatnonzero(np.diff(codes, prepend=codes[:1] - 1))
+    ends = np.append(starts[1:], len(codes))
+    if group_by == "year":
+        keys = df.index[starts].year.to_numpy()
+    else:
+        keys = df.index[starts].to_period("M" if group_by == "month" else "D")
 
-    return df_dict
+    if lazy:
+        return PeriodSlices(df, keys, starts, ends)
+    return {key: df.iloc[i:j] for key, i, j in zip(keys, starts, ends)}
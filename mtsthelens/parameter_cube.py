@@ -0,0 +1,358 @@
+"""
+This file contains the multi-parameter (parameter x time x station) cube of the
+Mt St Helens Project.
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from .preprocessing_functions import read_data
+
+# The amplitude ratios which are derived from the band amplitudes (numerator,
+# denominator). RSAM, MF and HF are the mean absolute ground velocity in the 2-5 Hz,
+# 4.5-8 Hz and 8-16 Hz band, DRSAM, DMF and DHF the same for the ground displacement.
+RATIOS = {
+    "DSAR": ("DMF", "DHF"),
+    "lDSAR": ("DRSAM", "DMF"),
+    "lhDSAR": ("DRSAM", "DHF"),
+    "VSAR": ("MF", "HF"),
+    "lhVSAR": ("RSAM", "HF"),
+}
+
+
+class ParameterCube:
+    """
+    Stores the band amplitudes of several stations as one (band x time x station)
+    array on a common time axis and derives the amplitude ratios when they are needed.
+
+    Only the bands are kept in memory or on disk, a ratio like DSAR = DMF / DHF is
+    computed by a vectorized division when it is accessed. The parameters of a cube
+    are its bands and the ratios whose bands are stored, select() restricts them. The
+    stacking functions stack_in_time, stack_in_space and station_year_param of the
+    manipulation functions accept a cube and process all selected parameters in one
+    call, the results have (parameter, station) columns. They derive and process one
+    parameter at a time, so only one parameter is held in memory as float64 besides
+    the results (which are float64 DataFrames in memory). to_frame and to_array in
+    contrast build all selected parameters at once.
+
+    Args:
+        values (np.memmap or np.ndarray): The (band x time x station) values.
+        time (array-like): The time axis.
+        stations (list): The station names.
+        bands (list): The band names.
+        ratios (dict, optional): {ratio: (numerator band, denominator band)}. Defaults
+            to None, which uses the ratios of RATIOS whose bands are stored.
+        parameters (list, optional): The bands and ratios the cube exposes. Defaults
+            to None, which exposes all bands and ratios.
+        path (str, optional): The directory the cube is stored in. Defaults to None.
+
+    Raises:
+        ValueError: If the shapes do not match, a ratio needs a band which is not
+            stored or a parameter is unknown.
+    Example:
+        >>> cube = ParameterCube.from_csv({'DMF': 'dmf.csv', 'DHF': 'dhf.csv'})
+        >>> cube['DSAR']
+        >>> seasonal, no_seasonal = stack_in_time(cube)
+        >>> seasonal['DSAR']
+    """
+
+    def __init__(
+        self,
+        values,
+        time,
+        stations,
+        bands,
+        ratios: dict = None,
+        parameters=None,
+        path: str = None,
+    ):
+        if values.ndim != 3:
+            raise ValueError("values must be a 3D (band x time x station) array.")
+        time = np.asarray(time, dtype="datetime64[ns]")
+        stations = [str(station) for station in stations]
+        bands = [str(band) for band in bands]
+        if values.shape != (len(bands), len(time), len(stations)):
+            raise ValueError(
+                f"values of shape {values.shape} do not match {len(bands)} bands, "
+                f"{len(time)} times and {len(stations)} stations."
+            )
+        if ratios is None:
+            ratios = {
+                name: bands_of_ratio
+                for name, bands_of_ratio in RATIOS.items()
+                if set(bands_of_ratio) <= set(bands)
+            }
+        for name, bands_of_ratio in ratios.items():
+            missing = [band for band in bands_of_ratio if band not in bands]
+            if missing:
+                raise ValueError(f"The bands {missing} of '{name}' are not stored.")
+            if name in bands:
+                raise ValueError(f"'{name}' is a band and a ratio.")
+        ratios = {
+            name: tuple(bands_of_ratio) for name, bands_of_ratio in ratios.items()
+        }
+        if parameters is None:
+            parameters = bands + list(ratios)
+        unknown = [
+            name for name in parameters if name not in bands and name not in ratios
+        ]
+        if unknown:
+            raise ValueError(
+                f"Unknown parameters {unknown}. Use any of {', '.join(bands + list(ratios))}."
+            )
+
+        self.values = values
+        self.time = time
+        self.stations = stations
+        self.bands = bands
+        self.ratios = ratios
+        self.parameters = list(parameters)
+        self.path = path
+
+    @classmethod
+    def empty(
+        cls,
+        bands,
+        time,
+        stations,
+        path: str = None,
+        dtype=np.float64,
+        ratios: dict = None,
+    ):
+        """
+        Preallocates a cube filled with NaN.
+
+        Args:
+            bands (list): The band names.
+            time (array-like): The time axis.
+            stations (list): The station names.
+            path (str, optional): Directory in which the values are stored as memmap.
+                Defaults to None, which keeps the values in memory.
+            dtype (np.dtype, optional): np.float32 or np.float64. Defaults to np.float64.
+            ratios (dict, optional): The ratios, see ParameterCube. Defaults to None.
+
+        Returns:
+            ParameterCube: The preallocated cube.
+
+        Raises:
+            ValueError: If dtype is neither float32 nor float64.
+        """
+        dtype = np.dtype(dtype)
+        if dtype not in (np.dtype(np.float32), np.dtype(np.float64)):
+            raise ValueError("dtype must be np.float32 or np.float64.")
+        time = np.asarray(time, dtype="datetime64[ns]")
+        bands = [str(band) for band in bands]
+        stations = [str(station) for station in stations]
+        shape = (len(bands), len(time), len(stations))
+
+        if path is None:
+            return cls(
+                np.full(shape, np.nan, dtype=dtype), time, stations, bands, ratios
+            )
+
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "time.npy"), time)
+        values = np.lib.format.open_memmap(
+            os.path.join(path, "values.npy"), mode="w+", dtype=dtype, shape=shape
+        )
+        values[:] = np.nan
+        cube = cls(values, time, stations, bands, ratios, path=path)
+        with open(os.path.join(path, "parameters.json"), "w", encoding="utf-8") as f:
+            json.dump({"bands": bands, "stations": stations, "ratios": cube.ratios}, f)
+        return cube
+
+    @classmethod
+    def open(cls, path: str, mode: str = "r"):
+        """
+        Opens a cube which was stored with ParameterCube.empty or from_frames.
+
+        Args:
+            path (str): The directory of the cube.
+            mode (str, optional): Memmap mode, 'r' or 'r+'. Defaults to 'r'.
+
+        Returns:
+            ParameterCube: The memory mapped cube.
+        """
+        values = np.load(os.path.join(path, "values.npy"), mmap_mode=mode)
+        time = np.load(os.path.join(path, "time.npy"))
+        with open(os.path.join(path, "parameters.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(
+            values, time, meta["stations"], meta["bands"], meta["ratios"], path=path
+        )
+
+    @classmethod
+    def from_frames(
+        cls, frames: dict, path: str = None, dtype=np.float64, ratios: dict = None
+    ):
+        """
+        Copies the (time x station) DataFrames of the bands into a cube. All bands are
+        aligned to the sorted union of their times and stations, missing cells are NaN.
+
+        Args:
+            frames (dict): {band: pd.DataFrame} with a DatetimeIndex.
+            path (str, optional): Directory for the memmap, see ParameterCube.empty.
+            dtype (np.dtype, optional): np.float32 or np.float64. Defaults to np.float64.
+            ratios (dict, optional): The ratios, see ParameterCube. Defaults to None.
+
+        Returns:
+            ParameterCube: The cube holding the bands.
+
+        Raises:
+            TypeError: If frames is not a dict of DataFrames.
+            ValueError: If frames is empty or an index is not a DatetimeIndex.
+        """
+        if not isinstance(frames, dict):
+            raise TypeError("Input must be a dictionary.")
+        if not frames:
+            raise ValueError("Input dictionary is empty.")
+        frames = {
+            band: df.to_frame() if isinstance(df, pd.Series) else df
+            for band, df in frames.items()
+        }
+        for band, df in frames.items():
+            if not isinstance(df, pd.DataFrame):
+                raise TypeError(
+                    f"Value associated with key '{band}' is not a DataFrame."
+                )
+            if not isinstance(df.index, pd.DatetimeIndex):
+                raise ValueError(f"The index of '{band}' must be a DatetimeIndex.")
+
+        indexes = [df.index for df in frames.values()]
+        time = indexes[0].append(indexes[1:]).unique().sort_values()
+        stations = pd.Index(
+            dict.fromkeys(str(col) for df in frames.values() for col in df.columns)
+        )
+        cube = cls.empty(frames.keys(), time, stations, path, dtype, ratios)
+        for i, df in enumerate(frames.values()):
+            rows = time.get_indexer(df.index)
+            columns = stations.get_indexer([str(col) for col in df.columns])
+            cube.values[i, rows[:, None], columns] = df.to_numpy(
+                dtype=dtype, na_value=np.nan
+            )
+        cube.flush()
+        return cube
+
+    @classmethod
+    def from_csv(
+        cls,
+        path_files: dict,
+        cols=None,
+        path: str = None,
+        dtype=np.float64,
+        ratios: dict = None,
+        cache: bool = False,
+    ):
+        """
+        Reads one CSV file per band (see preprocessing_functions.read_data) into a cube.
+
+        Args:
+            path_files (dict): {band: path of the CSV file}.
+            cols (str, int, list, optional): The stations to read from every file.
+            path (str, optional): Directory for the memmap, see ParameterCube.empty.
+            dtype (np.dtype, optional): np.float32 or np.float64. Defaults to np.float64.
+            ratios (dict, optional): The ratios, see ParameterCube. Defaults to None.
+            cache (bool, optional): Use the sidecar cache of read_data. Defaults to False.
+
+        Returns:
+            ParameterCube: The cube holding the bands.
+        """
+        frames = {
+            band: read_data(path_file, cols, cache=cache)
+            for band, path_file in path_files.items()
+        }
+        return cls.from_frames(frames, path, dtype, ratios)
+
+    def select(self, parameters):
+        """
+        Returns a cube which exposes only the given bands and ratios. The values are
+        shared, not copied.
+        """
+        if isinstance(parameters, str):
+            parameters = [parameters]
+        return ParameterCube(
+            self.values,
+            self.time,
+            self.stations,
+            self.bands,
+            self.ratios,
+            list(parameters),
+            self.path,
+        )
+
+    def to_array(self, parameters=None):
+        """
+        Returns the (time x parameter x station) values of the exposed parameters.
+        The ratios are divided band by band in float64, a zero denominator gives NaN.
+
+        Args:
+            parameters (list, optional): The parameters. Defaults to None, which
+                returns all exposed parameters.
+
+        Returns:
+            np.ndarray: The values, time is the first axis so that the array can be
+            reshaped into a (time x (parameter, station)) table without a copy.
+        """
+        parameters = self.parameters if parameters is None else list(parameters)
+        band = {name: i for i, name in enumerate(self.bands)}
+        out = np.empty((len(self.time), len(parameters), len(self.stations)))
+        for k, name in enumerate(parameters):
+            if name in band:
+                out[:, k, :] = self.values[band[name]]
+                continue
+            numerator, denominator = self.ratios[name]
+            denominator = self.values[band[denominator]]
+            out[:, k, :] = np.nan
+            np.divide(
+                self.values[band[numerator]],
+                denominator,
+                out=out[:, k, :],
+                where=denominator != 0,
+                dtype=np.float64,
+            )
+        return out
+
+    def to_frame(self, parameters=None):
+        """
+        Returns the exposed parameters as one (time x (parameter, station)) DataFrame.
+        All parameters are held in memory as float64, select() a few parameters of a
+        large cube first.
+        """
+        parameters = self.parameters if parameters is None else list(parameters)
+        values = self.to_array(parameters)
+        return pd.DataFrame(
+            values.reshape(len(self.time), -1),
+            index=pd.DatetimeIndex(self.time),
+            columns=pd.MultiIndex.from_product([parameters, self.stations]),
+        )
+
+    def __getitem__(self, name: str):
+        """The (time x station) DataFrame of a band or ratio."""
+        if name not in self.bands and name not in self.ratios:
+            raise KeyError(name)
+        return pd.DataFrame(
+            self.to_array([name])[:, 0, :],
+            index=pd.DatetimeIndex(self.time),
+            columns=self.stations,
+        )
+
+    def flush(self):
+        """Writes changes of a memory mapped cube to disk."""
+        if isinstance(self.values, np.memmap):
+            self.values.flush()
+
+    @property
+    def shape(self):
+        """The (parameter x time x station) shape of the exposed parameters."""
+        return (len(self.parameters), len(self.time), len(self.stations))
+
+    def __len__(self):
+        return len(self.time)
+
+    def __repr__(self):
+        where = "memory" if self.path is None else self.path
+        return (
+            f"ParameterCube({', '.join(self.parameters)} x {len(self.time)} times x "
+            f"{len(self.stations)} stations, {self.values.dtype}, {where})"
+        )
@@ -0,0 +1,454 @@
+"""
+This file contains the pipeline runner of the Mt St Helens Project.
+
+The processing steps of the tutorial (read_data, smoothing, masking, stacking,
+filtering and the plots) are run as stages of a DAG which is described in a JSON
+config file. Every stage is identified by a hash of its function, its parameters and
+the hashes of its inputs, and its result is stored on disk. On a re-run only stages
+whose hash changed are executed, independent stages run in parallel processes.
+
+Run it with:
+    python -m mtsthelens.pipeline config.json
+"""
+import os
+import re
+import sys
+import json
+import pickle
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import pandas as pd
+from . import preprocessing_functions
+from . import manipulation_functions
+
+
+# Stage functions, the inputs are passed positionally and the params as keywords
+def _read_data(path_file: str = None, cols=None):
+    return preprocessing_functions.read_data(path_file, cols)
+
+
+def _rolling_median(df: pd.DataFrame, window: str = "6H"):
+    return df.rolling(window, center=True).median()
+
+
+def _mask_frame(df: pd.DataFrame, window: str = "10D"):
+    return preprocessing_functions.mask_frame(df, window)[0]
+
+
+def _stack_in_time(df: pd.DataFrame, leap_day: str = "keep"):
+    return manipulation_functions.stack_in_time(df, leap_day=leap_day)
+
+
+def _stack_in_space(df: pd.DataFrame, estimator: str = "mean", trim: float = 0.1):
+    return manipulation_functions.stack_in_space(df, estimator=estimator, trim=trim)
+
+
+def _stack_space_year_param(df: pd.DataFrame):
+    return manipulation_functions.stack_space_year_param(df)
+
+
+def _filter_data(df: pd.DataFrame, **params):
+    return manipulation_functions.filter_data(df, **params)
+
+
+def _remove_long_periods(df: pd.DataFrame, **params):
+    return manipulation_functions.remove_long_periods(df, **params)
+
+
+def _save_figure(path_file: str):
+    # imported here, so the data stages do not need pygmt
+    import matplotlib.pyplot as plt
+
+    os.makedirs(os.path.dirname(path_file) or ".", exist_ok=True)
+    plt.savefig(path_file)
+    plt.close("all")
+    return path_file
+
+
+def _plot_stack_vs_raw(stack, raw_data, path_file: str = None, **params):
+    from . import plotting_functions
+
+    plotting_functions.plot_stack_vs_raw(stack, raw_data, **params)
+    return _save_figure(path_file)
+
+
+def _plot_space_params(yearly_params, path_file: str = None):
+    from . import plotting_functions
+
+    plotting_functions.plot_space_params(yearly_params)
+    return _save_figure(path_file)
+
+
+# name: (function, saves a figure)
+STAGE_FUNCTIONS = {
+    "read_data": (_read_data, False),
+    "rolling_median": (_rolling_median, False),
+    "mask_frame": (_mask_frame, False),
+    "stack_in_time": (_stack_in_time, False),
+    "stack_in_space": (_stack_in_space, False),
+    "stack_space_year_param": (_stack_space_year_param, False),
+    "filter_data": (_filter_data, False),
+    "remove_long_periods": (_remove_long_periods, False),
+    "plot_stack_vs_raw": (_plot_stack_vs_raw, True),
+    "plot_space_params": (_plot_space_params, True),
+}
+
+# The sequence of the tutorial. 'name[i]' uses the i-th item of a tuple result.
+DEFAULT_STAGES = {
+    "raw": {"function": "read_data", "inputs": [], "params": {}},
+    "smoothed": {
+        "function": "rolling_median",
+        "inputs": ["raw"],
+        "params": {"window": "6H"},
+    },
+    "masked": {"function": "mask_frame", "inputs": ["smoothed"], "params": {}},
+    "time_stack": {"function": "stack_in_time", "inputs": ["masked"], "params": {}},
+    "space_stack": {"function": "stack_in_space", "inputs": ["masked"], "params": {}},
+    "year_params": {
+        "function": "stack_space_year_param",
+        "inputs": ["space_stack[1]"],
+        "params": {},
+    },
+    "filtered": {"function": "filter_data", "inputs": ["masked"], "params": {}},
+    "plot_time_stack": {
+        "function": "plot_stack_vs_raw",
+        "inputs": ["time_stack[1]", "masked"],
+        "params": {},
+    },
+    "plot_filtered": {
+        "function": "plot_stack_vs_raw",
+        "inputs": ["filtered", "masked"],
+        "params": {},
+    },
+    "plot_space_params": {
+        "function": "plot_space_params",
+        "inputs": ["year_params"],
+        "params": {},
+    },
+}
+
+_INPUT = re.compile(r"^(?P<stage>[^\[\]]+)(\[(?P<item>\d+)\])?$")
+
+
+def _parse_input(spec: str):
+    """Splits 'stage' or 'stage[i]' into (stage, i or None)."""
+    match = _INPUT.match(spec)
+    if match is None:
+        raise ValueError(f"Invalid input '{spec}', use 'stage' or 'stage[i]'.")
+    item = match.group("item")
+    return match.group("stage"), None if item is None else int(item)
+
+
+def _code_hash():
+    """Hash of the source of the package, changed code invalidates all stages."""
+    digest = hashlib.sha1()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".py"):
+            with open(os.path.join(directory, name), "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _file_state(value):
+    """Size and modification time of a parameter which is an existing file."""
+    if isinstance(value, str) and os.path.isfile(value):
+        stat = os.stat(value)
+        return [os.path.abspath(value), stat.st_size, stat.st_mtime_ns]
+    return None
+
+
+def _run_stage(function: str, input_files: list, items: list, params: dict, out: str):
+    """Runs one stage in a worker process and stores its result in 'out'."""
+    inputs = []
+    for path_file, item in zip(input_files, items):
+        with open(path_file, "rb") as f:
+            value = pickle.load(f)
+        inputs.append(value if item is None else value[item])
+    result = STAGE_FUNCTIONS[function][0](*inputs, **params)
+    tmp = f"{out}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, out)
+    return out
+
+
+class Pipeline:
+    """
+    Runs stages as a DAG with content-hashed caching of the results on disk.
+
+    Every stage has a 'function' (a key of STAGE_FUNCTIONS), 'inputs' (names of other
+    stages, 'name[i]' selects the i-th item of a tuple result) and 'params' (keyword
+    arguments). Plot stages save their figure as '<output_dir>/<stage>.png'.
+
+    Args:
+        stages (dict): The stages by name.
+        cache_dir (str, optional): Directory of the stored results. Defaults to
+            './output/pipeline/cache'.
+        output_dir (str, optional): Directory of the figures. Defaults to
+            './output/pipeline'.
+        max_workers (int, optional): Number of processes, 1 runs the stages in this
+            process. Defaults to None, which uses all CPUs.
+
+    Raises:
+        ValueError: If a stage uses an unknown function or input or the stages
+            contain a cycle.
+
+    Example:
+        >>> pipeline = Pipeline.from_config('config.json')
+        >>> pipeline.run()
+        >>> df_filtered = pipeline.result('filtered')
+    """
+
+    def __init__(
+        self,
+        stages: dict,
+        cache_dir: str = "./output/pipeline/cache",
+        output_dir: str = "./output/pipeline",
+        max_workers: int = None,
+    ):
+        self.stages = {}
+        for name, stage in stages.items():
+            function = stage.get("function")
+            if function not in STAGE_FUNCTIONS:
+                raise ValueError(f"Stage '{name}' has the unknown function {function}.")
+            params = dict(stage.get("params") or {})
+            if STAGE_FUNCTIONS[function][1]:
+                params.setdefault("path_file", os.path.join(output_dir, f"{name}.png"))
+            self.stages[name] = {
+                "function": function,
+                "inputs": [_parse_input(spec) for spec in stage.get("inputs", [])],
+                "params": params,
+            }
+        for name, stage in self.stages.items():
+            for dependency, _ in stage["inputs"]:
+                if dependency not in self.stages:
+                    raise ValueError(
+                        f"Stage '{name}' has the unknown input {dependency}."
+                    )
+        self.order = self._topological_order()
+        self.cache_dir = cache_dir
+        self.output_dir = output_dir
+        self.max_workers = max_workers
+        self._hashes = None
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Creates a pipeline from a JSON config file (or dict).
+
+        The config can contain 'input' (the CSV file of the 'raw' stage), 'cache_dir',
+        'output_dir', 'max_workers' and 'stages'. The stages are merged into
+        DEFAULT_STAGES: the keys of a stage replace the default ones, new names add
+        stages and null removes a stage. The paths of a config file are relative to
+        the file.
+
+        Args:
+            config (str or dict): Path of the JSON file or the config itself.
+
+        Returns:
+            Pipeline: The pipeline.
+        """
+        if isinstance(config, str):
+            directory = os.path.dirname(os.path.abspath(config))
+            with open(config, "r", encoding="utf-8") as f:
+                config = json.load(f)
+            # paths in the file are relative to the file
+            for key in ("input", "cache_dir", "output_dir"):
+                if key in config:
+                    config[key] = os.path.join(directory, config[key])
+        stages = {name: dict(stage) for name, stage in DEFAULT_STAGES.items()}
+        for name, stage in config.get("stages", {}).items():
+            if stage is None:
+                stages.pop(name, None)
+            else:
+                stages[name] = {**stages.get(name, {}), **stage}
+        if "input" in config and "raw" in stages:
+            params = dict(stages["raw"].get("params") or {})
+            params["path_file"] = config["input"]
+            stages["raw"]["params"] = params
+        kwargs = {
+            key: config[key]
+            for key in ("cache_dir", "output_dir", "max_workers")
+            if key in config
+        }
+        return cls(stages, **kwargs)
+
+    def _topological_order(self):
+        """Orders the stages so every stage comes after its inputs."""
+        order, state = [], {}
+
+        def visit(name):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"The stages contain a cycle through '{name}'.")
+            state[name] = "visiting"
+            for dependency, _ in self.stages[name]["inputs"]:
+                visit(dependency)
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def hashes(self):
+        """
+        The hash of every stage: its function, its parameters (input files also by
+        size and modification time), the hashes of its inputs and the package source.
+        """
+        if self._hashes is None:
+            code = _code_hash()
+            hashes = {}
+            for name in self.order:
+                stage = self.stages[name]
+                key = {
+                    "function": stage["function"],
+                    "params": stage["params"],
+                    "files": {
+                        k: _file_state(v)
+                        for k, v in stage["params"].items()
+                        if not (k == "path_file" and self._saves_figure(name))
+                    },
+                    "inputs": [[hashes[d], item] for d, item in stage["inputs"]],
+                    "code": code,
+                }
+                text = json.dumps(key, sort_keys=True, default=str)
+                hashes[name] = hashlib.sha1(text.encode("utf-8")).hexdigest()
+            self._hashes = hashes
+        return self._hashes
+
+    def _saves_figure(self, name: str):
+        return STAGE_FUNCTIONS[self.stages[name]["function"]][1]
+
+    def _path(self, name: str):
+        return os.path.join(self.cache_dir, f"{name}-{self.hashes()[name][:16]}.pkl")
+
+    def _needed(self, targets):
+        """The targets and all stages they depend on."""
+        needed, todo = set(), list(targets)
+        while todo:
+            name = todo.pop()
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage '{name}'.")
+            if name not in needed:
+                needed.add(name)
+                todo += [dependency for dependency, _ in self.stages[name]["inputs"]]
+        return needed
+
+    def run(self, targets: list = None, force: bool = False):
+        """
+        Runs the stages whose results are not stored yet.
+
+        Args:
+            targets (list, optional): Stages to compute (with their inputs). Defaults
+                to None, which runs all stages.
+            force (bool, optional): Run the stages even if a result is stored.
+                Defaults to False.
+
+        Returns:
+            dict: 'cached' or 'run' for every stage.
+        """
+        self._hashes = None
+        needed = self._needed(self.order if targets is None else targets)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        status, pending = {}, [name for name in self.order if name in needed]
+        for name in pending:
+            if not force and os.path.exists(self._path(name)):
+                # a figure which was deleted is drawn again
+                if not self._saves_figure(name) or os.path.exists(
+                    self.stages[name]["params"]["path_file"]
+                ):
+                    status[name] = "cached"
+        pending = [name for name in pending if name not in status]
+
+        def ready(name):
+            return all(d in status for d, _ in self.stages[name]["inputs"])
+
+        def task(name):
+            stage = self.stages[name]
+            return (
+                stage["function"],
+                [self._path(dependency) for dependency, _ in stage["inputs"]],
+                [item for _, item in stage["inputs"]],
+                stage["params"],
+                self._path(name),
+            )
+
+        if self.max_workers == 1:
+            for name in pending:
+                _run_stage(*task(name))
+                status[name] = "run"
+            return status
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while pending or running:
+                for name in [name for name in pending if ready(name)]:
+                    pending.remove(name)
+                    running[executor.submit(_run_stage, *task(name))] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+                    status[running.pop(future)] = "run"
+        return status
+
+    def result(self, name: str):
+        """
+        Loads the stored result of a stage.
+
+        Raises:
+            KeyError: If the stage was not run with its current hash.
+        """
+        path = self._path(name)
+        if not os.path.exists(path):
+            raise KeyError(f"No result for stage '{name}', run the pipeline first.")
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def run(config: str, stages: list = None, force: bool = False):
+    """
+    Runs the pipeline of a JSON config file.
+
+    Args:
+        config (str): Path of the JSON config file.
+        stages (list, optional): Stages to compute (with their inputs). Defaults to
+            None, which runs all stages.
+        force (bool, optional): Run the stages even if a result is stored. Defaults
+            to False.
+
+    Returns:
+        dict: 'cached' or 'run' for every stage.
+    """
+    return Pipeline.from_config(config).run(stages, force)
+
+
+def main(argv: list = None):
+    """
+    Entry point: python -m mtsthelens.pipeline config.json [--stage NAME] [--force]
+
+    Returns:
+        int: The exit code, 0 if all stages succeeded and 1 if a stage failed.
+    """
+    parser = argparse.ArgumentParser(description="Runs the Mt St Helens pipeline.")
+    parser.add_argument("config", help="JSON config file")
+    parser.add_argument(
+        "--stage", action="append", help="only run this stage and its inputs"
+    )
+    parser.add_argument("--force", action="store_true", help="ignore stored results")
+    args = parser.parse_args(argv)
+    try:
+        status = run(args.config, args.stage, args.force)
+    except Exception as error:
+        print(f"Pipeline failed: {error!r}", file=sys.stderr)
+        return 1
+    for name, state in status.items():
+        print(f"{name}: {state}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -2,32 +2,171 @@
 This module contains plotting functions
 """
 import os
+import hashlib
+import tempfile
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 import pygmt
+import xarray as xr
 import matplotlib.pyplot as plt
+from PIL import Image
+from .instrumentation import instrument
 
 MERCATOR = "M15c"
 
+# hillshade grids by (region, resolution, radiance, relief file)
+_BASEMAP_CACHE = {}
+
+
+# Decimation for display
+_DECIMATION_METHODS = ("minmax", "lttb")
+
+
+def _minmax_indices(values: np.ndarray, n_buckets: int):
+    """
+    Positions of the minimum and maximum of every bucket of equal length, in time
+    order. A bucket without values keeps its first (NaN) position, so gaps are still
+    drawn as gaps.
+    """
+    size = -(-len(values) // n_buckets)
+    n_buckets = -(-len(values) // size)
+    padded = np.full(n_buckets * size, np.nan)
+    padded[: len(values)] = values
+    padded = padded.reshape(n_buckets, size)
+    empty = np.isnan(padded).all(axis=1)
+    low = np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1)
+    high = np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1)
+    start = np.arange(n_buckets) * size
+    low[empty], high[empty] = 0, 0
+    positions = np.column_stack(
+        [start + np.minimum(low, high), start + np.maximum(low, high)]
+    ).ravel()
+    positions = positions[positions < len(values)]
+    return positions[np.diff(positions, prepend=-1) != 0]
+
+
+def _lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int):
+    """
+    Positions selected by Largest-Triangle-Three-Buckets: the first and last point and
+    in every bucket in between the point which spans the largest triangle with the
+    point selected before and the mean of the next bucket.
+    """
+    n = len(x)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    positions = np.empty(n_out, dtype=np.int64)
+    positions[0], positions[-1] = 0, n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        first, last = edges[i], edges[i + 1]
+        next_last = edges[i + 2] if i + 2 < n_out - 1 else n
+        next_x = x[last:next_last].mean()
+        next_y = y[last:next_last].mean()
+        area = np.abs(
+            (x[previous] - next_x) * (y[first:last] - y[previous])
+            - (x[previous] - x[first:last]) * (next_y - y[previous])
+        )
+        previous = first + int(np.argmax(area))
+        positions[i + 1] = previous
+    return positions
+
+
+@instrument
+def decimate(series: pd.Series, max_points: int, method: str = "minmax"):
+    """
+    Reduces a series to at most max_points points for plotting, so the peaks stay
+    visible while the figure only draws about one point per pixel.
+
+    Methods:
+        'minmax': The minimum and maximum of max_points // 2 buckets of equal length.
+            Gaps (NaNs) stay gaps.
+        'lttb': Largest-Triangle-Three-Buckets, NaNs are dropped.
+
+    Args:
+        series (pd.Series): The data, e.g. one station of 10 minute data.
+        max_points (int): Maximum number of points.
+        method (str, optional): 'minmax' or 'lttb'. Defaults to 'minmax'.
+
+    Returns:
+        pd.Series: The decimated series. A DatetimeIndex loses its frequency, so all
+            lines of an axis are drawn on the same (irregular) time axis.
+
+    Raises:
+        ValueError: If method is unknown or max_points is smaller than 3.
+    """
+    if method not in _DECIMATION_METHODS:
+        raise ValueError(f"method must be one of {_DECIMATION_METHODS}.")
+    if max_points < 3:
+        raise ValueError("max_points must be at least 3.")
+    if isinstance(series.index, pd.DatetimeIndex) and series.index.freq is not None:
+        series = series.set_axis(pd.DatetimeIndex(series.index, freq=None))
+    if len(series) <= max_points:
+        return series
+
+    values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+    if method == "minmax":
+        return series.iloc[_minmax_indices(values, max_points // 2)]
+
+    series = series[~np.isnan(values)]
+    if len(series) <= max_points:
+        return series
+    if isinstance(series.index, pd.DatetimeIndex):
+        x = series.index.asi8.astype(np.float64)
+    else:
+        x = series.index.to_numpy(dtype=np.float64)
+    positions = _lttb_indices(x, series.to_numpy(dtype=np.float64), max_points)
+    return series.iloc[positions]
+
+
+def _display_points(fig, max_points):
+    """The number of points per line, 'auto' is the width of the figure in pixels."""
+    if max_points == "auto":
+        return int(fig.get_figwidth() * fig.dpi)
+    return max_points
+
+
+def _for_display(series: pd.Series, max_points, method: str):
+    """Decimates a series for plotting, max_points None plots all points."""
+    if max_points is None:
+        return series
+    return decimate(series, max_points, method)
+
 
 # Raw Data vs Time Stack
-def plot_stack_vs_raw(stack: pd.DataFrame, raw_data: pd.DataFrame):
+@instrument
+def plot_stack_vs_raw(
+    stack: pd.DataFrame,
+    raw_data: pd.DataFrame,
+    max_points=None,
+    method: str = "minmax",
+):
     """
     Plots stacked data with raw data for comparison
 
     Args: stack: Can be time stack with seasonality removed or filtered stack
 
+        max_points: Maximum number of points per line (see decimate), 'auto' uses
+        the width of the figure in pixels. Defaults to None, which plots all points
+
+        method: Decimation method, 'minmax' or 'lttb'
+
     Returns: An image comparing stacked data and raw data.
     """
     n_stations = stack.shape[1]
     fig, axes = plt.subplots(nrows=n_stations, ncols=1, figsize=(10, 6 * n_stations))
+    axes = np.atleast_1d(axes)
+    max_points = _display_points(fig, max_points)
     for i, col in enumerate(stack.columns):
-        stack[col].plot(ax=axes[i])
-        raw_data[col].plot(ax=axes[i], alpha=0.5)
+        _for_display(stack[col], max_points, method).plot(ax=axes[i])
+        _for_display(raw_data[col], max_points, method).plot(ax=axes[i], alpha=0.5)
         axes[i].set_title(f"Station {col}")
         axes[i].legend(["Manipulated Data", "Raw Data"])
     return
 
 
+@instrument
 def plot_space_params(yearly_params: pd.DataFrame):
     """
     Plots the minimum, maximum, mean and median value of the space stacked data for each year
@@ -48,16 +187,22 @@ def plot_space_params(yearly_params: pd.DataFrame):
 
 
 # Extrusion Rate
+@instrument
 def plot_extrusion(
     extrusion_data: pd.DataFrame,
     raw_data: pd.DataFrame,
     time_stack: pd.DataFrame,
     filtered_stack: pd.DataFrame,
+    max_points=None,
+    method: str = "minmax",
 ):
     """
     Plots and compares extrusion rate with the raw DSAR,
     time stacked DSAR and Filtered DSAR.
 
+    With max_points the raw, time stacked and filtered series are decimated to
+    max_points points per line before plotting, see decimate.
+
     Args:
         extrusion_data: Contains Date of Photography, Total Volume Change,
         Total Volume Change Rate, Extruded Lava Volume and Lava Extrusion Rate
@@ -68,6 +213,11 @@ def plot_extrusion(
 
         filtered_stack: Filtered Stack of the raw data
 
+        max_points: Maximum number of points per line, 'auto' uses the width of
+        the figure in pixels. Defaults to None, which plots all points
+
+        method: Decimation method, 'minmax' or 'lttb'
+
     Returns:
         Image that compares extrusion rate with values for raw data,
         time stacked data and filtered data
@@ -81,12 +231,20 @@ def plot_extrusion(
     vol_change_rate = extrusion_data.columns[1]
     lava_ext_rate = extrusion_data.columns[3]
     fig, axes = plt.subplots(nrows=n_stations, ncols=1, figsize=(12, 6 * n_stations))
+    axes = np.atleast_1d(axes)
+    max_points = _display_points(fig, max_points)
     for i, col in enumerate(raw_data.columns):
         ax1 = axes[i]
         ax1.set_ylabel("Values")  # Specify the value name
-        raw_data[col].plot(ax=ax1, alpha=0.4, label="Raw Data")
-        time_stack[col].plot(ax=ax1, alpha=0.6, label="Seasonality Removed Stack Data")
-        filtered_stack[col].plot(ax=ax1, label="Filtered Data")
+        _for_display(raw_data[col], max_points, method).plot(
+            ax=ax1, alpha=0.4, label="Raw Data"
+        )
+        _for_display(time_stack[col], max_points, method).plot(
+            ax=ax1, alpha=0.6, label="Seasonality Removed Stack Data"
+        )
+        _for_display(filtered_stack[col], max_points, method).plot(
+            ax=ax1, label="Filtered Data"
+        )
         ax2 = ax1.twinx()
         ax2.set_ylabel("Rate ($m^3/s$)")
         extrusion_data[vol_change_rate].plot(ax=ax2, color="black")
@@ -100,18 +258,13 @@ def plot_extrusion(
 
 
 # Animations
-def _min_max_values(read_dictionary: dict = None):
+def _stack_frames(read_dictionary: dict = None):
     """
-    Compute the minimum and maximum values for
-    each row in a dictionary of DataFrames.
-
-    Args:
-        read_dictionary (dict): A dictionary where keys are DataFrame
-        names and values are DataFrames.
+    Stacks a dictionary of DataFrames into one (frame x row x station) array. All
+    frames are aligned to the union of their rows and columns, missing cells are NaN.
 
     Returns:
-        tuple: Two DataFrames, the first containing the minimum values
-        per row, and the second containing the maximum values.
+        tuple: The keys, the rows (pd.Index) and the 3D array.
 
     Raises:
         ValueError: If the input dictionary is empty.
@@ -124,26 +277,181 @@ def _min_max_values(read_dictionary: dict = None):
     # Check if the dictionary is empty
     if not read_dictionary:
         raise ValueError("Input dictionary is empty.")
-    # Initialize lists to store min and max values for each row
-    min_values_per_row = []
-    max_values_per_row = []
-    # Loop through the DataFrames in the dictionary
     for key, df in read_dictionary.items():
         # Check if the values are DataFrames
         if not isinstance(df, pd.DataFrame):
             raise TypeError(f"Value associated with key '{key}' is not a DataFrame.")
-        # Get the min and max values for each row
-        min_values = df.min(axis=1)
-        max_values = df.max(axis=1)
-        # Append the min and max values to the lists
-        min_values_per_row.append(min_values)
-        max_values_per_row.append(max_values)
-    # Convert the lists to DataFrames
-    min_df = pd.DataFrame(min_values_per_row, index=read_dictionary.keys()).transpose()
-    max_df = pd.DataFrame(max_values_per_row, index=read_dictionary.keys()).transpose()
+    frames = list(read_dictionary.values())
+    rows = pd.Index(dict.fromkeys(row for df in frames for row in df.index))
+    columns = pd.Index(dict.fromkeys(col for df in frames for col in df.columns))
+    values = np.full((len(frames), len(rows), len(columns)), np.nan)
+    for i, df in enumerate(frames):
+        values[
+            i, rows.get_indexer(df.index)[:, None], columns.get_indexer(df.columns)
+        ] = df.to_numpy(dtype=np.float64, na_value=np.nan)
+    return list(read_dictionary.keys()), rows, values
+
+
+def _nan_extrema(values: np.ndarray, axis):
+    """NaN aware minimum and maximum along axis, all NaN slices give NaN."""
+    empty = np.isnan(values).all(axis=axis)
+    minimum = np.where(np.isnan(values), np.inf, values).min(axis=axis)
+    maximum = np.where(np.isnan(values), -np.inf, values).max(axis=axis)
+    minimum[empty], maximum[empty] = np.nan, np.nan
+    return minimum, maximum
+
+
+def _min_max_values(read_dictionary: dict = None):
+    """
+    Compute the minimum and maximum values for
+    each row in a dictionary of DataFrames.
+
+    Args:
+        read_dictionary (dict): A dictionary where keys are DataFrame
+        names and values are DataFrames.
+
+    Returns:
+        tuple: Two DataFrames, the first containing the minimum values
+        per row, and the second containing the maximum values.
+
+    Raises:
+        ValueError: If the input dictionary is empty.
+        TypeError: If the input is not a dictionary or if the values
+        in the dictionary are not DataFrames.
+    """
+    keys, rows, values = _stack_frames(read_dictionary)
+    # one reduction over the stations of all frames
+    minimum, maximum = _nan_extrema(values, axis=2)
+    min_df = pd.DataFrame(minimum.T, index=rows, columns=keys)
+    max_df = pd.DataFrame(maximum.T, index=rows, columns=keys)
     return min_df, max_df
 
 
+class RowExtrema:
+    """
+    Running minimum and maximum of every row over all stations and frames.
+
+    The extrema are updated with every new frame, so the color range and the region
+    of a long animation are known without a second pass over the data.
+
+    Attributes:
+        minimum (pd.Series): The minimum of every row.
+        maximum (pd.Series): The maximum of every row.
+        n_frames (int): The number of frames seen so far.
+
+    Example:
+        >>> extrema = RowExtrema()
+        >>> for key, df in frames():
+        ...     extrema.update({key: df})
+        >>> animation(stations_data, 'median', 'inferno', extrema=extrema)
+    """
+
+    def __init__(self):
+        self.minimum = pd.Series(dtype=np.float64)
+        self.maximum = pd.Series(dtype=np.float64)
+        self.n_frames = 0
+
+    def update(self, read_dictionary: dict):
+        """
+        Adds frames to the extrema.
+
+        Args:
+            read_dictionary (dict): The new frames, like in _min_max_values.
+
+        Returns:
+            RowExtrema: self.
+        """
+        _, rows, values = _stack_frames(read_dictionary)
+        minimum, maximum = _nan_extrema(
+            values.transpose(1, 0, 2).reshape(len(rows), -1), 1
+        )
+        self.minimum = pd.concat(
+            [self.minimum, pd.Series(minimum, index=rows)], axis=1
+        ).min(axis=1)
+        self.maximum = pd.concat(
+            [self.maximum, pd.Series(maximum, index=rows)], axis=1
+        ).max(axis=1)
+        self.n_frames += len(read_dictionary)
+        return self
+
+    def to_frame(self):
+        """The extrema as DataFrame with the columns 'minimum' and 'maximum'."""
+        return pd.DataFrame({"minimum": self.minimum, "maximum": self.maximum})
+
+
+def _basemap_key(
+    region: list, resolution: str, radiance: list, relief_file: str = None
+):
+    """
+    Returns the key of a hillshade grid in the memory cache and the name of its file
+    in the disk cache. A local relief file is identified by its path, size and
+    modification time, so a changed file is not read from the cache.
+    """
+    if relief_file is not None:
+        stat = os.stat(relief_file)
+        relief_file = (os.path.abspath(relief_file), stat.st_size, stat.st_mtime_ns)
+    key = (
+        tuple(float(i) for i in region),
+        resolution,
+        tuple(float(i) for i in radiance),
+        relief_file,
+    )
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+    return key, f"hillshade_{digest}.nc"
+
+
+@instrument
+def hillshade(
+    region: list,
+    resolution: str = "03s",
+    radiance: list = (270, 30),
+    relief_file: str = None,
+    cache_dir: str = None,
+):
+    """
+    Returns the hillshade (gradient) grid of the earth relief in a region.
+
+    The grid is computed once per (region, resolution, radiance) and kept in memory
+    and, if 'cache_dir' is given, as netCDF file, so all frames of an animation and
+    later runs reuse it instead of loading the relief and running grdgradient again.
+
+    Args:
+        region (list): [lon_min, lon_max, lat_min, lat_max] of the map.
+        resolution (str, optional): Resolution of the earth relief. Defaults to '03s'.
+        radiance (list, optional): [azimuth, elevation] of the illumination.
+            Defaults to (270, 30).
+        relief_file (str, optional): A pre-downloaded relief grid, which is cut to the
+            region instead of downloading the earth relief. Defaults to None.
+        cache_dir (str, optional): Directory of the disk cache, e.g.
+            './output/cache/basemap'. Defaults to None, which only keeps the grid
+            in memory.
+
+    Returns:
+        xr.DataArray: The hillshade grid.
+    """
+    key, file_name = _basemap_key(region, resolution, radiance, relief_file)
+    if key in _BASEMAP_CACHE:
+        return _BASEMAP_CACHE[key]
+
+    path = None if cache_dir is None else os.path.join(cache_dir, file_name)
+    if path is not None and os.path.exists(path):
+        dgrid = xr.load_dataarray(path)
+    else:
+        if relief_file is not None:
+            grid = pygmt.grdcut(grid=relief_file, region=region)
+        else:
+            grid = pygmt.datasets.load_earth_relief(
+                resolution=resolution, region=region
+            )
+        dgrid = pygmt.grdgradient(grid=grid, radiance=list(radiance))
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            dgrid.to_netcdf(path)
+    _BASEMAP_CACHE[key] = dgrid
+    return dgrid
+
+
+@instrument
 def map_plot(
     df: pd.DataFrame = None,
     color_min_max: list = None,
@@ -152,15 +460,23 @@ def map_plot(
     key: str = None,
     region: list = None,
     projection: str = "M15c",
+    resolution: str = "03s",
+    relief_file: str = None,
+    cache_dir: str = None,
+    output_directory: str = None,
 ):
     """
     Plots the map of the region required using PyGMT.
+
+    The hillshade basemap comes from hillshade, see there for resolution,
+    relief_file and cache_dir. The map is saved as '{parameter}_{key}.png' in
+    output_directory, by default './output/plot/animation/{parameter}/', and the
+    path of the file is returned.
     """
     # load base map and transfer to hillshade
     pygmt.makecpt(cmap="gray", series=[-1.5, 0.3, 0.01])
     fig = pygmt.Figure()
-    grid = pygmt.datasets.load_earth_relief(resolution="03s", region=region)
-    dgrid = pygmt.grdgradient(grid=grid, radiance=[270, 30])
+    dgrid = hillshade(region, resolution, relief_file=relief_file, cache_dir=cache_dir)
     fig.basemap(region=region, projection=projection, frame=[f"+t{key}"])
     fig.grdimage(grid=dgrid, projection=projection, cmap=True)
     # Plot markers using latitude and longitudes
@@ -173,22 +489,140 @@ def map_plot(
     )
     fig.colorbar(frame='af+l"DSAR"')
     # Save figure
-    output_directory = f"./output/plot/animation/{parameter}/"
+    if output_directory is None:
+        output_directory = f"./output/plot/animation/{parameter}/"
     # Create the output directory if it doesn't exist
     os.makedirs(output_directory, exist_ok=True)
-    fig.savefig(output_directory + f"{parameter}_{key}.png")
+    path_file = os.path.join(output_directory, f"{parameter}_{key}.png")
+    fig.savefig(path_file)
+    return path_file
+
+
+def _map_plot_frame(args):
+    """Renders one frame in a worker process, see animation."""
+    df, kwargs = args
+    return map_plot(df, **kwargs)
+
+
+@instrument
+def assemble_animation(
+    frames: list, path_file: str, duration: int = 300, loop: int = 0
+):
+    """
+    Assembles image files in the given order into an animated GIF or a MP4 video.
+
+    GIFs are written with Pillow. MP4 videos need the optional packages imageio and
+    imageio-ffmpeg, the frames are streamed one by one into the video.
+
+    Args:
+        frames (list): Paths of the frames (e.g. the .png files of map_plot).
+        path_file (str): The animation file, ending with '.gif' or '.mp4'.
+        duration (int, optional): Display time of every frame in milliseconds.
+            Defaults to 300 (like 'convert -delay 30').
+        loop (int, optional): Number of loops of a GIF, 0 loops forever.
+            Defaults to 0.
+
+    Returns:
+        str: path_file.
+
+    Raises:
+        ValueError: If there are no frames or the file type is not supported.
+        ImportError: If imageio is missing for a MP4 video.
+    """
+    if not frames:
+        raise ValueError("No frames to assemble.")
+    extension = os.path.splitext(path_file)[1].lower()
+    if extension not in (".gif", ".mp4"):
+        raise ValueError("The animation must be a '.gif' or '.mp4' file.")
+    directory = os.path.dirname(path_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if extension == ".gif":
+        # the frames after the first are decoded one by one while the GIF is written
+        first = Image.open(frames[0]).convert("RGB")
+        try:
+            first.save(
+                path_file,
+                save_all=True,
+                append_images=(
+                    Image.open(frame).convert("RGB") for frame in frames[1:]
+                ),
+                duration=duration,
+                loop=loop,
+            )
+        finally:
+            first.close()
+        return path_file
 
+    try:
+        import imageio.v2 as imageio
+    except ImportError as error:
+        raise ImportError(
+            "Writing a MP4 video needs imageio and imageio-ffmpeg "
+            "(pip install imageio imageio-ffmpeg)."
+        ) from error
+    with imageio.get_writer(path_file, fps=1000 / duration) as writer:
+        for frame in frames:
+            with Image.open(frame) as image:
+                writer.append_data(np.asarray(image.convert("RGB")))
+    return path_file
 
+
+@instrument
 def animation(
-    read_dictionary: dict = None, parameter: str = None, colormap: str = None
+    read_dictionary: dict = None,
+    parameter: str = None,
+    colormap: str = None,
+    resolution: str = "03s",
+    relief_file: str = None,
+    cache_dir: str = None,
+    output_directory: str = None,
+    output_format: str = "gif",
+    duration: int = 300,
+    max_workers: int = 1,
+    extrema=None,
 ):
     """
     Animates the data over the years on the map.
+
+    Every entry of read_dictionary is rendered as one frame with map_plot, the frames
+    share one cached hillshade basemap (see hillshade) and can be rendered in parallel
+    processes. Afterwards the frames are assembled in the order of read_dictionary
+    into '{parameter}.{output_format}' in output_directory.
+
+    Args:
+        read_dictionary (dict): The DataFrames of the frames (key = frame title).
+        parameter (str): The row which defines the color of the stations.
+        colormap (str): The GMT colormap.
+        resolution (str, optional): Resolution of the earth relief. Defaults to '03s'.
+        relief_file (str, optional): A pre-downloaded relief grid. Defaults to None.
+        cache_dir (str, optional): Directory of the basemap cache. Defaults to None,
+            in which case parallel workers share the basemap through a temporary
+            directory which is removed afterwards.
+        output_directory (str, optional): Directory of the frames and the animation.
+            Defaults to './output/plot/animation/{parameter}/'.
+        output_format (str, optional): 'gif', 'mp4' or None to only render the
+            frames. Defaults to 'gif'.
+        duration (int, optional): Display time of every frame in milliseconds.
+            Defaults to 300.
+        max_workers (int, optional): Number of processes, None uses all CPUs. The
+            workers are spawned, so a script calling animation with more than one
+            worker needs an ``if __name__ == "__main__":`` guard. Defaults to 1, which
+            renders the frames in this process.
+        extrema (RowExtrema, optional): Extrema collected while the frames were
+            computed, they define the color range and the region. Defaults to None,
+            which computes them from read_dictionary.
+
+    Returns:
+        str or list: The path of the animation, or the paths of the frames if
+            output_format is None.
     """
-    min_df, max_df = _min_max_values(read_dictionary)
-    df_min_max = pd.DataFrame(columns=["minimum", "maximum"])
-    df_min_max["minimum"] = min_df.min(axis=1)
-    df_min_max["maximum"] = max_df.max(axis=1)
+    if output_directory is None:
+        output_directory = f"./output/plot/animation/{parameter}/"
+    if extrema is None:
+        extrema = RowExtrema().update(read_dictionary)
+    df_min_max = extrema.to_frame()
     region = [
         round(df_min_max["minimum"].loc["longitude"] - 0.05, 2),
         round(df_min_max["maximum"].loc["longitude"] + 0.05, 2),
@@ -199,5 +633,58 @@ def animation(
         int(df_min_max["minimum"].loc[parameter]),
         int(df_min_max["maximum"].loc[parameter]),
     ]
-    for key, value in read_dictionary.items():
-        map_plot(value, color_min_max, colormap, parameter, key, region)
+    parallel = max_workers != 1 and len(read_dictionary) > 1
+    with contextlib.ExitStack() as stack:
+        if parallel and cache_dir is None:
+            cache_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        # compute the basemap once, the workers read it from the disk cache
+        hillshade(region, resolution, relief_file=relief_file, cache_dir=cache_dir)
+        frames = _render_frames(
+            read_dictionary,
+            max_workers if parallel else 1,
+            color_min_max=color_min_max,
+            colormap=colormap,
+            parameter=parameter,
+            region=region,
+            resolution=resolution,
+            relief_file=relief_file,
+            cache_dir=cache_dir,
+            output_directory=output_directory,
+        )
+
+    if output_format is None:
+        return frames
+    return assemble_animation(
+        frames,
+        os.path.join(output_directory, f"{parameter}.{output_format}"),
+        duration=duration,
+    )
+
+
+def _init_worker():
+    """Begins a GMT session of its own in a worker process of _render_frames."""
+    # GMT names the session after the parent process unless GMT_SESSION_NAME is set,
+    # so all workers of the pool would share one session directory (and e.g. the
+    # current CPT of makecpt)
+    os.environ["GMT_SESSION_NAME"] = str(os.getpid())
+    pygmt.session_management.begin()
+
+
+def _render_frames(read_dictionary: dict, max_workers: int = 1, **kwargs):
+    """Renders the frames of animation with map_plot, in worker processes if needed."""
+    tasks = [
+        (
+            value,
+            dict(kwargs, key=key),
+        )
+        for key, value in read_dictionary.items()
+    ]
+    if max_workers == 1:
+        return [_map_plot_frame(task) for task in tasks]
+    # forked workers would inherit the GMT state of this process
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+    ) as executor:
+        return list(executor.map(_map_plot_frame, tasks))
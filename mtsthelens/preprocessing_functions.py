@@ -1,12 +1,21 @@
 """This file contains funcions to preprocess time series."""
 # import all packages you will need
 import math
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import pandas as pd
 import numpy as np
 import scipy
 import scipy.signal
+from scipy.spatial import cKDTree
+from pandas.api.indexers import BaseIndexer
+from .instrumentation import instrument
 
 
+@instrument
 def calculate_distance(lat1, lat2, lon1, lon2):
     """
     Calculate the distance between two points on the Earth's surface using the Haversine formula.
@@ -50,6 +59,337 @@ def calculate_distance(lat1, lat2, lon1, lon2):
     return c * r
 
 
+EARTH_RADIUS_KM = 6371
+
+
+@instrument
+def haversine(lat1, lat2, lon1, lon2):
+    """
+    Array version of calculate_distance, the Args are broadcast against each other.
+
+    Args:
+        lat1 (array-like): Latitudes of the first points in degrees.
+        lat2 (array-like): Latitudes of the second points in degrees.
+        lon1 (array-like): Longitudes of the first points in degrees.
+        lon2 (array-like): Longitudes of the second points in degrees.
+
+    Returns:
+        np.ndarray: The distances in kilometers.
+    """
+    lat1, lat2, lon1, lon2 = (
+        np.radians(np.asarray(i, dtype=np.float64)) for i in (lat1, lat2, lon1, lon2)
+    )
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+@instrument
+def distance_matrix(lat, lon, lat2=None, lon2=None):
+    """
+    Calculates all pairwise distances between stations in one call.
+
+    Args:
+        lat (array-like): Latitudes of the stations in degrees.
+        lon (array-like): Longitudes of the stations in degrees.
+        lat2 (array-like, optional): Latitudes of a second set of points. Defaults
+            to None, which uses the stations themselves.
+        lon2 (array-like, optional): Longitudes of the second set of points.
+
+    Returns:
+        np.ndarray: (len(lat) x len(lat2)) distances in kilometers.
+
+    Example:
+        >>> dist = distance_matrix(df_sta.latitude, df_sta.longitude)
+    """
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    if lat2 is None:
+        lat2, lon2 = lat, lon
+    lat2, lon2 = np.asarray(lat2, dtype=np.float64), np.asarray(lon2, dtype=np.float64)
+    return haversine(lat[:, np.newaxis], lat2[np.newaxis, :], lon[:, np.newaxis], lon2)
+
+
+def _unit_vectors(lat, lon):
+    """Converts latitudes and longitudes in degrees into points on the unit sphere."""
+    lat = np.radians(np.atleast_1d(np.asarray(lat, dtype=np.float64)))
+    lon = np.radians(np.atleast_1d(np.asarray(lon, dtype=np.float64)))
+    return np.column_stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)]
+    )
+
+
+class StationIndex:
+    """
+    Spatial index of station coordinates for radius and k nearest queries.
+
+    The stations are stored as points on the unit sphere in a KD-tree. The straight
+    (chord) distance between two points on the sphere grows with the great circle
+    distance, so the tree answers great circle queries exactly. Distances are
+    returned in kilometers.
+
+    Args:
+        stations (list): The station names.
+        lat (array-like): Latitudes of the stations in degrees.
+        lon (array-like): Longitudes of the stations in degrees.
+
+    Example:
+        >>> index = StationIndex.from_frame(df_sta)
+        >>> index.within("SEP", 5)
+    """
+
+    def __init__(self, stations, lat, lon):
+        self.stations = np.asarray(stations, dtype=object)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        if not len(self.stations) == len(self.lat) == len(self.lon):
+            raise ValueError("stations, lat and lon must have the same length.")
+        self._positions = {station: i for i, station in enumerate(self.stations)}
+        self._tree = cKDTree(_unit_vectors(self.lat, self.lon))
+
+    @classmethod
+    def from_frame(cls, df_sta: pd.DataFrame):
+        """
+        Builds the index from a station table like sta_log_long.txt.
+
+        Args:
+            df_sta (pd.DataFrame): Table with the columns 'Station', 'latitude' and
+                'longitude'. Only the first row of every station is used.
+
+        Returns:
+            StationIndex: The index.
+        """
+        df_sta = df_sta.drop_duplicates(subset=["Station"])
+        return cls(df_sta["Station"], df_sta["latitude"], df_sta["longitude"])
+
+    def _point(self, point):
+        """Returns (lat, lon) of a station name or a (lat, lon) tuple."""
+        if isinstance(point, str):
+            if point not in self._positions:
+                raise KeyError(f"Unknown station {point}.")
+            i = self._positions[point]
+            return self.lat[i], self.lon[i]
+        lat, lon = point
+        return lat, lon
+
+    def distances(self, point):
+        """
+        Distances of all stations to a point, sorted from near to far.
+
+        Args:
+            point (str or tuple): A station name or a (lat, lon) tuple in degrees.
+
+        Returns:
+            pd.Series: The distances in kilometers indexed by station.
+        """
+        lat, lon = self._point(point)
+        dist = haversine(lat, self.lat, lon, self.lon)
+        return pd.Series(dist, index=self.stations, name="dist").sort_values(
+            kind="stable"
+        )
+
+    def within(self, point, radius: float):
+        """
+        All stations within 'radius' kilometers of a point, sorted from near to far.
+
+        Args:
+            point (str or tuple): A station name or a (lat, lon) tuple in degrees.
+            radius (float): The radius in kilometers.
+
+        Returns:
+            pd.Series: The distances in kilometers indexed by station.
+        """
+        lat, lon = self._point(point)
+        # chord length of the radius, a bit larger so rounding does not drop stations
+        chord = 2 * np.sin(min(radius / EARTH_RADIUS_KM, np.pi) / 2) * (1 + 1e-12)
+        found = self._tree.query_ball_point(_unit_vectors(lat, lon)[0], chord)
+        found = np.asarray(found, dtype=np.int64)
+        dist = haversine(lat, self.lat[found], lon, self.lon[found])
+        keep = dist <= radius
+        return pd.Series(
+            dist[keep], index=self.stations[found[keep]], name="dist"
+        ).sort_values(kind="stable")
+
+    def nearest(self, point, k: int = 1):
+        """
+        The k stations nearest to a point, sorted from near to far.
+
+        Args:
+            point (str or tuple): A station name or a (lat, lon) tuple in degrees.
+            k (int, optional): Number of stations, at most all stations are returned.
+                Defaults to 1.
+
+        Returns:
+            pd.Series: The distances in kilometers indexed by station.
+
+        Raises:
+            ValueError: If k is not a positive integer.
+        """
+        if not isinstance(k, (int, np.integer)) or k < 1:
+            raise ValueError("k must be a positive integer.")
+        lat, lon = self._point(point)
+        k = min(k, len(self.stations))
+        _, found = self._tree.query(_unit_vectors(lat, lon)[0], k=[*range(1, k + 1)])
+        found = np.asarray(found, dtype=np.int64)
+        dist = haversine(lat, self.lat[found], lon, self.lon[found])
+        return pd.Series(dist, index=self.stations[found], name="dist")
+
+    def __len__(self):
+        return len(self.stations)
+
+
+class StationCatalog:
+    """
+    Operating periods and coordinates of the stations from the station log
+    (sta_log_long.txt), parsed once into an interval table.
+
+    Every row of the log is one interval [StartTime, EndTime] of one station, a station
+    can have several intervals (epochs). The times are stored as datetime64[s] because
+    open ended periods are given as 2599-12-31, which does not fit into
+    datetime64[ns]. All queries are vectorized over the intervals. Passed as catalog
+    to manipulation_functions.stack_in_space, only the operating stations are stacked.
+
+    Args:
+        df_sta (pd.DataFrame): The station log with the columns 'Station',
+            'latitude', 'longitude', 'StartTime' and 'EndTime'.
+
+    Example:
+        >>> catalog = StationCatalog.from_file('./example_data/sta_log_long.txt')
+        >>> catalog.active('2004-10-01')
+        >>> df_masked = catalog.where_active(df_rsam)
+        >>> df_stack, df_stack_year = stack_in_space(df_rsam, catalog=catalog)
+    """
+
+    def __init__(self, df_sta: pd.DataFrame):
+        missing = {"Station", "latitude", "longitude", "StartTime", "EndTime"} - set(
+            df_sta.columns
+        )
+        if missing:
+            raise ValueError(f"The station log misses the columns {sorted(missing)}.")
+        df_sta = df_sta.reset_index(drop=True)
+        self.log = df_sta
+        self.station = df_sta["Station"].astype(str).to_numpy()
+        self.start = self._seconds(df_sta["StartTime"])
+        self.end = self._seconds(df_sta["EndTime"])
+        self.stations = list(dict.fromkeys(self.station))
+
+    @classmethod
+    def from_file(cls, path_file: str):
+        """Reads the '|' separated station log."""
+        return cls(pd.read_csv(path_file, sep="|", header=0))
+
+    @staticmethod
+    def _seconds(times):
+        """Converts times (str, Timestamp or datetime64) to datetime64[s]."""
+        if isinstance(times, pd.Series):
+            times = times.to_numpy()
+        times = np.asarray(times)
+        if times.dtype.kind == "M":
+            return times.astype("datetime64[s]")
+        return np.array(
+            [np.datetime64(str(time).replace(" ", "T"), "s") for time in times.ravel()],
+            dtype="datetime64[s]",
+        ).reshape(times.shape)
+
+    def _epoch(self, time):
+        return self._seconds(np.asarray([pd.Timestamp(time).to_datetime64()]))[0]
+
+    def active(self, time):
+        """
+        Stations which were operating at 'time'.
+
+        Args:
+            time (str or pd.Timestamp): The time.
+
+        Returns:
+            list: The station names in the order of the log.
+        """
+        time = self._epoch(time)
+        hit = set(self.station[(self.start <= time) & (time <= self.end)])
+        return [station for station in self.stations if station in hit]
+
+    def active_between(self, start, end):
+        """
+        Stations which were operating at some time in [start, end].
+
+        Args:
+            start (str or pd.Timestamp): Begin of the period.
+            end (str or pd.Timestamp): End of the period.
+
+        Returns:
+            list: The station names in the order of the log.
+        """
+        start, end = self._epoch(start), self._epoch(end)
+        hit = set(self.station[(self.start <= end) & (start <= self.end)])
+        return [station for station in self.stations if station in hit]
+
+    def coordinates(self, time=None):
+        """
+        Coordinates of every station, of the epoch which was active at 'time'.
+
+        Args:
+            time (str or pd.Timestamp, optional): The time. Defaults to None, which
+                returns the first epoch of every station (like drop_duplicates).
+
+        Returns:
+            pd.DataFrame: The log rows (latitude, longitude, ...) indexed by station.
+                With a time, only stations operating at that time are included, for
+                overlapping epochs the one which started last is used.
+        """
+        log = self.log.assign(_start=self.start)
+        if time is not None:
+            time = self._epoch(time)
+            log = log[(self.start <= time) & (time <= self.end)]
+            log = log.sort_values("_start", kind="stable").iloc[::-1]
+        log = log.drop_duplicates(subset=["Station"]).drop(columns="_start")
+        log = log.set_index(log["Station"].astype(str))
+        return log.reindex([s for s in self.stations if s in log.index])
+
+    def active_mask(self, index, stations):
+        """
+        Which (time, station) cells lie inside an operating period.
+
+        Args:
+            index (pd.DatetimeIndex): The sorted time axis.
+            stations (list): The station names, stations which are not in the log
+                count as always active.
+
+        Returns:
+            np.ndarray: Boolean (time x station) array.
+        """
+        times = self._seconds(np.asarray(index, dtype="datetime64[ns]"))
+        stations = [str(station) for station in stations]
+        mask = np.zeros((len(times), len(stations)), dtype=bool)
+        column = {station: j for j, station in enumerate(stations)}
+        first = np.searchsorted(times, self.start, side="left")
+        last = np.searchsorted(times, self.end, side="right")
+        for station, i, k in zip(self.station, first, last):
+            if station in column:
+                mask[i:k, column[station]] = True
+        for j, station in enumerate(stations):
+            if station not in self.stations:
+                mask[:, j] = True
+        return mask
+
+    def where_active(self, df: pd.DataFrame):
+        """
+        Sets all values of a (time x station) DataFrame outside the operating periods
+        of the stations to NaN, so the stacking functions treat them as missing.
+
+        Args:
+            df (pd.DataFrame): Data with a sorted DatetimeIndex and stations as columns.
+
+        Returns:
+            pd.DataFrame: The masked data.
+        """
+        return df.where(self.active_mask(df.index, df.columns))
+
+    def __len__(self):
+        return len(self.stations)
+
+
+@instrument
 def mask_df(row: pd.Series = None):
     """
     Masks specific regions in a time series based on detected peaks.
@@ -80,31 +420,157 @@ def mask_df(row: pd.Series = None):
     if not isinstance(row.index, pd.DatetimeIndex):
         raise ValueError("The index of 'row' must be a DatetimeIndex.")
 
-    peaks, properties = scipy.signal.find_peaks(
-        row,
-        prominence=(row.rolling("10D").median() * 100).to_numpy(),
-        distance=len(row),
-    )
+    bases = _peak_bases(row.to_numpy(), (row.rolling("10D").median() * 100).to_numpy())
     row_masked = row.copy()
-    try:
-        row_masked[
-            row_masked
-            > min(
-                row_masked.iloc[
-                    properties["left_bases"][0] : properties["right_bases"][0]
-                ]
-            )
-        ] = np.nan
-        row_masked.iloc[
-            properties["left_bases"][0] - 500 : properties["right_bases"][0] + 500
-        ] = np.nan
-    except:
+    if bases is None:
         print(f"{row} could not be masked.")
-        pass
+    else:
+        values = row_masked.to_numpy(dtype=float)
+        _apply_mask(values, bases[1], bases[2])
+        row_masked = pd.Series(values, index=row.index, name=row.name)
 
     return row_masked
 
 
+def _peak_bases(values: np.ndarray, prominence: np.ndarray):
+    """
+    Finds the highest peak of a time series whose prominence exceeds the given
+    per sample prominence threshold.
+
+    Args:
+        values (np.ndarray): The time series.
+        prominence (np.ndarray): The minimum prominence for each sample.
+
+    Returns:
+        tuple or None: The positions (peak, left_base, right_base) of the peak, or None
+        if no peak fulfills the prominence condition.
+    """
+    # with distance=len(values) only the highest peak is kept
+    peaks, properties = scipy.signal.find_peaks(
+        values,
+        prominence=prominence,
+        distance=len(values),
+    )
+    if len(peaks) == 0:
+        return None
+    return peaks[0], properties["left_bases"][0], properties["right_bases"][0]
+
+
+def _apply_mask(values: np.ndarray, left_base: int, right_base: int):
+    """
+    Masks a time series in place around a peak: every value above the minimum between
+    the bases and 500 samples left and right of the bases are set to NaN.
+    """
+    segment = values[left_base:right_base]
+    # the same result as min() on the segment, which returns NaN if it starts with NaN
+    threshold = segment[0] if np.isnan(segment[0]) else np.nanmin(segment)
+    values[values > threshold] = np.nan
+    values[left_base - 500 : right_base + 500] = np.nan
+
+
+class _SharedWindowIndexer(BaseIndexer):
+    """Rolling window indexer which returns precomputed window bounds."""
+
+    def get_window_bounds(
+        self, num_values=0, min_periods=None, center=None, closed=None, step=None
+    ):
+        return self.start, self.end
+
+
+@instrument
+def mask_frame(df: pd.DataFrame = None, window: str = "10D"):
+    """
+    Masks the peak region of every station of a DataFrame like mask_df does for a
+    single station, without applying mask_df column by column.
+
+    The bounds of the time based rolling window are computed once and shared by all
+    stations, the rolling median baselines of all stations are computed in one call
+    and the masks are applied in place to one 2D array. The masked values are identical
+    to df.apply(mask_df, axis=0). Instead of printing the stations which could not be
+    masked, a report with one row per station is returned.
+
+    Args:
+        df (pd.DataFrame): The (time x station) data with a sorted DatetimeIndex.
+        window (str, optional): Length of the rolling median window. Defaults to '10D'.
+
+    Returns:
+        df_masked (pd.DataFrame): The data with the peak regions set to NaN (float64).
+        report (pd.DataFrame): One row per station with the columns
+            - masked (bool): If a peak was found and masked.
+            - peak, left_base, right_base (pd.Timestamp): Time of the peak and its bases.
+            - n_masked (int): Number of values which were set to NaN.
+            - message (str): Why the station could not be masked, empty otherwise.
+
+    Raises:
+        TypeError: If input is not a pd.DataFrame.
+        ValueError: If the index is not a DatetimeIndex.
+        ValueError: If the index is not sorted.
+    """
+    if not isinstance(df, pd.DataFrame):
+        raise TypeError(f"Input must be a pd.DataFrame and not {type(df)}.")
+    if not isinstance(df.index, pd.DatetimeIndex):
+        raise ValueError("The index of 'df' must be a DatetimeIndex.")
+    if not df.index.is_monotonic_increasing:
+        raise ValueError("The index of 'df' must be sorted.")
+
+    # window (t - window, t] of every sample, the same bounds as rolling(window)
+    time = df.index.asi8
+    indexer = _SharedWindowIndexer(
+        start=np.searchsorted(time, time - pd.Timedelta(window).value, side="right"),
+        end=np.arange(1, len(time) + 1, dtype=np.int64),
+    )
+    prominence = (df.rolling(indexer, min_periods=1).median() * 100).to_numpy()
+    values = df.to_numpy(dtype=float, copy=True)
+
+    records = []
+    for j, station in enumerate(df.columns):
+        column = values[:, j]
+        nan_before = np.isnan(column).sum()
+        bases = _peak_bases(df.iloc[:, j].to_numpy(), prominence[:, j])
+        if bases is None:
+            records.append(
+                (
+                    station,
+                    False,
+                    pd.NaT,
+                    pd.NaT,
+                    pd.NaT,
+                    0,
+                    "no peak above the prominence threshold",
+                )
+            )
+            continue
+        _apply_mask(column, bases[1], bases[2])
+        peak, left_base, right_base = df.index[list(bases)]
+        records.append(
+            (
+                station,
+                True,
+                peak,
+                left_base,
+                right_base,
+                int(np.isnan(column).sum() - nan_before),
+                "",
+            )
+        )
+
+    df_masked = pd.DataFrame(values, index=df.index, columns=df.columns)
+    report = pd.DataFrame.from_records(
+        records,
+        columns=[
+            "station",
+            "masked",
+            "peak",
+            "left_base",
+            "right_base",
+            "n_masked",
+            "message",
+        ],
+    ).set_index("station")
+    return df_masked, report
+
+
+@instrument
 def norm(s):
     """
     Normalize a numeric array to a range between 0 and 1.
@@ -132,17 +598,452 @@ def norm(s):
     if s.shape[0] == 0:
         raise ValueError("Empty np.array or pd.Series is not a valid input.")
 
-    diff_s = max(s) - min(s)
-    s_norm = (s - min(s)) / diff_s
+    s_min, s_max = np.nanmin(s), np.nanmax(s)
+    s_norm = (s - s_min) / (s_max - s_min)
     return s_norm
 
 
-def read_data(path_file: str = None, cols=None):
+_NORM_METHODS = ("minmax", "zscore", "robust")
+
+
+def _norm_params(df: pd.DataFrame, method: str, window=None, center: bool = False):
+    """
+    Returns the (center, scale) of every column, the data is normalized as
+    (df - center) / scale. With a window both are rolling DataFrames, otherwise
+    arrays with one value per column. NaNs are skipped, a scale of 0 becomes NaN.
+    """
+    if method not in _NORM_METHODS:
+        raise ValueError(f"method must be one of {_NORM_METHODS}.")
+    if window is not None:
+        data = df.rolling(window, min_periods=1, center=center)
+        if method == "minmax":
+            loc, scale = data.min(), data.max() - data.min()
+        elif method == "zscore":
+            loc, scale = data.mean(), data.std()
+        else:
+            loc, scale = data.median(), data.quantile(0.75) - data.quantile(0.25)
+        return loc, scale.where(scale != 0)
+
+    values = df.to_numpy(dtype=np.float64, na_value=np.nan)
+    loc = np.full(values.shape[1], np.nan)
+    scale = np.full(values.shape[1], np.nan)
+    valid = ~np.isnan(values).all(axis=0)
+    values = values[:, valid]
+    if method == "minmax":
+        loc[valid] = np.nanmin(values, axis=0)
+        scale[valid] = np.nanmax(values, axis=0) - loc[valid]
+    elif method == "zscore":
+        loc[valid] = np.nanmean(values, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scale[valid] = np.nanstd(values, axis=0, ddof=1)
+    else:
+        q25, loc[valid], q75 = np.nanquantile(values, [0.25, 0.5, 0.75], axis=0)
+        scale[valid] = q75 - q25
+    scale[scale == 0] = np.nan
+    return loc, scale
+
+
+def _as_frame(df):
+    """Returns a DataFrame or Series as DataFrame."""
+    if isinstance(df, pd.Series):
+        return df.to_frame()
+    if isinstance(df, pd.DataFrame):
+        return df
+    raise TypeError("Input must be a pd.DataFrame or pd.Series.")
+
+
+def _like(df, values: np.ndarray):
+    """Wraps (time x column) values like the DataFrame or Series df."""
+    if isinstance(df, pd.Series):
+        return pd.Series(values[:, 0], index=df.index, name=df.name)
+    return pd.DataFrame(values, index=df.index, columns=df.columns)
+
+
+class Normalizer:
+    """
+    NaN aware normalization of all stations (columns) of a DataFrame at once.
+
+    The parameters are fitted once per column and can be reused, so new data is
+    normalized consistently with the data the Normalizer was fitted on.
+
+    Methods:
+        'minmax': (x - min) / (max - min), like norm.
+        'zscore': (x - mean) / std.
+        'robust': (x - median) / (75% quantile - 25% quantile).
+
+    Args:
+        method (str, optional): One of the methods above. Defaults to 'minmax'.
+
+    Attributes:
+        params (pd.DataFrame): The fitted 'center' and 'scale' (rows) of every column.
+
+    Example:
+        >>> normalizer = Normalizer('robust').fit(df_2004)
+        >>> df_2005_norm = normalizer.transform(df_2005)
+    """
+
+    def __init__(self, method: str = "minmax"):
+        if method not in _NORM_METHODS:
+            raise ValueError(f"method must be one of {_NORM_METHODS}.")
+        self.method = method
+        self.params = None
+
+    def fit(self, df):
+        """
+        Fits the parameters of every column.
+
+        Args:
+            df (pd.DataFrame or pd.Series): The (time x station) data.
+
+        Returns:
+            Normalizer: self.
+        """
+        frame = _as_frame(df)
+        loc, scale = _norm_params(frame, self.method)
+        self.params = pd.DataFrame(
+            [loc, scale], index=["center", "scale"], columns=frame.columns
+        )
+        return self
+
+    def _values_and_params(self, df):
+        frame = _as_frame(df)
+        if self.params is None:
+            raise ValueError("The Normalizer has to be fitted first.")
+        missing = set(frame.columns) - set(self.params.columns)
+        if missing:
+            raise KeyError(f"The Normalizer was not fitted on {sorted(missing)}.")
+        values = frame.to_numpy(dtype=np.float64, na_value=np.nan)
+        return values, self.params[frame.columns].to_numpy()
+
+    def transform(self, df):
+        """
+        Normalizes data with the fitted parameters.
+
+        Args:
+            df (pd.DataFrame or pd.Series): Data with (a subset of) the fitted columns.
+
+        Returns:
+            pd.DataFrame or pd.Series: The normalized data, same type as the input.
+        """
+        values, params = self._values_and_params(df)
+        return _like(df, (values - params[0]) / params[1])
+
+    def inverse_transform(self, df):
+        """Scales normalized data back with the fitted parameters."""
+        values, params = self._values_and_params(df)
+        return _like(df, values * params[1] + params[0])
+
+    def fit_transform(self, df):
+        """Fits the parameters on df and normalizes df."""
+        return self.fit(df).transform(df)
+
+
+@instrument
+def normalize(
+    df,
+    method: str = "minmax",
+    window=None,
+    center: bool = False,
+    return_params: bool = False,
+):
+    """
+    Normalizes all columns of a DataFrame in one vectorized pass, NaNs are skipped.
+
+    Args:
+        df (pd.DataFrame or pd.Series): The (time x station) data.
+        method (str, optional): 'minmax', 'zscore' or 'robust', see Normalizer.
+            Defaults to 'minmax'.
+        window (int or str, optional): Size of a rolling window (number of rows or an
+            offset like '30D'). Defaults to None, which uses the whole series.
+        center (bool, optional): Center the rolling window. Defaults to False.
+        return_params (bool, optional): Also return the parameters. Defaults to False.
+
+    Returns:
+        pd.DataFrame or pd.Series: The normalized data. With return_params also the
+            parameters, a fitted Normalizer without a window or a dict with the
+            rolling 'center' and 'scale' DataFrames with a window.
+
+    Example:
+        >>> df_sorted_norm = normalize(df_sorted)
+    """
+    if window is None:
+        normalizer = Normalizer(method)
+        result = normalizer.fit_transform(df)
+        return (result, normalizer) if return_params else result
+
+    loc, scale = _norm_params(_as_frame(df), method, window, center)
+    result = _like(df, ((_as_frame(df) - loc) / scale).to_numpy())
+    return (result, {"center": loc, "scale": scale}) if return_params else result
+
+
+@instrument
+def smooth(row: pd.Series = None, window: str = "6H"):
+    """
+    Smooths a time series with a centered rolling median.
+
+    Args:
+        row (pd.Series): A Pandas Series with a DatetimeIndex.
+        window (str, optional): Length of the rolling window. Defaults to '6H'.
+
+    Returns:
+        pd.Series: The smoothed time series.
+
+    Raises:
+        TypeError: If input is not a pd.Series.
+    """
+    if not isinstance(row, pd.Series):
+        raise TypeError(f"Input must be a pd.Series and not {type(row)}.")
+    return row.rolling(window, center=True).median()
+
+
+# shared memory of the input and output values, attached once per worker process
+_SHARED = {}
+
+
+def _attach_shared(input_name, output_name, shape, index):
+    """Initializer of the worker processes of parallel_apply."""
+    _SHARED["input"] = shared_memory.SharedMemory(name=input_name)
+    _SHARED["output"] = shared_memory.SharedMemory(name=output_name)
+    _SHARED["values"] = np.ndarray(
+        shape, dtype=np.float64, buffer=_SHARED["input"].buf, order="F"
+    )
+    _SHARED["out_values"] = np.ndarray(
+        shape, dtype=np.float64, buffer=_SHARED["output"].buf, order="F"
+    )
+    _SHARED["index"] = index
+
+
+def _apply_shared_column(j, name, func, kwargs):
+    """Applies func to column j of the shared input and writes the shared output."""
+    row = pd.Series(_SHARED["values"][:, j].copy(), index=_SHARED["index"], name=name)
+    result = np.asarray(func(row, **kwargs), dtype=np.float64)
+    if result.shape != row.shape:
+        raise ValueError(
+            f"func must return one value per sample, but returned shape {result.shape} "
+            f"for column {name}."
+        )
+    _SHARED["out_values"][:, j] = result
+
+
+@instrument
+def parallel_apply(
+    df: pd.DataFrame = None, func=None, max_workers: int = None, **kwargs
+):
+    """
+    Applies a function to every column (station) of a DataFrame in parallel processes,
+    e.g. mask_df, norm or smooth.
+
+    The values are copied once into a shared memory block which the worker processes
+    read from, so the columns are not pickled. Each worker writes its result into a
+    second shared memory block and the results are reassembled in column order.
+    The result is the same as df.apply(func, axis=0).
+
+    Args:
+        df (pd.DataFrame): The (time x station) data.
+        func (callable): A function which takes a pd.Series and returns a pd.Series or
+            array of the same length. It has to be picklable, i.e. defined at the top
+            level of a module (use functools.partial instead of a lambda).
+        max_workers (int, optional): Number of worker processes. Defaults to None,
+            which uses the number of CPUs.
+        **kwargs: Keyword arguments passed to func.
+
+    Returns:
+        pd.DataFrame: The result of func for every column as float64 values.
+
+    Raises:
+        TypeError: If df is not a pd.DataFrame or func is not callable.
+        ValueError: If func does not return one value per sample.
+    Example:
+        >>> raw_data = parallel_apply(raw_data, smooth, window='6H')
+        >>> raw_data = parallel_apply(raw_data, mask_df, max_workers=8)
+    """
+    if not isinstance(df, pd.DataFrame):
+        raise TypeError(f"Input must be a pd.DataFrame and not {type(df)}.")
+    if not callable(func):
+        raise TypeError("func must be callable.")
+
+    shape = df.shape
+    nbytes = max(int(np.prod(shape)) * np.dtype(np.float64).itemsize, 1)
+    input_shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    output_shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    values = out_values = None
+    try:
+        values = np.ndarray(shape, dtype=np.float64, buffer=input_shm.buf, order="F")
+        values[:] = df.to_numpy(dtype=np.float64, na_value=np.nan)
+        out_values = np.ndarray(
+            shape, dtype=np.float64, buffer=output_shm.buf, order="F"
+        )
+
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_attach_shared,
+            initargs=(input_shm.name, output_shm.name, shape, df.index),
+        ) as executor:
+            futures = [
+                executor.submit(_apply_shared_column, j, name, func, kwargs)
+                for j, name in enumerate(df.columns)
+            ]
+            for future in futures:
+                future.result()
+
+        df_result = pd.DataFrame(out_values.copy(), index=df.index, columns=df.columns)
+    finally:
+        # the views have to be released before the shared memory can be closed
+        values = out_values = None
+        input_shm.close()
+        input_shm.unlink()
+        output_shm.close()
+        output_shm.unlink()
+    return df_result
+
+
+def _resolve_cols(columns, cols=None):
+    """
+    Translates the 'cols' argument of read_data into a list of column names.
+
+    Args:
+        columns (list): Names of the data columns, without the time column.
+        cols (str, int, list, optional): The column selection as accepted by read_data.
+
+    Returns:
+        tuple: The list of selected column names and a bool which is True if a
+        single column was requested and a pd.Series should be returned.
+
+    Raises:
+        ValueError: If 'cols' is a float or a list mixing strings and integers.
+    """
+    columns = list(columns)
+    if cols is None:
+        return columns, False
+    if isinstance(cols, str):
+        return [cols], True
+    if isinstance(cols, int):
+        return [columns[cols]], True
+    if isinstance(cols, float):
+        raise ValueError(
+            "Column should be a string or integer or a list of eighter stings or integers."
+        )
+    if isinstance(cols, list):
+        if all(isinstance(col, int) for col in cols):
+            return [columns[col] for col in cols], False
+        if all(isinstance(col, str) for col in cols):
+            return list(cols), False
+        raise ValueError("Column list should only contain strings or integers.")
+    return columns, False
+
+
+def _cache_path(path_file: str, cache_dir: str = None):
+    """
+    Returns the directory of the binary sidecar cache belonging to a CSV file.
+
+    The sidecar lives next to the CSV file (<file>.cache) unless 'cache_dir' is given,
+    in which case it is named after a hash of the absolute path of the CSV file.
+    """
+    if cache_dir is None:
+        return path_file + ".cache"
+    key = hashlib.sha1(os.path.abspath(path_file).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{os.path.basename(path_file)}.{key}.cache")
+
+
+def _cache_key(path_file: str):
+    """Returns the path, size and modification time which identify a CSV file."""
+    stat = os.stat(path_file)
+    return {
+        "path": os.path.abspath(path_file),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def _load_cache_meta(path_file: str, cache_dir: str = None):
+    """
+    Returns the cache directory and its metadata if a valid sidecar cache exists for
+    the current size and modification time of the CSV file, otherwise None.
+    """
+    cache = _cache_path(path_file, cache_dir)
+    try:
+        with open(os.path.join(cache, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if {k: meta.get(k) for k in ("path", "size", "mtime_ns")} != _cache_key(path_file):
+        return None
+    return cache, meta
+
+
+def _read_cache(path_file: str, cols=None, cache_dir: str = None):
+    """
+    Loads the selected columns of a CSV file from its binary sidecar cache.
+
+    Args:
+        path_file (str): The path to the CSV file.
+        cols (str, int, list, optional): The column selection as accepted by read_data.
+        cache_dir (str, optional): Directory of the cache, see _cache_path.
+
+    Returns:
+        pd.DataFrame or pd.Series or None: The selected data or None if no valid cache
+        exists for the current size and modification time of the CSV file.
+    """
+    found = _load_cache_meta(path_file, cache_dir)
+    if found is None:
+        return None
+    cache, meta = found
+
+    columns = meta["columns"]
+    names, squeeze = _resolve_cols(columns, cols)
+    position = {name: i for i, name in enumerate(columns)}
+    index = pd.DatetimeIndex(np.load(os.path.join(cache, "index.npy")), name="time")
+    df = pd.DataFrame(
+        {
+            name: np.load(os.path.join(cache, f"col_{position[name]:04d}.npy"))
+            for name in names
+        },
+        index=index,
+    )
+    if squeeze:
+        return df[names[0]]
+    return df
+
+
+def _write_cache(df: pd.DataFrame, path_file: str, cache_dir: str = None):
+    """
+    Writes a parsed DataFrame as binary sidecar cache (one .npy file per column plus
+    the time index) next to the CSV file. DataFrames with non numeric columns are not
+    cached.
+    """
+    if not all(np.issubdtype(dtype, np.number) for dtype in df.dtypes):
+        return
+    cache = _cache_path(path_file, cache_dir)
+    os.makedirs(cache, exist_ok=True)
+    meta_file = os.path.join(cache, "meta.json")
+    # invalidate first so that an interrupted write never looks like a valid cache
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+
+    np.save(os.path.join(cache, "index.npy"), df.index.values)
+    for i, column in enumerate(df.columns):
+        np.save(os.path.join(cache, f"col_{i:04d}.npy"), df[column].to_numpy())
+
+    meta = _cache_key(path_file)
+    meta["columns"] = [str(column) for column in df.columns]
+    with open(meta_file, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+
+@instrument
+def read_data(
+    path_file: str = None, cols=None, cache: bool = False, cache_dir: str = None
+):
     """
     Reads data from a CSV file, converts it into a Pandas DataFrame,
     and optionally selects specific column(s) from the DataFrame based on the 'cols' parameter.
     The time columns need to be labeld as time which will become the DataFrame index.
 
+    Parsing large CSV files is slow. With 'cache' set to True the parsed data is written
+    to a binary sidecar (one .npy file per column plus the time index) on the first read.
+    Later reads load only the selected columns from the sidecar as long as the size and
+    modification time of the CSV file did not change.
+
     Args:
         path_file (str): The path to the CSV file to be read.
         cols (str, int, list, optional): The 'cols' parameter is optional and allows you to specify
@@ -151,6 +1052,10 @@ def read_data(path_file: str = None, cols=None):
             - List of column names (as str) or column indices (as int) to select multiple columns.
             - Array of column names (as str) or column indices (as int) to select multiple columns.
             - If 'cols' is not specified or set to None, the entire DataFrame will be returned.
+        cache (bool, optional): Read from and write to the binary sidecar cache.
+            Defaults to False.
+        cache_dir (str, optional): Directory for the sidecar cache. Defaults to None,
+            which places the cache next to the CSV file as <path_file>.cache.
 
     Returns:
         pd.DataFrame or pd.Series: The function returns a Pandas DataFrame or Series
@@ -174,11 +1079,19 @@ def read_data(path_file: str = None, cols=None):
         To read and select specific columns by index:
         >>> df = read_data('data.csv', cols=1)
         >>> df = read_data('data.csv', cols=[0, 2, 3])
+
+        To parse the CSV file only once and reuse the result in later runs:
+        >>> df = read_data('data.csv', cols=['Column1', 'Column2'], cache=True)
     """
 
     if not isinstance(path_file, str):
         raise TypeError(f"path_file must be a string not a {type(path_file)}.")
 
+    if cache:
+        df = _read_cache(path_file, cols, cache_dir)
+        if df is not None:
+            return df
+
     df = pd.read_csv(path_file)
 
     if "time" not in df.columns:
@@ -187,24 +1100,168 @@ def read_data(path_file: str = None, cols=None):
     df.set_index("time", inplace=True)
     df.index = pd.to_datetime(df.index).tz_localize(None)
 
+    if cache:
+        _write_cache(df, path_file, cache_dir)
+
     if cols is not None:
-        if isinstance(cols, str):
-            df = df[cols]
-        elif isinstance(cols, int):
-            df = df.iloc[:, cols]
-        elif isinstance(cols, float):
-            raise ValueError(
-                "Column should be a string or integer or a list of eighter stings or integers."
-            )
-        elif isinstance(cols, list):
-            if not (
-                all(isinstance(col, (int)) for col in cols)
-                or all(isinstance(col, (str)) for col in cols)
-            ):
-                raise ValueError("Column list should only contain strings or integers.")
-            if all(isinstance(col, int) for col in cols):
-                df = df.iloc[:, cols]
-            elif all(isinstance(col, str) for col in cols):
-                df = df[cols]
+        names, squeeze = _resolve_cols(df.columns, cols)
+        if squeeze:
+            df = df[names[0]]
+        else:
+            df = df[names]
 
     return df
+
+
+def _iter_cache_chunks(cache, meta, names, chunksize, start=None, end=None):
+    """
+    Yields DataFrames of at most 'chunksize' rows from a sidecar cache. The columns
+    are memory mapped and the rows between 'start' and 'end' are found by a binary
+    search on the time index, so nothing outside of the time window is read.
+    """
+    index = np.load(os.path.join(cache, "index.npy"), mmap_mode="r")
+    position = {name: i for i, name in enumerate(meta["columns"])}
+    data = {
+        name: np.load(
+            os.path.join(cache, f"col_{position[name]:04d}.npy"), mmap_mode="r"
+        )
+        for name in names
+    }
+    first = 0 if start is None else np.searchsorted(index, start.to_datetime64())
+    last = (
+        len(index)
+        if end is None
+        else np.searchsorted(index, end.to_datetime64(), side="right")
+    )
+    for i in range(first, last, chunksize):
+        j = min(i + chunksize, last)
+        yield pd.DataFrame(
+            {name: np.array(values[i:j]) for name, values in data.items()},
+            index=pd.DatetimeIndex(np.array(index[i:j]), name="time"),
+        )
+
+
+def _iter_csv_chunks(path_file, names, chunksize, start=None, end=None):
+    """
+    Yields DataFrames of at most 'chunksize' rows parsed from a CSV file. Only the time
+    column and the selected columns are parsed, rows before 'start' are dropped and the
+    reading stops as soon as a row after 'end' was seen.
+    """
+    reader = pd.read_csv(path_file, usecols=["time"] + names, chunksize=chunksize)
+    for chunk in reader:
+        chunk.set_index("time", inplace=True)
+        chunk.index = pd.to_datetime(chunk.index).tz_localize(None)
+        chunk = chunk[names]
+        if start is not None:
+            chunk = chunk.loc[chunk.index >= start]
+        if end is not None and len(chunk) and chunk.index[-1] > end:
+            yield chunk.loc[chunk.index <= end]
+            return
+        yield chunk
+
+
+def _periods(index: pd.DatetimeIndex, group_by: str):
+    """Returns the year, month or day period of each timestamp of the index."""
+    if group_by == "year":
+        return index.year
+    if group_by == "month":
+        return index.to_period("M")
+    if group_by == "day":
+        return index.to_period("D")
+    raise ValueError("Invalid value for 'group_by'. Use 'year', 'month', or 'day'.")
+
+
+def read_data_chunks(
+    path_file: str = None,
+    cols=None,
+    chunksize: int = 100000,
+    group_by: str = None,
+    start=None,
+    end=None,
+    cache_dir: str = None,
+):
+    """
+    Reads a CSV file piece by piece and yields DataFrames of bounded size, so files
+    which do not fit into memory can be processed in a loop.
+
+    The time index and the column selection are handled the same way as in read_data.
+    Either chunks of at most 'chunksize' rows are yielded or, if 'group_by' is given,
+    one DataFrame per year, month or day. With 'start' and 'end' only the time window
+    in between is returned. If a valid sidecar cache written by read_data(cache=True)
+    exists, the rows are taken directly from the memory mapped cache and the reader
+    jumps straight to 'start' instead of parsing the CSV file up to there.
+    The rows of the file are expected to be sorted in time.
+
+    Args:
+        path_file (str): The path to the CSV file to be read.
+        cols (str, int, list, optional): The column selection, see read_data.
+        chunksize (int, optional): Number of rows which are read at once. Defaults to 100000.
+        group_by (str, optional): Yield one DataFrame per 'year', 'month' or 'day'
+            instead of chunks of 'chunksize' rows. Defaults to None.
+        start (str or datetime, optional): First time to return. Defaults to None.
+        end (str or datetime, optional): Last time to return (inclusive). Defaults to None.
+        cache_dir (str, optional): Directory of the sidecar cache, see read_data.
+
+    Yields:
+        pd.DataFrame or pd.Series: The next piece of the selected data.
+        - If 'cols' specifies a single column, Series are yielded.
+
+    Raises:
+        TypeError: If path_file is not a string.
+        ValueError: If no column called time exist.
+        ValueError: If chunksize is not a positive integer.
+        ValueError: If group_by is not one of 'year', 'month' or 'day'.
+    Example:
+        To compute statistics year by year without loading all years, the stations
+        of every year are stacked in space first:
+        >>> for df_year in read_data_chunks('data.csv', group_by='year'):
+        ...     df_stack, df_stack_year = stack_in_space(df_year)
+        ...     df_stat = stack_space_year_param(df_stack_year)
+    """
+    if not isinstance(path_file, str):
+        raise TypeError(f"path_file must be a string not a {type(path_file)}.")
+    if not isinstance(chunksize, int) or chunksize <= 0:
+        raise ValueError("chunksize must be a positive integer.")
+    if group_by is not None:
+        _periods(pd.DatetimeIndex([]), group_by)
+
+    start = None if start is None else pd.Timestamp(start).tz_localize(None)
+    end = None if end is None else pd.Timestamp(end).tz_localize(None)
+
+    found = _load_cache_meta(path_file, cache_dir)
+    if found is not None:
+        cache, meta = found
+        names, squeeze = _resolve_cols(meta["columns"], cols)
+        chunks = _iter_cache_chunks(cache, meta, names, chunksize, start, end)
+    else:
+        header = pd.read_csv(path_file, nrows=0).columns
+        if "time" not in header:
+            raise ValueError("A column with the name time must exist.")
+        names, squeeze = _resolve_cols([c for c in header if c != "time"], cols)
+        chunks = _iter_csv_chunks(path_file, names, chunksize, start, end)
+
+    def _output(df):
+        return df[names[0]] if squeeze else df
+
+    if group_by is None:
+        for chunk in chunks:
+            if len(chunk):
+                yield _output(chunk)
+        return
+
+    # keep the rows of the last, possibly incomplete, period until the next chunk
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pd.concat([pending, chunk])
+        if not len(chunk):
+            continue
+        periods = _periods(chunk.index, group_by)
+        bounds = np.flatnonzero(periods[1:] != periods[:-1]) + 1
+        first = 0
+        for bound in bounds:
+            yield _output(chunk.iloc[first:bound])
+            first = bound
+        pending = chunk.iloc[first:]
+    if pending is not None and len(pending):
+        yield _output(pending)
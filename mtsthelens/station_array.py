@@ -0,0 +1,172 @@
+"""
+This file contains the memory mapped (time x station) array backend for the
+manipulation functions of the Mt St Helens Project.
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+class StationArray:
+    """
+    Stores one parameter of several stations as a contiguous (time x station) array
+    together with a compact time axis.
+
+    The values are usually a np.memmap of a .npy file on disk, stored in Fortran order
+    so that the time series of each station is contiguous. Without a path the values
+    are kept as a plain np.ndarray in memory. The manipulation functions accept a
+    StationArray instead of a DataFrame and write their results into preallocated
+    StationArrays, so the data never has to be held in memory as a whole.
+
+    Attributes:
+        values (np.memmap or np.ndarray): The (time x station) values.
+        time (np.ndarray): The time axis as datetime64[ns].
+        stations (list): The station (column) names.
+        path (str or None): The directory the array is stored in.
+    """
+
+    def __init__(self, values, time, stations, path: str = None):
+        if values.ndim != 2:
+            raise ValueError("values must be a 2D (time x station) array.")
+        time = np.asarray(time, dtype="datetime64[ns]")
+        stations = [str(station) for station in stations]
+        if values.shape != (len(time), len(stations)):
+            raise ValueError(
+                f"values of shape {values.shape} do not match {len(time)} times "
+                f"and {len(stations)} stations."
+            )
+        self.values = values
+        self.time = time
+        self.stations = stations
+        self.path = path
+
+    @classmethod
+    def empty(
+        cls,
+        time,
+        stations,
+        path: str = None,
+        dtype=np.float64,
+        fill=np.nan,
+    ):
+        """
+        Preallocates a StationArray.
+
+        Args:
+            time (array-like): The time axis.
+            stations (list): The station names.
+            path (str, optional): Directory in which the values are stored as memmap.
+                Defaults to None, which keeps the values in memory.
+            dtype (np.dtype, optional): np.float32 or np.float64. Defaults to np.float64.
+            fill (float, optional): Initial value. Defaults to NaN.
+
+        Returns:
+            StationArray: The preallocated array.
+
+        Raises:
+            ValueError: If dtype is neither float32 nor float64.
+        """
+        dtype = np.dtype(dtype)
+        if dtype not in (np.dtype(np.float32), np.dtype(np.float64)):
+            raise ValueError("dtype must be np.float32 or np.float64.")
+        time = np.asarray(time, dtype="datetime64[ns]")
+        stations = [str(station) for station in stations]
+        shape = (len(time), len(stations))
+
+        if path is None:
+            values = np.full(shape, fill, dtype=dtype, order="F")
+            return cls(values, time, stations)
+
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "time.npy"), time)
+        with open(os.path.join(path, "stations.json"), "w", encoding="utf-8") as f:
+            json.dump(stations, f)
+        values = np.lib.format.open_memmap(
+            os.path.join(path, "values.npy"),
+            mode="w+",
+            dtype=dtype,
+            shape=shape,
+            fortran_order=True,
+        )
+        if fill != 0:
+            values[:] = fill
+        return cls(values, time, stations, path)
+
+    @classmethod
+    def open(cls, path: str, mode: str = "r"):
+        """
+        Opens a StationArray which was stored with StationArray.empty or from_frame.
+
+        Args:
+            path (str): The directory of the array.
+            mode (str, optional): Memmap mode, 'r' or 'r+'. Defaults to 'r'.
+
+        Returns:
+            StationArray: The memory mapped array.
+        """
+        values = np.load(os.path.join(path, "values.npy"), mmap_mode=mode)
+        time = np.load(os.path.join(path, "time.npy"))
+        with open(os.path.join(path, "stations.json"), "r", encoding="utf-8") as f:
+            stations = json.load(f)
+        return cls(values, time, stations, path)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, path: str = None, dtype=np.float64):
+        """
+        Copies a DataFrame with a DatetimeIndex column by column into a StationArray.
+
+        Args:
+            df (pd.DataFrame): The (time x station) data.
+            path (str, optional): Directory for the memmap, see StationArray.empty.
+            dtype (np.dtype, optional): np.float32 or np.float64. Defaults to np.float64.
+
+        Returns:
+            StationArray: The array holding the values of 'df'.
+
+        Raises:
+            TypeError: If df is not a DataFrame.
+            ValueError: If the index of df is not a DatetimeIndex.
+        """
+        if not isinstance(df, pd.DataFrame):
+            raise TypeError("Input 'df' must be a pandas DataFrame.")
+        if not isinstance(df.index, pd.DatetimeIndex):
+            raise ValueError("The index of 'df' must be a DatetimeIndex.")
+        array = cls.empty(df.index, df.columns, path, dtype)
+        for j in range(df.shape[1]):
+            array.values[:, j] = df.iloc[:, j].to_numpy(dtype=dtype, na_value=np.nan)
+        array.flush()
+        return array
+
+    def to_frame(self):
+        """Returns the values as DataFrame with a DatetimeIndex (loads all values)."""
+        return pd.DataFrame(
+            np.asarray(self.values),
+            index=pd.DatetimeIndex(self.time),
+            columns=self.stations,
+        )
+
+    def flush(self):
+        """Writes changes of a memory mapped array to disk."""
+        if isinstance(self.values, np.memmap):
+            self.values.flush()
+
+    @property
+    def shape(self):
+        """The (time x station) shape of the values."""
+        return self.values.shape
+
+    @property
+    def dtype(self):
+        """The dtype of the values."""
+        return self.values.dtype
+
+    def __len__(self):
+        return len(self.time)
+
+    def __repr__(self):
+        where = "memory" if self.path is None else self.path
+        return (
+            f"StationArray({len(self.time)} times x {len(self.stations)} stations, "
+            f"{self.dtype}, {where})"
+        )
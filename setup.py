@@ -16,11 +16,12 @@ opts = dict(
     description = 'Analyze the seismic data of the volcanic eruption of the Mount St. Helens from 2004 to 2008',
     long_description = 'Analyze the correlation of seismic attenuation and the magma extrusion rate and the changing\
           of the climatic patterns in the region from seismic data of the Mount St. Helens',
-    packages = ['mtsthelens', 'tests', 'example'],
+    packages = ['mtsthelens', 'tests', 'example', 'benchmarks'],
     package_data = {'example':['example_data/*.*']},
     include_package_data = True,
     install_requires = ['pytest-runner', 'flake8'],
     tests_require = ['pytest'],
+    entry_points = {'console_scripts': ['mtsthelens-pipeline=mtsthelens.pipeline:main']},
 )
 
 if __name__=='__main__':
@@ -0,0 +1,120 @@
+"""
+Test file for the synthetic data generator and the comparison of the benchmarks.
+"""
+import unittest
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+# file directory manipulation - relative import
+current_directory = os.getcwd()
+# Go back one folder level
+parent_directory = os.path.abspath(os.path.join(current_directory, os.pardir))
+sys.path.insert(0, parent_directory)
+from ..benchmarks import synthetic
+from ..benchmarks import run_benchmarks
+from ..mtsthelens import preprocessing_functions
+
+
+# Define a class in which the tests will run
+class Test_Benchmarks(unittest.TestCase):
+    """This class contains all test for the benchmark helpers"""
+
+    def test_synthetic_data(self):
+        """Test the shape, the determinism and the gaps of the synthetic data"""
+        df = synthetic.synthetic_data(years=1, stations=3, gap_density=0.05)
+
+        self.assertEqual(df.shape, (52704, 3))  # 2004 is a leap year
+        self.assertEqual(pd.infer_freq(df.index), "10T")
+        pd.testing.assert_frame_equal(
+            df, synthetic.synthetic_data(years=1, stations=3, gap_density=0.05)
+        )
+        self.assertFalse(df.equals(synthetic.synthetic_data(years=1, stations=3)))
+        nan_fraction = df.isna().to_numpy().mean()
+        self.assertGreater(nan_fraction, 0.02)
+        self.assertLess(nan_fraction, 0.1)
+        self.assertTrue((df.min() > 0).all())
+
+    def test_synthetic_parameters_csv(self):
+        """Test several parameters and that read_data reads the CSV"""
+        import tempfile
+
+        data = synthetic.synthetic_parameters(
+            ["DSAR", "lDSAR"], years=1, stations=2, nan_density=0
+        )
+        self.assertEqual(list(data), ["DSAR", "lDSAR"])
+        self.assertFalse(data["DSAR"].equals(data["lDSAR"]))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path_file = synthetic.write_csv(
+                data["DSAR"].iloc[:1000], os.path.join(tmp, "data.csv")
+            )
+            df = preprocessing_functions.read_data(path_file)
+        np.testing.assert_allclose(df.values, data["DSAR"].iloc[:1000].values)
+
+    def _result(self, function="filter_data", stations=2, seconds=1.0, peak=2**24):
+        return {
+            "function": function,
+            "years": 1,
+            "stations": stations,
+            "parameters": 1,
+            "rows": 52704,
+            "nan_density": 0.001,
+            "gap_density": 0.01,
+            "seconds": seconds,
+            "peak_bytes": peak,
+        }
+
+    def test_compare(self):
+        """Test that only changes beyond the tolerance are regressions"""
+        baseline = [
+            self._result(),
+            self._result(stations=8),
+            self._result("mask_frame"),
+            self._result("normalize", seconds=0.001),
+        ]
+        results = [
+            self._result(seconds=1.0),
+            self._result(stations=8, seconds=2.0),
+            self._result("mask_frame", peak=2**26),
+            self._result("normalize", seconds=0.003),
+            self._result("df2dict"),
+        ]
+        comparison = run_benchmarks.compare(results, baseline, tolerance=1.5)
+
+        self.assertEqual(len(comparison), 4)
+        self.assertEqual(
+            [row["regression"] for row in comparison], [False, True, True, False]
+        )
+        self.assertAlmostEqual(comparison[1]["time_ratio"], 2.0)
+        self.assertAlmostEqual(comparison[2]["memory_ratio"], 4.0)
+
+    def test_compare_machine(self):
+        """Test that a baseline of another machine is refused"""
+        meta = {"machine": "Linux-x86_64", "cpus": 8, "python": "3.11.7"}
+        results = [self._result()]
+        run_benchmarks.compare(results, results, meta=meta, baseline_meta=dict(meta))
+        with self.assertRaises(ValueError):
+            run_benchmarks.compare(
+                results, results, meta=meta, baseline_meta=dict(meta, cpus=1)
+            )
+
+    def test_scaling(self):
+        """Test the fitted exponents of linear and quadratic scaling"""
+        results = []
+        for rows in [1000, 2000, 4000]:
+            for stations in [2, 8]:
+                for function, seconds in [
+                    ("linear", 1e-6 * rows * stations),
+                    ("quadratic", 1e-9 * rows**2 * stations),
+                ]:
+                    result = self._result(function, stations, seconds)
+                    result["rows"] = rows
+                    results.append(result)
+        exponents = run_benchmarks.scaling(results)
+
+        self.assertAlmostEqual(exponents["linear"]["rows"], 1)
+        self.assertAlmostEqual(exponents["linear"]["stations"], 1)
+        self.assertAlmostEqual(exponents["quadratic"]["rows"], 2)
+        self.assertEqual(run_benchmarks.scaling([self._result()]), {})
@@ -0,0 +1,84 @@
+"""
+Test file for the instrumentation.py
+"""
+import unittest
+import sys
+import os
+import json
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+# file directory manipulation - relative import
+current_directory = os.getcwd()
+# Go back one folder level
+parent_directory = os.path.abspath(os.path.join(current_directory, os.pardir))
+sys.path.insert(0, parent_directory)
+from ..mtsthelens import instrumentation
+from ..mtsthelens import manipulation_functions
+
+
+@instrumentation.instrument
+def _inner(n):
+    return np.ones((n, 2))
+
+
+@instrumentation.instrument
+def _outer(n):
+    _inner(n)
+    return _inner(2 * n)
+
+
+# Define a class in which the tests will run
+class Test_Instrumentation(unittest.TestCase):
+    """This class contains all test for the instrumentation"""
+
+    def test_profile_records(self):
+        """Test the records of nested calls"""
+        with instrumentation.profile() as report:
+            _outer(100000)
+
+        self.assertEqual([r["stack"] for r in report.records][-1], "_outer")
+        self.assertEqual(
+            [r["stack"] for r in report.records[:2]], ["_outer;_inner", "_outer;_inner"]
+        )
+        outer = report.records[-1]
+        self.assertEqual(outer["input_shapes"], [None])
+        self.assertEqual(outer["output_shape"], [200000, 2])
+        self.assertEqual(outer["depth"], 0)
+        # the peak of the inner calls counts for the outer call
+        self.assertGreaterEqual(outer["peak_memory"], 200000 * 2 * 8)
+        self.assertGreaterEqual(report.records[1]["peak_memory"], 200000 * 2 * 8)
+        self.assertGreaterEqual(outer["wall_time"], report.records[0]["wall_time"])
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_disabled(self):
+        """Test that nothing is recorded outside a profile"""
+        with instrumentation.profile() as report:
+            pass
+        _outer(10)
+        self.assertEqual(report.records, [])
+        self.assertFalse(instrumentation._ENABLED)
+
+    def test_export(self):
+        """Test the summary and the JSON and flame graph export"""
+        dates = pd.date_range(start="2023-01-01", periods=1000, freq="10T")
+        df = pd.DataFrame(np.random.rand(1000, 3), index=dates, columns=["A", "B", "C"])
+        with instrumentation.profile() as report:
+            manipulation_functions.filter_data(df)
+            manipulation_functions.filter_data(df)
+            _outer(10)
+
+        summary = report.summary()
+        self.assertEqual(summary.loc["manipulation_functions.filter_data", "calls"], 2)
+        self.assertEqual(report.records[0]["input_shapes"], [[1000, 3]])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path_file = report.to_json(os.path.join(tmp, "profile.json"))
+            with open(path_file, "r", encoding="utf-8") as f:
+                self.assertEqual(len(json.load(f)["records"]), 5)
+        lines = report.to_flamegraph().splitlines()
+        stacks = [line.rsplit(" ", 1)[0] for line in lines]
+        self.assertEqual(stacks, ["filter_data", "_outer;_inner", "_outer"])
+        self.assertTrue(all(int(line.rsplit(" ", 1)[1]) >= 0 for line in lines))
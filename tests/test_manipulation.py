@@ -4,6 +4,7 @@ Test file for the manipulation_function.py
 import unittest
 import sys
 import os
+import tempfile
 import numpy as np
 import pandas as pd
 
@@ -13,6 +14,9 @@ current_directory = os.getcwd()
 parent_directory = os.path.abspath(os.path.join(current_directory, os.pardir))
 sys.path.insert(0, parent_directory)
 from ..mtsthelens import manipulation_functions
+from ..mtsthelens.station_array import StationArray
+from ..mtsthelens.parameter_cube import ParameterCube
+from ..mtsthelens.preprocessing_functions import StationCatalog
 
 
 # Define a class in which the tests will run
@@ -305,6 +309,34 @@ class Test_Manipulation(unittest.TestCase):
         with self.assertRaises(ValueError):
             manipulation_functions.df2dict(non_datetime_index_df)
 
+    def test_df2dict_lazy(self):
+        """Test that the lazy mapping has the same periods and rows as the dictionary."""
+        result = manipulation_functions.df2dict(self.sample_df, "month")
+        lazy = manipulation_functions.df2dict(self.sample_df, "month", lazy=True)
+        self.assertIsInstance(lazy, manipulation_functions.PeriodSlices)
+        self.assertListEqual(list(lazy.keys()), list(result.keys()))
+        for key, value in result.items():
+            pd.testing.assert_frame_equal(lazy[key], value)
+
+    def test_df2dict_unsorted_index(self):
+        """Test that rows of an unsorted index are grouped in their original order."""
+        shuffled = self.sample_df.sample(frac=1, random_state=0)
+        result = manipulation_functions.df2dict(shuffled, "month")
+        periods = shuffled.index.to_period("M")
+        self.assertEqual(len(result), 12)
+        for key, value in result.items():
+            pd.testing.assert_frame_equal(value, shuffled[periods == key])
+
+    def test_df2dict_returns_views(self):
+        """Test that the periods of a sorted DataFrame are not copied."""
+        result = manipulation_functions.df2dict(self.sample_df, "day")
+        self.assertEqual(len(result), len(self.sample_df))
+        self.assertTrue(
+            np.shares_memory(
+                result[pd.Period("2022-03-01", "D")].values, self.sample_df.values
+            )
+        )
+
     def test_stackInSpace_handles_leap_years(self):
         leap_year_df = pd.DataFrame(
             {"value": [1, 2, 3]},
@@ -451,4 +483,488 @@ class Test_Manipulation(unittest.TestCase):
         result = manipulation_functions.filter_data(stack)
 
         for column in stack.columns:
-            self.assertFalse(np.array_equal(result[column], stack[column]))
\ No newline at end of file
+            self.assertFalse(np.array_equal(result[column], stack[column]))
+
+    def test_station_array_stack_in_time(self):
+        """Test that stack_in_time gives the same result for a StationArray on disk."""
+        dates = pd.date_range(start="2001-01-01", end="2003-01-05", freq="1h")
+        df = pd.DataFrame(
+            {"Station1": np.random.randn(len(dates)), "Station2": np.random.randn(len(dates))},
+            index=dates,
+        )
+        df.iloc[30:60, 0] = np.nan
+        seasonal_data, data_no_seasonal = manipulation_functions.stack_in_time(df)
+        with tempfile.TemporaryDirectory() as directory:
+            array = StationArray.from_frame(df, os.path.join(directory, "in"))
+            seasonal_array, no_seasonal_array = manipulation_functions.stack_in_time(
+                array, directory
+            )
+            self.assertIsInstance(no_seasonal_array.values, np.memmap)
+            np.testing.assert_allclose(seasonal_array.values, seasonal_data.values)
+            np.testing.assert_allclose(no_seasonal_array.values, data_no_seasonal.values)
+            self.assertTrue((seasonal_array.time == seasonal_data.index.values).all())
+
+    def test_station_array_stack_in_space(self):
+        """Test that stack_in_space and stack_space_year_param accept a StationArray."""
+        dates = pd.date_range("2004-01-01", periods=100, freq="D")
+        df = pd.DataFrame(np.random.rand(100, 3), index=dates, columns=["A", "B", "C"])
+        df.iloc[5, :] = 0
+        df_median_stackSpace, df_stackSpace_year = manipulation_functions.stack_in_space(
+            df
+        )
+        array_stackSpace, array_stackSpace_year = manipulation_functions.stack_in_space(
+            StationArray.from_frame(df)
+        )
+        np.testing.assert_allclose(
+            array_stackSpace.values[:, 0], df_median_stackSpace["df_rsam_median_SS"]
+        )
+        np.testing.assert_allclose(
+            manipulation_functions.stack_space_year_param(array_stackSpace_year).values,
+            manipulation_functions.stack_space_year_param(df_stackSpace_year).values,
+        )
+
+    def test_station_array_filter_data(self):
+        """Test that filter_data gives the same result for a StationArray."""
+        dates = pd.date_range(start="2023-01-01", periods=100, freq="D")
+        stack = pd.DataFrame(np.random.rand(100, 3), index=dates, columns=["A", "B", "C"])
+        result = manipulation_functions.filter_data(stack)
+        array = manipulation_functions.filter_data(StationArray.from_frame(stack))
+        np.testing.assert_allclose(array.values, result.values)
+
+    def test_stackInTime_matches_groupby(self):
+        """
+        Test that the seasonality equals the mean over the (month, day, hour, minute)
+        groups and is removed from every row
+        """
+        dates = pd.date_range(start="2003-01-01", end="2005-12-31", freq="1h")
+        df = pd.DataFrame(
+            {"Station1": np.random.rand(len(dates)), "Station2": np.random.rand(len(dates))},
+            index=dates,
+        )
+        df.iloc[100:500, 1] = np.nan
+        expected = df.groupby(
+            [df.index.month, df.index.day, df.index.hour, df.index.minute]
+        ).mean()
+
+        seasonal_data, data_no_seasonal = manipulation_functions.stack_in_time(df)
+
+        np.testing.assert_allclose(seasonal_data.values, expected.values)
+        self.assertEqual(seasonal_data.index[0], pd.Timestamp("2000-01-01 00:00"))
+        self.assertIn(pd.Timestamp("2000-02-29 05:00"), seasonal_data.index)
+        np.testing.assert_allclose(
+            data_no_seasonal.loc["2004-02-29 05:00"].values,
+            (df.loc["2004-02-29 05:00"] - seasonal_data.loc["2000-02-29 05:00"]).values,
+        )
+
+    def test_stackInTime_leap_day(self):
+        """Test the handling of the 29th February"""
+        dates = pd.date_range(start="2003-01-01", end="2005-12-31", freq="1h")
+        df = pd.DataFrame({"Station1": np.random.rand(len(dates))}, index=dates)
+
+        seasonal_data, data_no_seasonal = manipulation_functions.stack_in_time(
+            df, leap_day="drop"
+        )
+        self.assertEqual(len(seasonal_data), 365 * 24)
+        self.assertEqual(len(data_no_seasonal), len(df) - 24)
+
+        seasonal_data, data_no_seasonal = manipulation_functions.stack_in_time(
+            df, leap_day="feb28"
+        )
+        self.assertEqual(len(seasonal_data), 365 * 24)
+        self.assertEqual(len(data_no_seasonal), len(df))
+        feb28 = df.loc[
+            (df.index.month == 2) & (df.index.day >= 28) & (df.index.hour == 0)
+        ]
+        self.assertAlmostEqual(
+            seasonal_data.loc["2000-02-28 00:00", "Station1"], feb28["Station1"].mean()
+        )
+
+        with self.assertRaises(ValueError):
+            manipulation_functions.stack_in_time(df, leap_day="invalid")
+
+    def test_seasonal_climatology_A(self):
+        """Test that a single update gives exactly the output of stack_in_time"""
+        dates = pd.date_range(start="2003-01-01", end="2005-01-05", freq="10min")
+        df = pd.DataFrame(
+            {"Station1": np.random.rand(len(dates)), "Station2": np.random.rand(len(dates))},
+            index=dates,
+        )
+        df.iloc[100:500, 1] = np.nan
+        seasonal_data, data_no_seasonal = manipulation_functions.stack_in_time(df)
+
+        climatology = manipulation_functions.SeasonalClimatology()
+        result = climatology.update(df)
+
+        pd.testing.assert_frame_equal(climatology.seasonal, seasonal_data)
+        pd.testing.assert_frame_equal(result, data_no_seasonal)
+
+    def test_seasonal_climatology_B(self):
+        """Test incremental updates of a saved and loaded seasonality with variance"""
+        dates = pd.date_range(start="2003-01-01", end="2005-12-31", freq="1h")
+        df = pd.DataFrame({"Station1": np.random.rand(len(dates))}, index=dates)
+        seasonal_data, data_no_seasonal = manipulation_functions.stack_in_time(df)
+
+        climatology = manipulation_functions.SeasonalClimatology(
+            slot_minutes=60, variance=True
+        )
+        climatology.update(df.loc[:"2004-06-30 23:00"])
+        with tempfile.TemporaryDirectory() as directory:
+            climatology.save(os.path.join(directory, "climatology.npz"))
+            climatology = manipulation_functions.SeasonalClimatology.load(
+                os.path.join(directory, "climatology.npz")
+            )
+        result = climatology.update(df.loc["2004-07-01 00:00":])
+
+        np.testing.assert_allclose(climatology.seasonal.values, seasonal_data.values)
+        np.testing.assert_allclose(
+            result.values, data_no_seasonal.loc["2004-07-01 00:00":].values
+        )
+        expected_variance = df.groupby(
+            [df.index.month, df.index.day, df.index.hour]
+        ).var()
+        np.testing.assert_allclose(
+            climatology.variance.values, expected_variance.values
+        )
+
+    def test_seasonal_climatology_C(self):
+        """Test for timestamps which are not on the slot grid"""
+        dates = pd.date_range(start="2003-01-01", periods=10, freq="5min")
+        df = pd.DataFrame({"Station1": np.random.rand(len(dates))}, index=dates)
+        climatology = manipulation_functions.SeasonalClimatology(slot_minutes=10)
+        with self.assertRaises(ValueError):
+            climatology.update(df)
+
+    def test_stackInSpace_estimators(self):
+        """Test the mean, median and trimmed mean over the stations ignoring NaNs and zeros"""
+        df = pd.DataFrame(
+            {
+                "Station1": [1.0, 0.0, np.nan],
+                "Station2": [2.0, 4.0, np.nan],
+                "Station3": [3.0, 6.0, np.nan],
+                "Station4": [10.0, np.nan, np.nan],
+            },
+            index=pd.date_range("2005-01-01", periods=3, freq="10min"),
+        )
+        result, _ = manipulation_functions.stack_in_space(df)
+        np.testing.assert_allclose(result["df_rsam_median_SS"], [4.0, 5.0, np.nan])
+
+        result, _ = manipulation_functions.stack_in_space(df, estimator="median")
+        np.testing.assert_allclose(result["df_rsam_median_SS"], [2.5, 5.0, np.nan])
+
+        result, _ = manipulation_functions.stack_in_space(
+            df, estimator="trimmed_mean", trim=0.25
+        )
+        np.testing.assert_allclose(result["df_rsam_median_SS"], [2.5, 5.0, np.nan])
+
+        with self.assertRaises(ValueError):
+            manipulation_functions.stack_in_space(df, estimator="mode")
+
+    def test_stackInSpace_year_table(self):
+        """Test that the year table has one row per slot of the year and one column per year"""
+        dates = pd.date_range("2004-06-01", "2006-06-30 23:00", freq="1h")
+        df = pd.DataFrame(np.random.rand(len(dates), 3), index=dates)
+
+        df_median_stackSpace, df_stackSpace_year = manipulation_functions.stack_in_space(
+            df
+        )
+
+        self.assertEqual(df_stackSpace_year.shape, (365 * 24, 3))
+        self.assertListEqual(df_stackSpace_year.columns.tolist(), [2004, 2005, 2006])
+        self.assertEqual(df_stackSpace_year.index[0], "01/01 00:00:00")
+        self.assertAlmostEqual(
+            df_stackSpace_year.loc["03/01 05:00:00", 2005],
+            df_median_stackSpace.loc["2005-03-01 05:00", "df_rsam_median_SS"],
+        )
+        self.assertTrue(np.isnan(df_stackSpace_year.loc["01/01 00:00:00", 2004]))
+        self.assertEqual(
+            manipulation_functions.stack_space_year_param(df_stackSpace_year).shape,
+            (4, 3),
+        )
+
+    def test_station_year_param_A(self):
+        """Test that the statistics of each year equal stack_space_year_param of that year"""
+        dates = pd.date_range("2004-03-01", "2006-06-01", freq="1h")
+        df = pd.DataFrame(np.random.rand(len(dates), 3), index=dates, columns=["A", "B", "C"])
+        df.iloc[:3000, 1] = np.nan
+
+        result = manipulation_functions.station_year_param(df)
+
+        self.assertListEqual(result.index.levels[0].tolist(), [2004, 2005, 2006])
+        for year, df_year in manipulation_functions.df2dict(df).items():
+            pd.testing.assert_frame_equal(
+                result.loc[year],
+                manipulation_functions.stack_space_year_param(df_year),
+                check_names=False,
+            )
+
+    def test_station_year_param_B(self):
+        """Test std, quantiles and the coordinates of the station table"""
+        dates = pd.date_range("2004-01-01", "2004-12-31", freq="1D")
+        df = pd.DataFrame(np.random.rand(len(dates), 2), index=dates, columns=["SEP", "EDM"])
+        df_sta = pd.DataFrame(
+            {
+                "Station": ["EDM", "SEP", "SEP"],
+                "latitude": [46.19, 46.2, 0.0],
+                "longitude": [-122.15, -122.19, 0.0],
+            }
+        )
+
+        result = manipulation_functions.station_year_param(
+            df, stats=["std"], quantiles=[0.9], df_sta=df_sta
+        ).loc[2004]
+
+        self.assertListEqual(result.index.tolist(), ["std", "q0.9", "latitude", "longitude"])
+        np.testing.assert_allclose(result.loc["std"], df.std())
+        np.testing.assert_allclose(result.loc["q0.9"], df.quantile(0.9))
+        np.testing.assert_allclose(result.loc["latitude"], [46.2, 46.19])
+
+    def test_station_year_param_C(self):
+        """Test for an unknown statistic"""
+        df = pd.DataFrame({"A": [1.0]}, index=pd.to_datetime(["2004-01-01"]))
+        with self.assertRaises(ValueError):
+            manipulation_functions.station_year_param(df, stats=["mode"])
+
+    def test_filter_data_zero_phase(self):
+        """Test that the filter has no phase shift and does not plot by default"""
+        import matplotlib.pyplot as plt
+        from scipy.signal import butter, sosfiltfilt
+
+        plt.close("all")
+        dates = pd.date_range(start="2023-01-01", periods=500, freq="D")
+        stack = pd.DataFrame(np.random.rand(500, 3), index=dates, columns=["A", "B", "C"])
+
+        result = manipulation_functions.filter_data(stack)
+
+        sos = butter(5, 0.025, fs=30, output="sos")
+        np.testing.assert_allclose(result.values, sosfiltfilt(sos, stack.values, axis=0))
+        self.assertListEqual(plt.get_fignums(), [])
+
+    def test_filter_data_gaps(self):
+        """Test that each segment between NaNs is filtered on its own"""
+        from scipy.signal import butter, sosfiltfilt
+
+        dates = pd.date_range(start="2023-01-01", periods=500, freq="D")
+        stack = pd.DataFrame(np.random.rand(500, 2), index=dates, columns=["A", "B"])
+        stack.iloc[200:250, 0] = np.nan
+        stack.iloc[0, 1] = np.nan
+
+        result = manipulation_functions.filter_data(stack)
+
+        sos = butter(5, 0.025, fs=30, output="sos")
+        np.testing.assert_array_equal(np.isnan(result.values), np.isnan(stack.values))
+        np.testing.assert_allclose(
+            result["A"].iloc[250:], sosfiltfilt(sos, stack["A"].iloc[250:].values)
+        )
+        np.testing.assert_allclose(
+            result["B"].iloc[1:], sosfiltfilt(sos, stack["B"].iloc[1:].values)
+        )
+
+    def test_filter_data_forward(self):
+        """Test the causal forward filter and a high pass filter"""
+        from scipy.signal import butter, sosfilt
+
+        dates = pd.date_range(start="2023-01-01", periods=500, freq="D")
+        stack = pd.DataFrame(np.random.rand(500, 2), index=dates, columns=["A", "B"])
+
+        result = manipulation_functions.filter_data(
+            stack, cutoff=0.1, fs=1, btype="high", zero_phase=False
+        )
+
+        sos = butter(5, 0.1, fs=1, btype="high", output="sos")
+        np.testing.assert_allclose(result.values, sosfilt(sos, stack.values, axis=0))
+
+    def test_filter_data_bandpass_plot(self):
+        """Test the plot of the frequency response of a band pass filter"""
+        import matplotlib.pyplot as plt
+
+        dates = pd.date_range(start="2023-01-01", periods=500, freq="D")
+        stack = pd.DataFrame(np.random.rand(500, 2), index=dates, columns=["A", "B"])
+
+        result = manipulation_functions.filter_data(
+            stack, cutoff=(0.1, 0.2), fs=1, btype="bandpass", plot=True
+        )
+
+        self.assertEqual(result.shape, stack.shape)
+        markers = plt.gca().lines[1]
+        np.testing.assert_allclose(markers.get_xdata(), [0.1, 0.2])
+        plt.close("all")
+
+    def test_streaming_filter(self):
+        """Test that filtering chunk by chunk equals filtering the whole series"""
+        dates = pd.date_range(start="2023-01-01", periods=3000, freq="10T")
+        df = pd.DataFrame(np.random.rand(3000, 3), index=dates, columns=["A", "B", "C"])
+        df.iloc[500:600, 1] = np.nan
+        df.iloc[999:1001, 2] = np.nan
+
+        expected = manipulation_functions.filter_data(df, zero_phase=False)
+
+        streaming_filter = manipulation_functions.StreamingFilter()
+        result = pd.concat(
+            [streaming_filter.update(df.iloc[i : i + 250]) for i in range(0, 3000, 250)]
+        )
+
+        np.testing.assert_allclose(result.values, expected.values, atol=1e-12)
+        self.assertTrue(np.array_equal(result.isna().values, expected.isna().values))
+
+    def test_streaming_filter_series(self):
+        """Test the StreamingFilter with Series and a new station"""
+        dates = pd.date_range(start="2023-01-01", periods=1000, freq="10T")
+        df = pd.DataFrame(np.random.rand(1000, 2), index=dates, columns=["A", "B"])
+        expected = manipulation_functions.filter_data(df, zero_phase=False)
+
+        streaming_filter = manipulation_functions.StreamingFilter()
+        first = streaming_filter.update(df["A"].iloc[:400])
+        rest = streaming_filter.update(df.iloc[400:])
+
+        self.assertIsInstance(first, pd.Series)
+        np.testing.assert_allclose(
+            pd.concat([first, rest["A"]]).values, expected["A"].values
+        )
+        # station 'B' starts at rest when it first appears
+        np.testing.assert_allclose(
+            rest["B"].values,
+            manipulation_functions.filter_data(df["B"].iloc[400:], zero_phase=False),
+        )
+
+        # a Series without a name
+        unnamed = manipulation_functions.StreamingFilter().update(
+            pd.Series(df["A"].values)
+        )
+        self.assertIsNone(unnamed.name)
+        np.testing.assert_allclose(unnamed.values, expected["A"].values)
+
+        with self.assertRaises(TypeError):
+            streaming_filter.update(np.zeros(3))
+
+    def test_remove_long_periods(self):
+        """Test that the multirate high pass removes trends and keeps short periods"""
+        dates = pd.date_range(start="2000-01-01", end="2005-12-31", freq="H")
+        t = np.arange(len(dates)) / (365 * 24)
+        short = np.sin(2 * np.pi * t * 12)
+        df = pd.DataFrame(
+            {"A": 5 * t + 3 * np.sin(2 * np.pi * t / 3) + short, "B": short + 1},
+            index=dates,
+        )
+        df.iloc[10000:12000, 0] = np.nan
+
+        result, trend = manipulation_functions.remove_long_periods(
+            df, return_trend=True
+        )
+
+        self.assertIsInstance(result, pd.DataFrame)
+        self.assertTrue(result["A"].iloc[10000:12000].isna().all())
+        np.testing.assert_allclose((result + trend).values, df.values)
+        inner = slice(365 * 24, -365 * 24)
+        for column in ["A", "B"]:
+            residual = result[column].values[inner] - short[inner]
+            self.assertLess(np.nanmax(np.abs(residual)), 0.2)
+
+    def test_remove_long_periods_series(self):
+        """Test the multirate high pass with a Series and wrong input"""
+        dates = pd.date_range(start="2000-01-01", periods=5000, freq="D")
+        series = pd.Series(np.linspace(0, 10, 5000), index=dates, name="A")
+
+        result = manipulation_functions.remove_long_periods(series)
+
+        self.assertIsInstance(result, pd.Series)
+        self.assertEqual(result.name, "A")
+        self.assertLess(np.abs(result.values[1000:-1000]).max(), 0.1)
+
+        with self.assertRaises(TypeError):
+            manipulation_functions.remove_long_periods(series.values)
+        with self.assertRaises(ValueError):
+            manipulation_functions.remove_long_periods(series.reset_index(drop=True))
+
+    def test_stackInTime_chunks(self):
+        """Test that stacking chunk by chunk gives the in-memory result"""
+        dates = pd.date_range(start="2019-12-01", end="2021-03-31", freq="1H")
+        df = pd.DataFrame(
+            np.random.rand(len(dates), 3), index=dates, columns=["A", "B", "C"]
+        )
+        df.iloc[100:400, 1] = np.nan
+
+        for leap_day in ["keep", "feb28", "drop"]:
+            expected = manipulation_functions.stack_in_time(df, leap_day=leap_day)
+            chunks = manipulation_functions.ChunkedFrame.from_frame(df, 1000)
+            seasonal, no_seasonal = manipulation_functions.stack_in_time(
+                chunks, leap_day=leap_day
+            )
+            self.assertIsInstance(no_seasonal, manipulation_functions.ChunkedFrame)
+            no_seasonal = no_seasonal.to_frame()
+            self.assertTrue(seasonal.index.equals(expected[0].index))
+            self.assertTrue(no_seasonal.index.equals(expected[1].index))
+            np.testing.assert_allclose(seasonal.values, expected[0].values, atol=1e-12)
+            np.testing.assert_allclose(
+                no_seasonal.values, expected[1].values, atol=1e-12
+            )
+
+        with self.assertRaises(TypeError):
+            manipulation_functions.stack_in_time(iter([df]))
+        with self.assertRaises(ValueError):
+            manipulation_functions.stack_in_time([df[["A", "B"]], df[["A"]]])
+
+    def test_stackInSpace_chunks(self):
+        """Test that stacking an iterator of chunks gives the in-memory result"""
+        dates = pd.date_range(start="2019-12-01", end="2021-03-31", freq="1H")
+        df = pd.DataFrame(
+            np.random.rand(len(dates), 5), index=dates, columns=list("ABCDE")
+        )
+        df.iloc[::7, 2] = np.nan
+
+        for estimator in ["mean", "median", "trimmed_mean"]:
+            expected = manipulation_functions.stack_in_space(df, estimator=estimator)
+            chunks = manipulation_functions.ChunkedFrame.from_frame(df, 999)
+            result = manipulation_functions.stack_in_space(
+                iter(chunks), estimator=estimator
+            )
+            pd.testing.assert_frame_equal(result[0], expected[0])
+            pd.testing.assert_frame_equal(result[1], expected[1])
+
+        with self.assertRaises(ValueError):
+            manipulation_functions.stack_in_space([])
+
+    def test_stackInSpace_catalog(self):
+        """Test that stations outside their operating periods are not stacked"""
+        dates = pd.date_range(start="2003-12-01", end="2005-03-31", freq="6H")
+        df = pd.DataFrame(
+            np.random.rand(len(dates), 3) + 1, index=dates, columns=["A", "B", "C"]
+        )
+        catalog = StationCatalog(
+            pd.DataFrame(
+                {
+                    "Station": ["A", "B", "B"],
+                    "latitude": [46.0, 46.1, 46.1],
+                    "longitude": [-122.0, -122.1, -122.1],
+                    "StartTime": ["2003-01-01", "2003-01-01", "2004-09-01"],
+                    "EndTime": ["2004-06-30", "2004-02-01", "2599-12-31"],
+                }
+            )
+        )
+
+        expected = manipulation_functions.stack_in_space(catalog.where_active(df))
+        self.assertFalse(
+            np.allclose(
+                expected[0].values, manipulation_functions.stack_in_space(df)[0].values
+            )
+        )
+        result = manipulation_functions.stack_in_space(df, catalog=catalog)
+        pd.testing.assert_frame_equal(result[0], expected[0])
+        pd.testing.assert_frame_equal(result[1], expected[1])
+
+        chunks = manipulation_functions.ChunkedFrame.from_frame(df, 100)
+        result = manipulation_functions.stack_in_space(chunks, catalog=catalog)
+        pd.testing.assert_frame_equal(result[0], expected[0])
+
+        array_stack, _ = manipulation_functions.stack_in_space(
+            StationArray.from_frame(df), catalog=catalog
+        )
+        np.testing.assert_allclose(
+            array_stack.values[:, 0], expected[0]["df_rsam_median_SS"]
+        )
+
+        cube_stack, _ = manipulation_functions.stack_in_space(
+            ParameterCube.from_frames({"RSAM": df}), catalog=catalog
+        )
+        np.testing.assert_allclose(
+            cube_stack["RSAM"], expected[0]["df_rsam_median_SS"]
+        )
@@ -0,0 +1,121 @@
+"""
+Test file for the parameter_cube.py
+"""
+import unittest
+import sys
+import os
+import tempfile
+from unittest import mock
+import numpy as np
+import pandas as pd
+
+# file directory manipulation - relative import
+current_directory = os.getcwd()
+# Go back one folder level
+parent_directory = os.path.abspath(os.path.join(current_directory, os.pardir))
+sys.path.insert(0, parent_directory)
+from ..mtsthelens.parameter_cube import ParameterCube
+from ..mtsthelens import manipulation_functions
+
+
+# Define a class in which the tests will run
+class Test_ParameterCube(unittest.TestCase):
+    """This class contains all test for the ParameterCube class"""
+
+    def setUp(self):
+        dates = pd.date_range(start="2003-12-01", end="2005-02-01", freq="1H")
+        self.bands = {
+            band: pd.DataFrame(
+                np.random.rand(len(dates), 3) + 0.1,
+                index=dates,
+                columns=["STA1", "STA2", "STA3"],
+            )
+            for band in ["DRSAM", "DMF", "DHF"]
+        }
+        self.bands["DHF"].iloc[5, 1] = 0
+        self.bands["DMF"].iloc[50:60, 2] = np.nan
+
+    def test_ratios(self):
+        """Test that the ratios are derived from the stored bands"""
+        cube = ParameterCube.from_frames(self.bands)
+        self.assertEqual(cube.bands, ["DRSAM", "DMF", "DHF"])
+        self.assertEqual(list(cube.ratios), ["DSAR", "lDSAR", "lhDSAR"])
+        self.assertEqual(cube.shape, (6, len(self.bands["DMF"]), 3))
+
+        expected = self.bands["DMF"] / self.bands["DHF"]
+        dsar = cube["DSAR"]
+        self.assertTrue(np.isnan(dsar.iloc[5, 1]))
+        expected.iloc[5, 1] = np.nan
+        pd.testing.assert_frame_equal(dsar, expected, check_freq=False)
+        expected = self.bands["DRSAM"] / self.bands["DHF"]
+        expected.iloc[5, 1] = np.nan
+        pd.testing.assert_frame_equal(cube["lhDSAR"], expected, check_freq=False)
+
+        with self.assertRaises(KeyError):
+            cube["VSAR"]
+        with self.assertRaises(ValueError):
+            cube.select(["VSAR"])
+        with self.assertRaises(ValueError):
+            ParameterCube.from_frames(self.bands, ratios={"VSAR": ("MF", "HF")})
+
+    def test_roundtrip_memmap(self):
+        """Test that a cube stored on disk keeps only the bands and can be opened"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cube")
+            ParameterCube.from_frames(
+                self.bands, path, np.float32, ratios={"DSAR": ("DMF", "DHF")}
+            )
+            cube = ParameterCube.open(path)
+            self.assertIsInstance(cube.values, np.memmap)
+            self.assertEqual(cube.values.shape[0], 3)
+            self.assertEqual(cube.parameters, ["DRSAM", "DMF", "DHF", "DSAR"])
+            np.testing.assert_allclose(
+                cube["DMF"].values, self.bands["DMF"].values, rtol=1e-6
+            )
+
+    def test_alignment(self):
+        """Test that bands with different times and stations are aligned"""
+        bands = {
+            "MF": self.bands["DMF"].iloc[:100],
+            "HF": self.bands["DHF"].iloc[50:150, :2],
+        }
+        cube = ParameterCube.from_frames(bands)
+        self.assertEqual(len(cube), 150)
+        self.assertEqual(cube.stations, ["STA1", "STA2", "STA3"])
+        vsar = cube["VSAR"]
+        self.assertEqual(vsar.iloc[:50].notna().sum().sum(), 0)
+        self.assertEqual(vsar.iloc[:, 2].notna().sum(), 0)
+        np.testing.assert_allclose(
+            vsar.iloc[50:100, :2].values,
+            (bands["MF"].iloc[50:100, :2] / bands["HF"].iloc[:50]).values,
+        )
+
+    def test_stacking(self):
+        """Test that all parameters are stacked in one call like one by one"""
+        cube = ParameterCube.from_frames(self.bands).select(["DSAR", "lDSAR", "DMF"])
+        # the parameters are processed one by one, never all at once
+        with mock.patch.object(ParameterCube, "to_frame", side_effect=AssertionError):
+            seasonal, no_seasonal = manipulation_functions.stack_in_time(cube)
+            stack, year_table = manipulation_functions.stack_in_space(
+                cube, estimator="median"
+            )
+            stats = manipulation_functions.station_year_param(cube)
+
+        self.assertEqual(list(stack.columns), ["DSAR", "lDSAR", "DMF"])
+        for name in cube.parameters:
+            df = cube[name]
+            expected = manipulation_functions.stack_in_time(df)
+            pd.testing.assert_frame_equal(seasonal[name], expected[0])
+            pd.testing.assert_frame_equal(no_seasonal[name], expected[1])
+
+            expected = manipulation_functions.stack_in_space(df, estimator="median")
+            np.testing.assert_allclose(stack[name].values, expected[0].iloc[:, 0])
+            self.assertTrue(stack.index.equals(expected[0].index))
+            pd.testing.assert_frame_equal(year_table[name], expected[1])
+
+            pd.testing.assert_frame_equal(
+                stats[name], manipulation_functions.station_year_param(df)
+            )
+
+        with self.assertRaises(ValueError):
+            manipulation_functions.stack_in_time(cube.select([]))
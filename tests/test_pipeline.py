@@ -0,0 +1,102 @@
+"""
+Test file for the pipeline.py
+"""
+import unittest
+import sys
+import os
+import json
+import tempfile
+import numpy as np
+import pandas as pd
+
+# file directory manipulation - relative import
+current_directory = os.getcwd()
+# Go back one folder level
+parent_directory = os.path.abspath(os.path.join(current_directory, os.pardir))
+sys.path.insert(0, parent_directory)
+from ..mtsthelens import pipeline
+from ..mtsthelens import manipulation_functions
+
+
+# Define a class in which the tests will run
+class Test_Pipeline(unittest.TestCase):
+    """This class contains all test for the Pipeline class"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        dates = pd.date_range(start="2004-01-01", end="2005-12-31", freq="10min")
+        df = pd.DataFrame(
+            np.random.rand(len(dates), 2) + 1, index=dates, columns=["A", "B"]
+        )
+        df.index = df.index.tz_localize("UTC")
+        df.index.name = "time"
+        df.to_csv(os.path.join(self.tmp.name, "data.csv"))
+        # without the plot stages, which need pygmt
+        self.config = {
+            "input": "data.csv",
+            "cache_dir": "cache",
+            "output_dir": "output",
+            "max_workers": 2,
+            "stages": {
+                "plot_time_stack": None,
+                "plot_filtered": None,
+                "plot_space_params": None,
+            },
+        }
+        self.path_config = os.path.join(self.tmp.name, "config.json")
+        with open(self.path_config, "w", encoding="utf-8") as f:
+            json.dump(self.config, f)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_run_and_cache(self):
+        """Test that a re-run only computes the changed stages"""
+        status = pipeline.Pipeline.from_config(self.path_config).run()
+        self.assertEqual(set(status.values()), {"run"})
+        self.assertEqual(len(status), 7)
+
+        status = pipeline.Pipeline.from_config(self.path_config).run()
+        self.assertEqual(set(status.values()), {"cached"})
+
+        self.config["stages"]["filtered"] = {"params": {"cutoff": 0.05}}
+        with open(self.path_config, "w", encoding="utf-8") as f:
+            json.dump(self.config, f)
+        status = pipeline.Pipeline.from_config(self.path_config).run()
+        self.assertEqual(status["filtered"], "run")
+        self.assertEqual(status["time_stack"], "cached")
+
+    def test_results(self):
+        """Test that the stages compute the same as the functions"""
+        runner = pipeline.Pipeline.from_config(self.path_config)
+        runner.max_workers = 1
+        status = runner.run(["year_params"])
+
+        self.assertNotIn("filtered", status)
+        masked = runner.result("masked")
+        expected = manipulation_functions.stack_space_year_param(
+            manipulation_functions.stack_in_space(masked)[1]
+        )
+        pd.testing.assert_frame_equal(runner.result("year_params"), expected)
+        with self.assertRaises(KeyError):
+            runner.result("filtered")
+
+    def test_main(self):
+        """Test the exit code and the status of the command line entry point"""
+        self.assertEqual(pipeline.main([self.path_config]), 0)
+        status = pipeline.run(self.path_config)
+        self.assertEqual(set(status.values()), {"cached"})
+
+    def test_invalid_stages(self):
+        """Test unknown functions, inputs and cycles"""
+        with self.assertRaises(ValueError):
+            pipeline.Pipeline({"a": {"function": "unknown"}})
+        with self.assertRaises(ValueError):
+            pipeline.Pipeline({"a": {"function": "filter_data", "inputs": ["b"]}})
+        with self.assertRaises(ValueError):
+            pipeline.Pipeline(
+                {
+                    "a": {"function": "filter_data", "inputs": ["b"]},
+                    "b": {"function": "filter_data", "inputs": ["a"]},
+                }
+            )
@@ -5,8 +5,12 @@ which do not output a plot.
 import unittest
 import sys
 import os
+import tempfile
+from unittest import mock
 import numpy as np
 import pandas as pd
+import xarray as xr
+from PIL import Image, ImageSequence
 
 # file directory manipulation - relative import
 current_directory = os.getcwd()
@@ -16,6 +20,34 @@ sys.path.insert(0, parent_directory)
 from ..mtsthelens import plotting_functions
 
 
+class _InlineExecutor:
+    """Stands in for the ProcessPoolExecutor of animation and runs in this process."""
+
+    calls = []
+
+    def __init__(self, max_workers=None, mp_context=None, initializer=None):
+        _InlineExecutor.calls.append(
+            {"max_workers": max_workers, "mp_context": mp_context, "initializer": initializer}
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def map(self, func, iterable):
+        return map(func, iterable)
+
+
+def _fake_map_plot(df, key=None, output_directory=None, **kwargs):
+    """Writes a one colored frame instead of rendering the map with pygmt."""
+    os.makedirs(output_directory, exist_ok=True)
+    path_file = os.path.join(output_directory, f"{key}.png")
+    Image.new("RGB", (20, 10), (int(df.loc["DSAR"].iloc[0]), 0, 0)).save(path_file)
+    return path_file
+
+
 # Define a class in which the tests will run
 class Test_Plotting(unittest.TestCase):
     """This class contains all test for the functions in plotting_functions.py"""
@@ -56,3 +88,242 @@ class Test_Plotting(unittest.TestCase):
         # Test with a dictionary containing non-DataFrame values
         with self.assertRaises(TypeError):
             plotting_functions._min_max_values(self.non_dataframe_dict)
+
+    def test_basemap_key(self):
+        # Test that the basemap cache key depends on region, resolution and radiance
+        region = [-122.3, -122.1, 46.1, 46.3]
+        key, file_name = plotting_functions._basemap_key(region, "03s", [270, 30])
+        same_key, same_file_name = plotting_functions._basemap_key(
+            tuple(region), "03s", (270, 30)
+        )
+        self.assertEqual(key, same_key)
+        self.assertEqual(file_name, same_file_name)
+        self.assertTrue(file_name.endswith(".nc"))
+        for other in [
+            plotting_functions._basemap_key(region, "15s", [270, 30]),
+            plotting_functions._basemap_key(region, "03s", [180, 30]),
+            plotting_functions._basemap_key(region[::-1], "03s", [270, 30]),
+        ]:
+            self.assertNotEqual(other[1], file_name)
+
+    def _mock_pygmt(self):
+        """pygmt with a relief grid and a gradient which adds one to it"""
+        pygmt = mock.MagicMock()
+        grid = xr.DataArray(
+            np.arange(12.0).reshape(3, 4),
+            coords={"lat": [46.1, 46.2, 46.3], "lon": [-122.4, -122.3, -122.2, -122.1]},
+            dims=("lat", "lon"),
+        )
+        pygmt.datasets.load_earth_relief.return_value = grid
+        pygmt.grdcut.return_value = grid
+        pygmt.grdgradient.side_effect = lambda grid, radiance: grid + 1
+        return pygmt
+
+    def test_hillshade_memory_cache(self):
+        # Test that the second call with the same key is a cache hit
+        region = [-122.4, -122.1, 46.1, 46.3]
+        pygmt = self._mock_pygmt()
+        with mock.patch.object(plotting_functions, "pygmt", pygmt), mock.patch.dict(
+            plotting_functions._BASEMAP_CACHE, clear=True
+        ):
+            first = plotting_functions.hillshade(region)
+            second = plotting_functions.hillshade(region)
+            self.assertIs(first, second)
+            self.assertEqual(pygmt.grdgradient.call_count, 1)
+            self.assertEqual(pygmt.datasets.load_earth_relief.call_count, 1)
+
+            plotting_functions.hillshade(region, radiance=(90, 30))
+            self.assertEqual(pygmt.grdgradient.call_count, 2)
+
+    def test_hillshade_disk_cache(self):
+        # Test that a new process (empty memory cache) reads the disk cache
+        region = [-122.4, -122.1, 46.1, 46.3]
+        pygmt = self._mock_pygmt()
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(
+            plotting_functions, "pygmt", pygmt
+        ):
+            with mock.patch.dict(plotting_functions._BASEMAP_CACHE, clear=True):
+                first = plotting_functions.hillshade(region, cache_dir=tmp)
+            self.assertEqual(len(os.listdir(tmp)), 1)
+            with mock.patch.dict(plotting_functions._BASEMAP_CACHE, clear=True):
+                second = plotting_functions.hillshade(region, cache_dir=tmp)
+            self.assertEqual(pygmt.grdgradient.call_count, 1)
+            np.testing.assert_array_equal(second.values, first.values)
+
+    def test_hillshade_relief_file(self):
+        # Test that a relief file is cut instead of downloading the earth relief
+        region = [-122.4, -122.1, 46.1, 46.3]
+        pygmt = self._mock_pygmt()
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(
+            plotting_functions, "pygmt", pygmt
+        ), mock.patch.dict(plotting_functions._BASEMAP_CACHE, clear=True):
+            relief_file = os.path.join(tmp, "relief.nc")
+            with open(relief_file, "wb") as f:
+                f.write(b"grid")
+            plotting_functions.hillshade(region, relief_file=relief_file)
+            pygmt.grdcut.assert_called_once_with(grid=relief_file, region=region)
+            pygmt.datasets.load_earth_relief.assert_not_called()
+
+    def test_assemble_animation(self):
+        # Test that the frames are assembled in the given order into a GIF
+        with tempfile.TemporaryDirectory() as tmp:
+            frames = []
+            for i, color in enumerate([(255, 0, 0), (0, 255, 0), (0, 0, 255)]):
+                frames.append(os.path.join(tmp, f"frame_{i}.png"))
+                Image.new("RGB", (20, 10), color).save(frames[-1])
+
+            path_file = plotting_functions.assemble_animation(
+                frames, os.path.join(tmp, "animation.gif"), duration=200
+            )
+
+            with Image.open(path_file) as gif:
+                colors = [
+                    frame.convert("RGB").getpixel((0, 0))
+                    for frame in ImageSequence.Iterator(gif)
+                ]
+                self.assertEqual(gif.info["duration"], 200)
+            self.assertEqual(colors, [(255, 0, 0), (0, 255, 0), (0, 0, 255)])
+
+            with self.assertRaises(ValueError):
+                plotting_functions.assemble_animation(
+                    frames, os.path.join(tmp, "animation.avi")
+                )
+            with self.assertRaises(ValueError):
+                plotting_functions.assemble_animation([], path_file)
+
+    def test_animation(self):
+        # Test the rendering of the frames in worker processes with pygmt mocked
+        read_dictionary = {
+            year: pd.DataFrame(
+                {"STA1": [46.2, -122.2, 40 * i], "STA2": [46.3, -122.1, 40 * i + 10]},
+                index=["latitude", "longitude", "DSAR"],
+            )
+            for i, year in enumerate([2005, 2004, 2006])
+        }
+        _InlineExecutor.calls = []
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(
+            plotting_functions, "map_plot", side_effect=_fake_map_plot
+        ) as map_plot, mock.patch.object(
+            plotting_functions, "hillshade"
+        ) as hillshade, mock.patch.object(
+            plotting_functions, "ProcessPoolExecutor", _InlineExecutor
+        ):
+            output_directory = os.path.join(tmp, "frames")
+            path_file = plotting_functions.animation(
+                read_dictionary,
+                "DSAR",
+                "hot",
+                output_directory=output_directory,
+                max_workers=2,
+            )
+
+            self.assertEqual(path_file, os.path.join(output_directory, "DSAR.gif"))
+            self.assertTrue(os.path.isfile(path_file))
+            hillshade.assert_called_once()
+            self.assertEqual(
+                [call.kwargs["key"] for call in map_plot.call_args_list],
+                [2005, 2004, 2006],
+            )
+            self.assertEqual(
+                {call.kwargs["output_directory"] for call in map_plot.call_args_list},
+                {output_directory},
+            )
+            # the workers are spawned, not forked
+            self.assertEqual(len(_InlineExecutor.calls), 1)
+            self.assertEqual(_InlineExecutor.calls[0]["max_workers"], 2)
+            self.assertEqual(
+                _InlineExecutor.calls[0]["mp_context"].get_start_method(), "spawn"
+            )
+            self.assertIs(
+                _InlineExecutor.calls[0]["initializer"], plotting_functions._init_worker
+            )
+            # the frames keep the order of the dictionary
+            with Image.open(path_file) as gif:
+                reds = [
+                    frame.convert("RGB").getpixel((0, 0))[0]
+                    for frame in ImageSequence.Iterator(gif)
+                ]
+            self.assertEqual(reds, [0, 40, 80])
+
+            frames = plotting_functions.animation(
+                read_dictionary,
+                "DSAR",
+                "hot",
+                output_directory=output_directory,
+                output_format=None,
+            )
+            self.assertEqual(
+                frames,
+                [os.path.join(output_directory, f"{key}.png") for key in read_dictionary],
+            )
+            # the frames are rendered in this process by default
+            self.assertEqual(len(_InlineExecutor.calls), 1)
+
+        # every worker begins a GMT session of its own
+        with mock.patch.dict(os.environ), mock.patch.object(
+            plotting_functions, "pygmt"
+        ) as pygmt:
+            plotting_functions._init_worker()
+            self.assertEqual(os.environ["GMT_SESSION_NAME"], str(os.getpid()))
+            pygmt.session_management.begin.assert_called_once()
+
+    def test_decimate_minmax(self):
+        # Test that minmax decimation keeps the extrema and the gaps
+        idx = pd.date_range("2004-01-01", periods=100000, freq="10T")
+        series = pd.Series(np.random.rand(100000), index=idx)
+        series.iloc[5000] = 10
+        series.iloc[7000] = -10
+        series.iloc[20000:30000] = np.nan
+
+        result = plotting_functions.decimate(series, 1000)
+
+        self.assertLessEqual(len(result), 1000)
+        self.assertEqual(result.max(), 10)
+        self.assertEqual(result.min(), -10)
+        self.assertTrue(result.index.is_monotonic_increasing)
+        self.assertTrue(result.loc["2004-05-20":"2004-06-20"].isna().all())
+        self.assertIsNone(result.index.freq)
+
+    def test_decimate_lttb(self):
+        # Test LTTB decimation and short series
+        idx = pd.date_range("2004-01-01", periods=10000, freq="10T")
+        series = pd.Series(np.sin(np.arange(10000) / 500), index=idx)
+        series.iloc[4321] = 5
+
+        result = plotting_functions.decimate(series, 200, method="lttb")
+
+        self.assertEqual(len(result), 200)
+        self.assertEqual(result.index[0], idx[0])
+        self.assertEqual(result.index[-1], idx[-1])
+        self.assertEqual(result.max(), 5)
+
+        short = plotting_functions.decimate(series.iloc[:100], 200)
+        np.testing.assert_array_equal(short.values, series.iloc[:100].values)
+        with self.assertRaises(ValueError):
+            plotting_functions.decimate(series, 200, method="mean")
+
+    def test_min_max_values_alignment(self):
+        # Test frames with different stations and NaNs
+        df3 = pd.DataFrame({"B": [0, np.nan, 20], "C": [-1, np.nan, 3]})
+        min_df, max_df = plotting_functions._min_max_values(
+            {"df1": self.df1, "df3": df3}
+        )
+        self.assertEqual(list(min_df.columns), ["df1", "df3"])
+        np.testing.assert_array_equal(min_df["df1"].values, [1, 2, 3])
+        np.testing.assert_array_equal(min_df["df3"].values, [-1, np.nan, 3])
+        np.testing.assert_array_equal(max_df["df3"].values, [0, np.nan, 20])
+
+    def test_row_extrema(self):
+        # Test that the running extrema equal the extrema of all frames
+        extrema = plotting_functions.RowExtrema()
+        extrema.update({"df1": self.df1})
+        extrema.update({"df2": self.df2})
+        min_df, max_df = plotting_functions._min_max_values(
+            {"df1": self.df1, "df2": self.df2}
+        )
+        result = extrema.to_frame()
+        self.assertEqual(extrema.n_frames, 2)
+        np.testing.assert_array_equal(result["minimum"], min_df.min(axis=1))
+        np.testing.assert_array_equal(result["maximum"], max_df.max(axis=1))
+        with self.assertRaises(TypeError):
+            extrema.update(self.non_dataframe_dict)
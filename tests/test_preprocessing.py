@@ -3,6 +3,7 @@ import unittest
 import sys
 import os
 import datetime
+import tempfile
 import numpy as np
 import pandas as pd
 
@@ -78,6 +79,131 @@ class TestPreprocessingFunctions(unittest.TestCase):
         with self.assertRaises(TypeError):
             preprocessing_functions.calculate_distance(lat1, lat2, lon1, lon2)
 
+    # Tests for haversine, distance_matrix and StationIndex
+    def test_distance_matrix(self):
+        """Test the distance matrix against calculate_distance."""
+        lat = [46.2, 46.19, 45.0, -10.5]
+        lon = [-122.19, -122.18, -120.0, 30.25]
+
+        result = preprocessing_functions.distance_matrix(lat, lon)
+
+        self.assertEqual(result.shape, (4, 4))
+        for i in range(4):
+            for j in range(4):
+                self.assertAlmostEqual(
+                    result[i, j],
+                    preprocessing_functions.calculate_distance(
+                        lat[i], lat[j], lon[i], lon[j]
+                    ),
+                    places=6,
+                )
+        np.testing.assert_allclose(
+            preprocessing_functions.haversine(lat[0], lat, lon[0], lon), result[0]
+        )
+
+    def test_station_index(self):
+        """Test radius and nearest queries against brute force distances."""
+        rng = np.random.default_rng(0)
+        lat = rng.uniform(45.5, 47, 200)
+        lon = rng.uniform(-123, -121, 200)
+        stations = [f"S{i}" for i in range(200)]
+        index = preprocessing_functions.StationIndex(stations, lat, lon)
+        dist = preprocessing_functions.haversine(lat[0], lat, lon[0], lon)
+
+        within = index.within("S0", 20)
+        self.assertEqual(set(within.index), set(np.array(stations)[dist <= 20]))
+        self.assertTrue(within.is_monotonic_increasing)
+
+        nearest = index.nearest((lat[0], lon[0]), k=5)
+        np.testing.assert_allclose(nearest.values, np.sort(dist)[:5])
+        self.assertEqual(nearest.index[0], "S0")
+        self.assertEqual(len(index.distances("S0")), 200)
+
+        with self.assertRaises(KeyError):
+            index.within("XXX", 1)
+
+    def test_station_index_from_frame(self):
+        """Test that duplicated stations are only indexed once."""
+        df_sta = pd.DataFrame(
+            {
+                "Station": ["A", "B", "A"],
+                "latitude": [46.2, 46.3, 46.2],
+                "longitude": [-122.2, -122.2, -122.2],
+            }
+        )
+
+        index = preprocessing_functions.StationIndex.from_frame(df_sta)
+
+        self.assertEqual(len(index), 2)
+        self.assertAlmostEqual(index.nearest("A", k=2)["B"], 11.119, places=2)
+
+        # k is clamped to the number of stations and has to be positive
+        self.assertListEqual(list(index.nearest("A", k=10).index), ["A", "B"])
+        with self.assertRaises(ValueError):
+            index.nearest("A", k=0)
+
+    # Tests for StationCatalog
+    def _catalog(self):
+        df_sta = pd.DataFrame(
+            {
+                "Station": ["A", "B", "A", "C"],
+                "latitude": [46.0, 46.1, 46.5, 46.2],
+                "longitude": [-122.0, -122.1, -122.5, -122.2],
+                "StartTime": [
+                    "2000-01-01T00:00:00",
+                    "2001-01-01T00:00:00",
+                    "2003-01-01T00:00:00",
+                    "2000-01-01T00:00:00",
+                ],
+                "EndTime": [
+                    "2002-01-01T00:00:00",
+                    "2599-12-31T23:59:59",
+                    "2599-12-31T23:59:59",
+                    "2000-06-01T00:00:00",
+                ],
+            }
+        )
+        return preprocessing_functions.StationCatalog(df_sta)
+
+    def test_station_catalog_active(self):
+        """Test which stations are active at a time and over a period."""
+        catalog = self._catalog()
+
+        self.assertEqual(len(catalog), 3)
+        self.assertEqual(catalog.active("2000-03-01"), ["A", "C"])
+        self.assertEqual(catalog.active("2002-06-01"), ["B"])
+        self.assertEqual(catalog.active("2400-01-01"), ["A", "B"])
+        self.assertEqual(catalog.active_between("2002-02-01", "2002-12-31"), ["B"])
+        self.assertEqual(
+            catalog.active_between("2000-05-01", "2001-01-01"), ["A", "B", "C"]
+        )
+
+    def test_station_catalog_coordinates(self):
+        """Test the coordinates of the epoch of a station."""
+        catalog = self._catalog()
+
+        self.assertEqual(catalog.coordinates().loc["A", "latitude"], 46.0)
+        coordinates = catalog.coordinates("2004-01-01")
+        self.assertEqual(list(coordinates.index), ["A", "B"])
+        self.assertEqual(coordinates.loc["A", "latitude"], 46.5)
+
+    def test_station_catalog_where_active(self):
+        """Test that cells outside the operating periods become NaN."""
+        catalog = self._catalog()
+        idx = pd.date_range("2000-01-01", "2004-01-01", freq="D")
+        df = pd.DataFrame(1.0, index=idx, columns=["A", "B", "C", "D"])
+
+        result = catalog.where_active(df)
+
+        self.assertTrue(result.loc["2000-01-01":"2002-01-01", "A"].notna().all())
+        self.assertTrue(result.loc["2002-01-02":"2002-12-31", "A"].isna().all())
+        self.assertTrue(result.loc["2003-01-01":, "A"].notna().all())
+        self.assertEqual(result["C"].notna().sum(), 153)
+        self.assertTrue(result["D"].notna().all())
+
+        with self.assertRaises(ValueError):
+            preprocessing_functions.StationCatalog(pd.DataFrame({"Station": ["A"]}))
+
     # Tests for mask_df
     def test_mask_df_A(self):
         """Smoke Test and at the same time also a one-shot test
@@ -149,6 +275,53 @@ class TestPreprocessingFunctions(unittest.TestCase):
         with self.assertRaises(ValueError):
             preprocessing_functions.mask_df(df_test)
 
+    # Tests for mask_frame
+    def test_mask_frame_A(self):
+        """Test that mask_frame gives the same result as applying mask_df to each column."""
+        idx = pd.date_range(
+            datetime.datetime(2000, 1, 1), datetime.datetime(2000, 1, 2), freq="1s"
+        )
+        df_test = pd.DataFrame(1.0, index=idx, columns=["col1", "col2", "col3"])
+        df_test.iloc[4000, 0] = 2
+        df_test.iloc[100, 1] = 5
+        df_test.iloc[20000:20010, 1] = np.nan
+
+        expected = df_test.apply(preprocessing_functions.mask_df, axis=0)
+        masked_df_test, report = preprocessing_functions.mask_frame(df_test)
+
+        np.testing.assert_array_equal(masked_df_test.to_numpy(), expected.to_numpy())
+
+    def test_mask_frame_B(self):
+        """Test the report for a masked and a not masked station."""
+        idx = pd.date_range(
+            datetime.datetime(2000, 1, 1), datetime.datetime(2000, 1, 2), freq="1s"
+        )
+        df_test = pd.DataFrame(0.0, index=idx, columns=["col1", "col2"])
+        df_test.iloc[4000, 0] = 1
+
+        masked_df_test, report = preprocessing_functions.mask_frame(df_test)
+
+        self.assertListEqual(report["masked"].tolist(), [True, False])
+        self.assertEqual(report.loc["col1", "peak"], idx[4000])
+        self.assertEqual(
+            report.loc["col1", "n_masked"], np.isnan(masked_df_test["col1"]).sum()
+        )
+        self.assertNotEqual(report.loc["col2", "message"], "")
+
+    def test_mask_frame_C(self):
+        """Test for pd.Series as input."""
+        idx = pd.date_range(
+            datetime.datetime(2000, 1, 1), datetime.datetime(2000, 1, 2), freq="1s"
+        )
+        with self.assertRaises(TypeError):
+            preprocessing_functions.mask_frame(pd.Series(0, index=idx))
+
+    def test_mask_frame_D(self):
+        """Test for a DataFrame without DatetimeIndex."""
+        df_test = pd.DataFrame(0, index=range(100), columns=["col1", "col2"])
+        with self.assertRaises(ValueError):
+            preprocessing_functions.mask_frame(df_test)
+
     # Tests for norm
     def test_norm_A(self):
         """Smoke Test and at the same time also a one-shot test
@@ -188,3 +361,243 @@ class TestPreprocessingFunctions(unittest.TestCase):
         s = pd.DataFrame(0, index=range(5), columns=["col1", "col2"])
         with self.assertRaises(TypeError):
             preprocessing_functions.norm(s)
+
+    def test_norm_G(self):
+        """Test that NaNs do not poison norm."""
+        s = np.array([np.nan, 1, 2, 3])
+        result = preprocessing_functions.norm(s)
+        np.testing.assert_array_almost_equal(result, np.array([np.nan, 0, 0.5, 1]))
+
+    # Tests for normalize and Normalizer
+    def test_normalize_A(self):
+        """Test that minmax normalize equals norm applied to every column."""
+        df = pd.DataFrame(np.random.rand(100, 3) * 10, columns=["A", "B", "C"])
+        df.iloc[:5, 1] = np.nan
+
+        result = preprocessing_functions.normalize(df)
+
+        pd.testing.assert_frame_equal(
+            result, df.apply(preprocessing_functions.norm, axis=0)
+        )
+
+    def test_normalize_B(self):
+        """Test zscore and robust parameters and reusing them on new data."""
+        df = pd.DataFrame({"A": [1.0, 2, 3, 4, np.nan], "B": [5.0, 5, 5, 5, 5]})
+
+        result, normalizer = preprocessing_functions.normalize(
+            df, "zscore", return_params=True
+        )
+        np.testing.assert_allclose(
+            result["A"].values, (df["A"] - df["A"].mean()) / df["A"].std()
+        )
+        self.assertTrue(result["B"].isna().all())
+
+        normalizer = preprocessing_functions.Normalizer("robust").fit(df)
+        self.assertEqual(normalizer.params.loc["center", "A"], 2.5)
+        self.assertEqual(normalizer.params.loc["scale", "A"], 1.5)
+        new = pd.Series([2.5, 4.0], name="A")
+        pd.testing.assert_series_equal(
+            normalizer.transform(new), pd.Series([0.0, 1.0], name="A")
+        )
+        pd.testing.assert_series_equal(
+            normalizer.inverse_transform(normalizer.transform(new)), new
+        )
+
+        with self.assertRaises(KeyError):
+            normalizer.transform(pd.DataFrame({"X": [1.0]}))
+        with self.assertRaises(ValueError):
+            preprocessing_functions.Normalizer("max")
+        with self.assertRaises(ValueError):
+            preprocessing_functions.Normalizer().transform(df)
+
+    def test_normalize_C(self):
+        """Test rolling normalization."""
+        idx = pd.date_range("2004-01-01", periods=50, freq="D")
+        df = pd.DataFrame({"A": np.arange(50.0), "B": np.random.rand(50)}, index=idx)
+
+        result, params = preprocessing_functions.normalize(
+            df, window="10D", return_params=True
+        )
+
+        rolling = df.rolling("10D", min_periods=1)
+        expected = (df - rolling.min()) / (rolling.max() - rolling.min())
+        pd.testing.assert_frame_equal(result, expected)
+        self.assertTrue((result["A"].iloc[1:] == 1).all())
+        pd.testing.assert_frame_equal(params["center"], rolling.min())
+
+    # Tests for smooth and parallel_apply
+    def test_smooth_A(self):
+        """One-shot test that smooth is a centered rolling median."""
+        idx = pd.date_range("2004-01-01", periods=100, freq="10min")
+        s = pd.Series(np.random.rand(100), index=idx)
+        result = preprocessing_functions.smooth(s, window="1H")
+        pd.testing.assert_series_equal(result, s.rolling("1H", center=True).median())
+
+    def test_parallel_apply_A(self):
+        """Test that parallel_apply gives the same result as DataFrame.apply."""
+        idx = pd.date_range("2004-01-01", periods=500, freq="10min")
+        df_test = pd.DataFrame(
+            np.random.rand(500, 4), index=idx, columns=["s1", "s2", "s3", "s4"]
+        )
+        df_test.iloc[10:20, 1] = np.nan
+        for func in [preprocessing_functions.norm, preprocessing_functions.smooth]:
+            expected = df_test.apply(func, axis=0)
+            result = preprocessing_functions.parallel_apply(
+                df_test, func, max_workers=2
+            )
+            pd.testing.assert_frame_equal(result, expected)
+
+    def test_parallel_apply_B(self):
+        """Test that keyword arguments are passed to the function."""
+        idx = pd.date_range("2004-01-01", periods=100, freq="10min")
+        df_test = pd.DataFrame(np.random.rand(100, 2), index=idx, columns=["s1", "s2"])
+        result = preprocessing_functions.parallel_apply(
+            df_test, preprocessing_functions.smooth, max_workers=2, window="2H"
+        )
+        expected = df_test.rolling("2H", center=True).median()
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_parallel_apply_C(self):
+        """Test for a function which does not return one value per sample."""
+        idx = pd.date_range("2004-01-01", periods=100, freq="10min")
+        df_test = pd.DataFrame(np.random.rand(100, 2), index=idx, columns=["s1", "s2"])
+        with self.assertRaises(ValueError):
+            preprocessing_functions.parallel_apply(df_test, np.sum, max_workers=1)
+
+    def test_parallel_apply_D(self):
+        """Test for pd.Series as input."""
+        with self.assertRaises(TypeError):
+            preprocessing_functions.parallel_apply(
+                pd.Series([1.0, 2.0]), preprocessing_functions.norm
+            )
+
+    # Tests for read_data
+    def _write_csv(self, directory):
+        """Writes a small CSV file with a time column and two stations."""
+        idx = pd.date_range("2004-01-01", periods=20, freq="10min", tz="UTC")
+        df = pd.DataFrame(
+            {"time": idx.astype(str), "sta1": np.arange(20.0), "sta2": np.arange(20)}
+        )
+        path_file = os.path.join(directory, "data.csv")
+        df.to_csv(path_file, index=False)
+        return path_file
+
+    def test_read_data_cache_A(self):
+        """Test that a cached read returns the same data as parsing the CSV file."""
+        with tempfile.TemporaryDirectory() as directory:
+            path_file = self._write_csv(directory)
+            expected = preprocessing_functions.read_data(path_file)
+            first = preprocessing_functions.read_data(path_file, cache=True)
+            second = preprocessing_functions.read_data(path_file, cache=True)
+
+            self.assertTrue(os.path.exists(path_file + ".cache"))
+            pd.testing.assert_frame_equal(first, expected)
+            pd.testing.assert_frame_equal(second, expected)
+
+    def test_read_data_cache_B(self):
+        """Test that the column selection is honored when reading from the cache."""
+        with tempfile.TemporaryDirectory() as directory:
+            path_file = self._write_csv(directory)
+            preprocessing_functions.read_data(path_file, cache=True, cache_dir=directory)
+
+            for cols in ["sta2", 1, ["sta2"], [1, 0]]:
+                expected = preprocessing_functions.read_data(path_file, cols=cols)
+                result = preprocessing_functions.read_data(
+                    path_file, cols=cols, cache=True, cache_dir=directory
+                )
+                if isinstance(expected, pd.Series):
+                    pd.testing.assert_series_equal(result, expected)
+                else:
+                    pd.testing.assert_frame_equal(result, expected)
+
+    def test_read_data_cache_C(self):
+        """Test that the cache is rebuilt after the CSV file changed."""
+        with tempfile.TemporaryDirectory() as directory:
+            path_file = self._write_csv(directory)
+            preprocessing_functions.read_data(path_file, cache=True)
+
+            df = pd.read_csv(path_file)
+            df["sta1"] = -1.0
+            df.to_csv(path_file, index=False)
+            os.utime(path_file, ns=(0, 0))
+
+            result = preprocessing_functions.read_data(path_file, cols="sta1", cache=True)
+            self.assertTrue((result == -1.0).all())
+
+    def test_read_data_D(self):
+        """Test for a float as column selection."""
+        with tempfile.TemporaryDirectory() as directory:
+            path_file = self._write_csv(directory)
+            with self.assertRaises(ValueError):
+                preprocessing_functions.read_data(path_file, cols=1.0)
+
+    # Tests for read_data_chunks
+    def _write_long_csv(self, directory):
+        """Writes a CSV file with daily values spanning three years."""
+        idx = pd.date_range("2004-01-01", "2006-12-31", freq="D")
+        df = pd.DataFrame(
+            {
+                "time": idx.astype(str),
+                "sta1": np.arange(len(idx), dtype=float),
+                "sta2": -np.arange(len(idx), dtype=float),
+            }
+        )
+        path_file = os.path.join(directory, "long.csv")
+        df.to_csv(path_file, index=False)
+        return path_file
+
+    def test_read_data_chunks_A(self):
+        """Test that the concatenated chunks equal the output of read_data."""
+        with tempfile.TemporaryDirectory() as directory:
+            path_file = self._write_long_csv(directory)
+            expected = preprocessing_functions.read_data(path_file, cols=["sta2"])
+            chunks = list(
+                preprocessing_functions.read_data_chunks(
+                    path_file, cols=["sta2"], chunksize=100
+                )
+            )
+
+            self.assertTrue(all(len(chunk) <= 100 for chunk in chunks))
+            pd.testing.assert_frame_equal(pd.concat(chunks), expected)
+
+    def test_read_data_chunks_B(self):
+        """Test that one DataFrame per year is yielded, with and without cache."""
+        with tempfile.TemporaryDirectory() as directory:
+            path_file = self._write_long_csv(directory)
+            for cache in [False, True]:
+                if cache:
+                    preprocessing_functions.read_data(path_file, cache=True)
+                chunks = list(
+                    preprocessing_functions.read_data_chunks(
+                        path_file, cols="sta1", chunksize=50, group_by="year"
+                    )
+                )
+                self.assertEqual(
+                    [chunk.index.year.unique().tolist() for chunk in chunks],
+                    [[2004], [2005], [2006]],
+                )
+                self.assertIsInstance(chunks[0], pd.Series)
+
+    def test_read_data_chunks_C(self):
+        """Test that only the requested time window is returned, with and without cache."""
+        with tempfile.TemporaryDirectory() as directory:
+            path_file = self._write_long_csv(directory)
+            expected = preprocessing_functions.read_data(path_file).loc[
+                "2005-03-01":"2005-06-30"
+            ]
+            for cache in [False, True]:
+                if cache:
+                    preprocessing_functions.read_data(path_file, cache=True)
+                chunks = preprocessing_functions.read_data_chunks(
+                    path_file, chunksize=64, start="2005-03-01", end="2005-06-30"
+                )
+                pd.testing.assert_frame_equal(pd.concat(list(chunks)), expected)
+
+    def test_read_data_chunks_D(self):
+        """Test for an invalid group_by."""
+        with tempfile.TemporaryDirectory() as directory:
+            path_file = self._write_long_csv(directory)
+            with self.assertRaises(ValueError):
+                list(
+                    preprocessing_functions.read_data_chunks(path_file, group_by="week")
+                )
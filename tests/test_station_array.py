@@ -0,0 +1,68 @@
+"""
+Test file for the station_array.py
+"""
+import unittest
+import sys
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+# file directory manipulation - relative import
+current_directory = os.getcwd()
+# Go back one folder level
+parent_directory = os.path.abspath(os.path.join(current_directory, os.pardir))
+sys.path.insert(0, parent_directory)
+from ..mtsthelens.station_array import StationArray
+
+
+# Define a class in which the tests will run
+class Test_StationArray(unittest.TestCase):
+    """This class contains all test for the StationArray class"""
+
+    def setUp(self):
+        dates = pd.date_range(start="2004-01-01", periods=200, freq="10min")
+        self.df = pd.DataFrame(
+            {
+                "Station1": np.random.rand(len(dates)),
+                "Station2": np.random.rand(len(dates)),
+            },
+            index=dates,
+        )
+        self.df.iloc[10:20, 1] = np.nan
+
+    def test_roundtrip_memory(self):
+        """Smoke Test and one-shot test of an in memory StationArray."""
+        array = StationArray.from_frame(self.df)
+        self.assertIsNone(array.path)
+        self.assertEqual(array.shape, self.df.shape)
+        pd.testing.assert_frame_equal(array.to_frame(), self.df, check_freq=False)
+
+    def test_roundtrip_memmap(self):
+        """Test that a StationArray stored on disk can be opened again."""
+        with tempfile.TemporaryDirectory() as directory:
+            StationArray.from_frame(self.df, os.path.join(directory, "a"))
+            array = StationArray.open(os.path.join(directory, "a"))
+            self.assertIsInstance(array.values, np.memmap)
+            self.assertTrue(array.values.flags["F_CONTIGUOUS"])
+            pd.testing.assert_frame_equal(array.to_frame(), self.df, check_freq=False)
+
+    def test_float32(self):
+        """Test that float32 values are supported."""
+        array = StationArray.from_frame(self.df, dtype=np.float32)
+        self.assertEqual(array.dtype, np.float32)
+
+    def test_invalid_dtype(self):
+        """Test for an integer dtype."""
+        with self.assertRaises(ValueError):
+            StationArray.empty(self.df.index, self.df.columns, dtype=np.int64)
+
+    def test_shape_mismatch(self):
+        """Test for values which do not match the time axis."""
+        with self.assertRaises(ValueError):
+            StationArray(np.zeros((3, 2)), self.df.index, self.df.columns)
+
+    def test_non_dataframe(self):
+        """Test for a Series as input."""
+        with self.assertRaises(TypeError):
+            StationArray.from_frame(self.df["Station1"])